@@ -1 +1,2 @@
 from .main import Client
+from .retry import AlidnsError, CircuitOpenError, RetryPolicy, CircuitBreaker
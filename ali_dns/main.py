@@ -1,117 +1,397 @@
+import collections
 import json
 import logging
-import os
+import threading
+import time
+import typing
 
-from alibabacloud_alidns20150109 import models as alidns_20150109_models
-from alibabacloud_alidns20150109.client import Client as Alidns20150109Client
-from alibabacloud_tea_openapi import models as open_api_models
-from alibabacloud_tea_util import models as util_models
+from .retry import AlidnsError, CircuitBreaker, RetryPolicy, classify, error_code
+
+# The Alibaba Cloud SDK is imported on first use, it is slow to import.
+if typing.TYPE_CHECKING:
+    from alibabacloud_alidns20150109.client import Client as Alidns20150109Client
+    from alibabacloud_alidns20150109.models import DescribeDomainRecordsResponseBodyDomainRecordsRecord as Record
 
 LANG = 'zh'
+DEFAULT_ENDPOINT = 'alidns.cn-beijing.aliyuncs.com'
+DEFAULT_PROTOCOL = 'https'
+# Milliseconds
+DEFAULT_CONNECT_TIMEOUT = 5000
+DEFAULT_READ_TIMEOUT = 10000
+# Largest page size DescribeDomainRecords accepts
+MAX_PAGE_SIZE = 500
+# Error code of adding a record that exists
+DUPLICATE_CODE = 'DomainRecordDuplicate'
 
 log = logging.getLogger(__name__)
 
 
 class Client:
-    def __init__(self, access_key_id: str, access_key_secret: str):
-        self.client = Client.create_client(access_key_id, access_key_secret)
-        self.runtime = util_models.RuntimeOptions()
+    def __init__(self, access_key_id: str, access_key_secret: str,
+                 connect_timeout: int = DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout: int = DEFAULT_READ_TIMEOUT,
+                 endpoint: str = DEFAULT_ENDPOINT,
+                 protocol: str = DEFAULT_PROTOCOL,
+                 limiter=None,
+                 retry: typing.Optional[RetryPolicy] = None,
+                 breaker: typing.Optional[CircuitBreaker] = None):
+        """
+        One Client is meant to be shared by the whole process, so the underlying
+        keep-alive connections are reused by every record operation. The Tea core keeps one
+        pooled session per endpoint for the process, its pool size is not configurable.
+        Failed calls raise AlidnsError, transient failures are retried first.
+        @param limiter: optional, every API call takes a token with limiter.acquire(),
+                        and a throttled one holds the others with limiter.pause(seconds)
+        """
+        from alibabacloud_tea_util import models as util_models
+
+        self.client = Client.create_client(access_key_id, access_key_secret,
+                                           connect_timeout, read_timeout, endpoint, protocol)
+        self.runtime = util_models.RuntimeOptions(
+            autoretry=False,
+            keep_alive=True,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout)
+
+        # Record index per zone, record type and rr: (domain, type, rr) -> {record id: record}.
+        # Filled by the first lookup and kept current by add/update/delete.
+        self._zones: dict[tuple[str, str, str], dict[str, Record]] = dict()
+        # Record id -> (domain, type, rr), to find the zone of update/delete.
+        self._record_zones: dict[str, tuple[str, str, str]] = dict()
+        self._zone_locks: dict[tuple[str, str, str], threading.Lock] = dict()
+        # Zones whose records are listed at once, not one name at a time, and those of them listed: (domain, type)
+        self._whole_zones: set[str] = set()
+        self._listed_zones: set[tuple[str, str]] = set()
+        self._lock = threading.Lock()
+        # Domain -> authoritative nameserver host names
+        self._nameservers: dict[str, list[str]] = dict()
+        # API calls by action, and errors by action and error code
+        self.calls = collections.Counter[str]()
+        self.errors = collections.Counter[tuple[str, str]]()
+        self.limiter = limiter
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
 
     @staticmethod
-    def create_client(access_key_id: str, access_key_secret: str, ) -> Alidns20150109Client:
+    def create_client(access_key_id: str, access_key_secret: str,
+                      connect_timeout: int = DEFAULT_CONNECT_TIMEOUT,
+                      read_timeout: int = DEFAULT_READ_TIMEOUT,
+                      endpoint: str = DEFAULT_ENDPOINT,
+                      protocol: str = DEFAULT_PROTOCOL) -> 'Alidns20150109Client':
         """
         使用AK&SK初始化账号Client
         @param access_key_id:
         @param access_key_secret:
+        @param connect_timeout: 连接超时，毫秒
+        @param read_timeout: 读取超时，毫秒
+        @param endpoint: 访问的域名
+        @param protocol: http 或 https
         @return: Client
         @throws Exception
         """
+        from alibabacloud_alidns20150109.client import Client as Alidns20150109Client
+        from alibabacloud_tea_openapi import models as open_api_models
+
         log.debug(f"Create client with access key id: {access_key_id[:8]}..."
                   f" access key secret {access_key_secret[:8]}...")
         config = open_api_models.Config(
             # 必填，您的 AccessKey ID,
             access_key_id=access_key_id,
             # 必填，您的 AccessKey Secret,
-            access_key_secret=access_key_secret
+            access_key_secret=access_key_secret,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            protocol=protocol
         )
         # 访问的域名
-        config.endpoint = f'alidns.cn-beijing.aliyuncs.com'
+        config.endpoint = endpoint
         return Alidns20150109Client(config)
 
-    def find_records_by_type(self, domain: str, type_name: str):
-        log.debug(f'Find records domain name: {domain}, type: {type_name}')
-        describe_domain_records_request = alidns_20150109_models.DescribeDomainRecordsRequest(
-            domain_name=domain, lang=LANG, type=type_name)
+    def _call(self, action: str, method, request):
+        """
+        Call one API action with the shared runtime options, counting calls and errors.
+        Throttled and transient failures are retried with backoff until the retries or the deadline run out.
+        @raise AlidnsError: the call failed
+        """
+        deadline = time.monotonic() + self.retry.timeout
+        attempt = 0
+        while True:
+            self.breaker.check(action)
+            if self.limiter is not None:
+                self.limiter.acquire()
+            with self._lock:
+                self.calls[action] += 1
+            try:
+                response = method(request, self.runtime)
+            except Exception as err:
+                code = error_code(err)
+                retryable, throttled = classify(err)
+                with self._lock:
+                    self.errors[(action, code)] += 1
+                # Throttling says the API is up, it does not count towards opening the circuit.
+                if retryable and not throttled:
+                    self.breaker.failure()
+                delay = self.retry.delay(attempt)
+                if not retryable or attempt >= self.retry.retries or time.monotonic() + delay > deadline:
+                    raise AlidnsError(action, code, getattr(err, 'message', None) or str(err), retryable) from err
+            else:
+                self.breaker.success()
+                return response
 
-        try:
-            response = self.client.describe_domain_records_with_options(describe_domain_records_request, self.runtime)
-            log.debug(f'Found {len(response.body.domain_records.record)} records')
-        except Exception as err:
-            log.critical(err)
-            exit(os.EX_SOFTWARE)
-        return response.body.domain_records.record
+            attempt += 1
+            log.warning(f'{action} failed ({code}), retry {attempt} in {delay:.1f} s')
+            if throttled and self.limiter is not None:
+                # The other workers share the quota, hold them too.
+                self.limiter.pause(delay)
+            else:
+                time.sleep(delay)
+
+    def find_records_by_type(self, domain: str, type_name: str, rr: typing.Optional[str] = None) \
+            -> typing.Iterator['Record']:
+        """
+        Iterate the records of a zone, filtered by type and, if given, by rr on the server side.
+        Pages are requested lazily while the caller consumes the iterator.
+        """
+        from alibabacloud_alidns20150109 import models as alidns_20150109_models
+
+        log.debug(f'Find records domain name: {domain}, type: {type_name}, rr: {rr}')
+        page_number = 1
+        seen = 0
+        while True:
+            describe_domain_records_request = alidns_20150109_models.DescribeDomainRecordsRequest(
+                domain_name=domain, lang=LANG, type=type_name, rrkey_word=rr,
+                page_number=page_number, page_size=MAX_PAGE_SIZE)
+
+            response = self._call('DescribeDomainRecords', self.client.describe_domain_records_with_options,
+                                  describe_domain_records_request)
+            records = response.body.domain_records.record
+            seen += len(records)
+            log.debug(f'Found {len(records)} records on page {page_number}, total {response.body.total_count}')
+
+            for record in records:
+                # RRKeyWord is a fuzzy match.
+                if rr is None or record.rr == rr:
+                    yield record
+
+            if len(records) == 0 or seen >= response.body.total_count:
+                return
+            page_number += 1
+
+    def get_nameservers(self, domain: str) -> list[str]:
+        """Authoritative nameservers Alidns assigned to the domain."""
+        from alibabacloud_alidns20150109 import models as alidns_20150109_models
+
+        with self._lock:
+            if domain in self._nameservers:
+                return self._nameservers[domain]
+
+        log.debug(f'Get nameservers, domain name: {domain}')
+        describe_domain_info_request = alidns_20150109_models.DescribeDomainInfoRequest(
+            domain_name=domain, lang=LANG)
+        response = self._call('DescribeDomainInfo', self.client.describe_domain_info_with_options,
+                              describe_domain_info_request)
+        nameservers = list(response.body.dns_servers.dns_server)
+        log.debug(f'Nameservers of {domain}: {nameservers}')
+        with self._lock:
+            self._nameservers[domain] = nameservers
+        return nameservers
 
     def add_record(self, domain: str, rr: str, type_name: str, value: str, ttl: int) -> str:
+        from alibabacloud_alidns20150109 import models as alidns_20150109_models
+
         log.info(f'Add record, domain name: {domain}, rr {rr}, type: {type_name}, value: {value[:8]}..., ttl: {ttl}')
         add_domain_record_request = alidns_20150109_models.AddDomainRecordRequest(
             domain_name=domain, rr=rr, type=type_name, lang=LANG, value=value, ttl=ttl)
 
         try:
-            response = self.client.add_domain_record_with_options(add_domain_record_request, self.runtime)
-        except Exception as err:
-            log.critical(err)
-            exit(os.EX_SOFTWARE)
-        log.debug(f'Add done, record id: {response.body.record_id}')
-        return response.body.record_id
+            response = self._call('AddDomainRecord', self.client.add_domain_record_with_options,
+                                  add_domain_record_request)
+        except AlidnsError as err:
+            # The record may or may not have changed, list it again next time.
+            self.invalidate(domain, type_name, rr)
+            if err.code != DUPLICATE_CODE:
+                raise
+            # An attempt that timed out may have added it after all.
+            record_id = next((r.record_id for r in self.zone_records(domain, rr, type_name) if r.value == value), None)
+            if record_id is None:
+                raise
+            log.debug(f'Record exists, record id: {record_id}')
+            return record_id
+        record_id = response.body.record_id
+        log.debug(f'Add done, record id: {record_id}')
+        self._cache_put(alidns_20150109_models.DescribeDomainRecordsResponseBodyDomainRecordsRecord(
+            domain_name=domain, record_id=record_id, rr=rr, type=type_name, value=value, ttl=ttl))
+        return record_id
 
     def delete_record(self, record_id: str) -> None:
+        from alibabacloud_alidns20150109 import models as alidns_20150109_models
+
         log.info(f'Delete record, record id: {record_id}')
 
         delete_domain_record_request = alidns_20150109_models.DeleteDomainRecordRequest(
             record_id=record_id, lang=LANG)
 
         try:
-            self.client.delete_domain_record_with_options(delete_domain_record_request, self.runtime)
-        except Exception as err:
-            log.critical(err)
-            exit(os.EX_SOFTWARE)
+            self._call('DeleteDomainRecord', self.client.delete_domain_record_with_options,
+                       delete_domain_record_request)
+        except AlidnsError:
+            # The record may or may not have changed, list it again next time.
+            self._invalidate_record(record_id)
+            raise
+        self._cache_pop(record_id)
 
     def update_record(self, record_id: str, rr: str, type_name: str, value: str, ttl: int) -> None:
+        from alibabacloud_alidns20150109 import models as alidns_20150109_models
+
         log.info(f'Update record, rr {rr}, type: {type_name}, value: {value[:8]}..., ttl: {ttl}')
         update_domain_record_request = alidns_20150109_models.UpdateDomainRecordRequest(
             lang=LANG, record_id=record_id, rr=rr, type=type_name, value=value, ttl=ttl)
 
         try:
-            self.client.update_domain_record_with_options(update_domain_record_request, self.runtime)
-        except Exception as err:
-            log.critical(err)
-            exit(os.EX_SOFTWARE)
+            self._call('UpdateDomainRecord', self.client.update_domain_record_with_options,
+                       update_domain_record_request)
+        except AlidnsError:
+            # The record may or may not have changed, list it again next time.
+            self._invalidate_record(record_id)
+            raise
+        with self._lock:
+            key = self._record_zones.get(record_id)
+        if key is not None:
+            self._cache_pop(record_id)
+            self._cache_put(alidns_20150109_models.DescribeDomainRecordsResponseBodyDomainRecordsRecord(
+                domain_name=key[0], record_id=record_id, rr=rr, type=type_name, value=value, ttl=ttl))
+
+    def _zone_lock(self, key: tuple[str, str, str]) -> threading.Lock:
+        with self._lock:
+            return self._zone_locks.setdefault(key, threading.Lock())
+
+    def _cache_put(self, record: 'Record'):
+        key = (record.domain_name, record.type, record.rr)
+        with self._lock:
+            if key in self._zones:
+                self._zones[key][record.record_id] = record
+                self._record_zones[record.record_id] = key
+
+    def _cache_pop(self, record_id: str):
+        with self._lock:
+            key = self._record_zones.pop(record_id, None)
+            if key is not None:
+                self._zones[key].pop(record_id, None)
+
+    def _invalidate_record(self, record_id: str):
+        with self._lock:
+            key = self._record_zones.get(record_id)
+        if key is not None:
+            self.invalidate(*key)
+
+    def invalidate(self, domain: str, type_name: str, rr: str):
+        """Drop the cached records of a name, the next lookup lists them again."""
+        key = (domain, type_name, rr)
+        with self._lock:
+            # Names missing from a listed zone are known to be empty, until it is listed again.
+            self._listed_zones.discard((domain, type_name))
+            records = self._zones.pop(key, None)
+            if records is not None:
+                log.debug(f'Invalidate record cache, domain: {domain}, type: {type_name}, rr: {rr}')
+                for record_id in records:
+                    self._record_zones.pop(record_id, None)
+
+    def clear_cache(self):
+        """Forget the cached records and nameservers, a long-lived client calls it before each run."""
+        with self._lock:
+            self._zones.clear()
+            self._record_zones.clear()
+            self._zone_locks.clear()
+            self._whole_zones.clear()
+            self._listed_zones.clear()
+            self._nameservers.clear()
+
+    def index_whole_zone(self, domain: str):
+        """
+        List the records of domain at once, instead of one name at a time. For a zone that holds
+        the challenges of many domains, one listing serves all of them.
+        """
+        with self._lock:
+            self._whole_zones.add(domain)
+
+    def _list_whole_zone(self, domain: str, type_name: str):
+        with self._zone_lock((domain, type_name, '')):
+            with self._lock:
+                if (domain, type_name) in self._listed_zones:
+                    return
+            by_rr = dict[str, dict[str, 'Record']]()
+            for r in self.find_records_by_type(domain, type_name):
+                by_rr.setdefault(r.rr, dict())[r.record_id] = r
+            with self._lock:
+                for rr, records in by_rr.items():
+                    self._zones[(domain, type_name, rr)] = records
+                    for record_id in records:
+                        self._record_zones[record_id] = (domain, type_name, rr)
+                self._listed_zones.add((domain, type_name))
+
+    def zone_records(self, domain: str, rr: str, type_name: str) -> list['Record']:
+        key = (domain, type_name, rr)
+        with self._lock:
+            whole_zone = domain in self._whole_zones
+        if whole_zone:
+            self._list_whole_zone(domain, type_name)
+        with self._zone_lock(key):
+            with self._lock:
+                records = self._zones.get(key)
+                if records is not None:
+                    return list(records.values())
+                if (domain, type_name) in self._listed_zones:
+                    self._zones[key] = dict()
+                    return []
+
+            records = {r.record_id: r for r in self.find_records_by_type(domain, type_name, rr)}
+            with self._lock:
+                self._zones[key] = records
+                for record_id in records:
+                    self._record_zones[record_id] = key
+            return list(records.values())
 
     def find_challenge_records(self, domain: str, rr: str, type_name: str):
         log.info(f'Find record, domain: {domain}, type: {type_name}')
-        all_records = self.find_records_by_type(domain, type_name)
-        result = list[alidns_20150109_models.DescribeDomainRecordsResponseBodyDomainRecordsRecord]()
-        print_result = list()
-        for record in all_records:
-            if record.rr == rr:
-                result.append(record)
-                print_result.append(record.to_map())
-        log.debug(f'Found record: {json.dumps(print_result, indent=4)}')
+        result = self.zone_records(domain, rr, type_name)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(f'Found record: {json.dumps([r.to_map() for r in result], indent=4)}')
         return result
 
-    def set_challenge_dns(self, domain: str, rr: str, type_name: str, value: str, ttl: int) -> str:
+    def set_challenge_dns(self, domain: str, rr: str, type_name: str, values: list[str], ttl: int) -> list[str]:
+        """
+        Make the challenge name hold exactly the given values, one record per value.
+        Existing records are reused, stale ones are updated to a missing value or deleted.
+        @return: record ids of the values
+        """
         records = self.find_challenge_records(domain, rr, type_name)
-        if len(records) == 0:
-            record_id = self.add_record(domain, rr, type_name, value, ttl)
-        else:
-            for r in records[1:]:
-                self.delete_record(r.record_id)
+        missing = list(dict.fromkeys(values))
+        record_ids = list[str]()
+        stale = list['Record']()
+        for r in records:
+            if r.value in missing:
+                missing.remove(r.value)
+                record_ids.append(r.record_id)
+            else:
+                stale.append(r)
 
-            record_id = records[0].record_id
-            if records[0].value != value:
-                self.update_record(record_id, rr, type_name, value, ttl)
+        for value in missing:
+            if len(stale) != 0:
+                r = stale.pop(0)
+                self.update_record(r.record_id, rr, type_name, value, ttl)
+                record_ids.append(r.record_id)
+            else:
+                record_ids.append(self.add_record(domain, rr, type_name, value, ttl))
 
-        return record_id
+        for r in stale:
+            self.delete_record(r.record_id)
+
+        return record_ids
 
-    def clean_challenge_dns(self, record_id: str):
-        self.delete_record(record_id)
+    def clean_challenge_dns(self, record_ids: list[str]):
+        """Delete the challenge records, a record left behind is only logged, the next set_challenge_dns reuses it."""
+        for record_id in record_ids:
+            try:
+                self.delete_record(record_id)
+            except AlidnsError as err:
+                log.warning(f'Delete record {record_id} fail, left behind: {err}')
@@ -0,0 +1,323 @@
+import logging
+import random
+import socket
+import struct
+import time
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+DNS_PORT = 53
+TYPE_CNAME = 5
+TYPE_TXT = 16
+TYPE_OPT = 41
+CLASS_IN = 1
+RCODE_NXDOMAIN = 3
+FLAG_TC = 0x0200
+FLAG_RD = 0x0100
+RESOLV_CONF = '/etc/resolv.conf'
+# Follow at most this many CNAMEs, as resolvers do
+MAX_CNAME_CHAIN = 8
+# EDNS0 UDP payload size, big enough for a handful of TXT values
+UDP_PAYLOAD_SIZE = 4096
+
+DEFAULT_QUERY_TIMEOUT = 3
+
+Server = tuple[str, int]
+# The addresses of one nameserver host
+Nameserver = list[Server]
+
+
+class DNSError(Exception):
+    pass
+
+
+def parse_server(text: str) -> Server:
+    """Parse 'host' or 'host:port', IPv6 addresses as '[::1]:53'."""
+    text = text.strip()
+    if text.startswith('['):
+        host, _, port = text[1:].partition(']')
+        port = port.lstrip(':')
+    elif text.count(':') == 1:
+        host, port = text.split(':')
+    else:
+        host, port = text, ''
+    return host, int(port) if port else DNS_PORT
+
+
+def resolve_nameservers(hosts: typing.Iterable[str]) -> list[Nameserver]:
+    """
+    Resolve nameserver host names to their IPv4 and IPv6 addresses, skipping the hosts that do not resolve.
+    Only families the system has an address of are kept, an IPv4-only system gets no IPv6 addresses.
+    """
+    nameservers = list[Nameserver]()
+    for host in hosts:
+        host, port = parse_server(host)
+        try:
+            infos = socket.getaddrinfo(host, port, socket.AF_UNSPEC, socket.SOCK_DGRAM, 0, socket.AI_ADDRCONFIG)
+        except socket.gaierror as err:
+            log.warning(f'Resolve nameserver {host} fail: {err}')
+            continue
+        nameservers.append(list(dict.fromkeys((info[4][0], port) for info in infos)))
+    return nameservers
+
+
+def resolve_servers(hosts: typing.Iterable[str]) -> list[Server]:
+    """The addresses of all nameserver hosts, in order."""
+    return list(dict.fromkeys(server for nameserver in resolve_nameservers(hosts) for server in nameserver))
+
+
+def _encode_name(name: str) -> bytes:
+    data = bytes()
+    for label in name.rstrip('.').split('.'):
+        raw = label.encode('idna')
+        data += struct.pack('!B', len(raw)) + raw
+    return data + b'\x00'
+
+
+def _skip_name(data: bytes, offset: int) -> int:
+    while True:
+        if offset >= len(data):
+            raise DNSError('Truncated name')
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            # Compression pointer ends the name.
+            return offset + 2
+        offset += 1
+        if length == 0:
+            return offset
+        offset += length
+
+
+def _read_name(data: bytes, offset: int) -> str:
+    labels = list[str]()
+    for _ in range(len(data)):
+        if offset >= len(data):
+            raise DNSError('Truncated name')
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            offset = struct.unpack('!H', data[offset:offset + 2])[0] & 0x3FFF
+            continue
+        if length == 0:
+            return '.'.join(labels).lower()
+        labels.append(data[offset + 1:offset + 1 + length].decode('ascii', errors='replace'))
+        offset += 1 + length
+    raise DNSError('Name compression loop')
+
+
+def build_query(name: str, qtype: int = TYPE_TXT, recursive: bool = False) -> tuple[int, bytes]:
+    qid = random.getrandbits(16)
+    # No recursion desired when we ask authoritative servers.
+    header = struct.pack('!HHHHHH', qid, FLAG_RD if recursive else 0, 1, 0, 0, 1)
+    question = _encode_name(name) + struct.pack('!HH', qtype, CLASS_IN)
+    opt = b'\x00' + struct.pack('!HHIH', TYPE_OPT, UDP_PAYLOAD_SIZE, 0, 0)
+    return qid, header + question + opt
+
+
+def _parse_answers(data: bytes, qid: int) -> typing.Optional[list[tuple[int, int, int]]]:
+    """The type, offset and length of the data of every answer record, None when the response is truncated."""
+    if len(data) < 12:
+        raise DNSError('Truncated header')
+    rid, flags, qdcount, ancount, _, _ = struct.unpack('!HHHHHH', data[:12])
+    if rid != qid:
+        raise DNSError('Mismatched response id')
+    if flags & FLAG_TC:
+        return None
+    rcode = flags & 0x000F
+    if rcode == RCODE_NXDOMAIN:
+        return []
+    if rcode != 0:
+        raise DNSError(f'Response code {rcode}')
+
+    offset = 12
+    for _ in range(qdcount):
+        offset = _skip_name(data, offset) + 4
+
+    answers = list[tuple[int, int, int]]()
+    for _ in range(ancount):
+        offset = _skip_name(data, offset)
+        rtype, _, _, rdlength = struct.unpack('!HHIH', data[offset:offset + 10])
+        offset += 10
+        answers.append((rtype, offset, rdlength))
+        offset += rdlength
+    return answers
+
+
+def parse_txt_response(data: bytes, qid: int) -> typing.Optional[list[str]]:
+    """Return the TXT values of the answer, None when the response is truncated."""
+    answers = _parse_answers(data, qid)
+    if answers is None:
+        return None
+    values = list[str]()
+    for rtype, offset, rdlength in answers:
+        if rtype != TYPE_TXT:
+            continue
+        rdata = data[offset:offset + rdlength]
+        # A TXT value is one or more length-prefixed strings.
+        i, parts = 0, list[bytes]()
+        while i < len(rdata):
+            length = rdata[i]
+            parts.append(rdata[i + 1:i + 1 + length])
+            i += 1 + length
+        values.append(b''.join(parts).decode('utf-8', errors='replace'))
+    return values
+
+
+def parse_cname_response(data: bytes, qid: int) -> typing.Optional[list[str]]:
+    """Return the CNAME targets of the answer, None when the response is truncated."""
+    answers = _parse_answers(data, qid)
+    if answers is None:
+        return None
+    return [_read_name(data, offset) for rtype, offset, _ in answers if rtype == TYPE_CNAME]
+
+
+def _query_tcp(query: bytes, server: Server, timeout: float) -> bytes:
+    with socket.create_connection(server, timeout=timeout) as sock:
+        sock.sendall(struct.pack('!H', len(query)) + query)
+        data = bytes()
+        while len(data) < 2 or len(data) < 2 + struct.unpack('!H', data[:2])[0]:
+            chunk = sock.recv(65535)
+            if len(chunk) == 0:
+                raise DNSError('Connection closed')
+            data += chunk
+        return data[2:]
+
+
+def _query(name: str, qtype: int, server: Server, timeout: float,
+           parse: typing.Callable[[bytes, int], typing.Optional[list[str]]], recursive: bool = False) -> list[str]:
+    """Query one server over UDP, and over TCP when the answer is truncated."""
+    qid, query = build_query(name, qtype, recursive)
+    family = socket.AF_INET6 if ':' in server[0] else socket.AF_INET
+    with socket.socket(family, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        sock.sendto(query, server)
+        while True:
+            data, addr = sock.recvfrom(65535)
+            if addr[:2] == server:
+                break
+
+    values = parse(data, qid)
+    if values is None:
+        values = parse(_query_tcp(query, server, timeout), qid)
+    return values
+
+
+def query_txt(name: str, server: Server, timeout: float = DEFAULT_QUERY_TIMEOUT) -> list[str]:
+    """Query the TXT values of name from one server."""
+    return _query(name, TYPE_TXT, server, timeout, parse_txt_response)
+
+
+def query_cname(name: str, server: Server, timeout: float = DEFAULT_QUERY_TIMEOUT,
+                recursive: bool = False) -> typing.Optional[str]:
+    """Query the CNAME target of name from one server, None when it has none."""
+    targets = _query(name, TYPE_CNAME, server, timeout, parse_cname_response, recursive)
+    return targets[0] if len(targets) != 0 else None
+
+
+def system_nameservers() -> list[str]:
+    """The recursive nameservers of the system, from resolv.conf."""
+    try:
+        with open(RESOLV_CONF) as f:
+            lines = f.read().splitlines()
+    except OSError as err:
+        log.warning(f'Read {RESOLV_CONF} fail: {err}')
+        return []
+    return [line.split()[1] for line in lines if len(line.split()) >= 2 and line.split()[0] == 'nameserver']
+
+
+def follow_cname(name: str, zone: str, servers: list[Server]) -> typing.Optional[str]:
+    """
+    Follow the CNAMEs of name through recursive servers, until a target in zone.
+    None when the chain does not lead into zone, or no server answers.
+    """
+    zone = zone.rstrip('.').lower()
+    for _ in range(MAX_CNAME_CHAIN):
+        for server in servers:
+            try:
+                target = query_cname(name, server, recursive=True)
+                break
+            except (OSError, DNSError) as err:
+                log.debug(f'Query {name} CNAME from {server[0]}:{server[1]} fail: {err!r}')
+        else:
+            return None
+        if target is None:
+            return None
+        if target == zone or target.endswith(f'.{zone}'):
+            return target
+        name = target
+    return None
+
+
+def pending_servers(name: str, values: typing.Iterable[str], nameservers: list[Nameserver],
+                    timeout: float = DEFAULT_QUERY_TIMEOUT) -> list[Nameserver]:
+    """
+    Query every address of the nameservers in parallel, return the nameservers none of whose addresses
+    answers all the values yet. A nameserver is done once one address has them, the others may be unreachable.
+    """
+    expected = set(values)
+    servers = list(dict.fromkeys(server for nameserver in nameservers for server in nameserver))
+
+    def check(server: Server) -> bool:
+        try:
+            answer = query_txt(name, server, timeout)
+        except (OSError, DNSError) as err:
+            log.debug(f'Query {name} TXT from {server[0]}:{server[1]} fail: {err!r}')
+            return False
+        return expected.issubset(answer)
+
+    with ThreadPoolExecutor(max_workers=max(len(servers), 1)) as executor:
+        done = {server for server, ok in zip(servers, executor.map(check, servers)) if ok}
+    return [nameserver for nameserver in nameservers if done.isdisjoint(nameserver)]
+
+
+def wait_txt_propagation(name: str, values: typing.Iterable[str], nameservers: list[Nameserver],
+                         timeout: float, interval: float, max_interval: float) -> None:
+    """
+    Wait until every nameserver answers all the expected TXT values for name, on any of its addresses.
+    Nameservers are queried in parallel, the interval between rounds grows up to max_interval.
+    @raise TimeoutError: not every nameserver has the values when the deadline passes
+    """
+    values = list(values)
+    pending = list(nameservers)
+    deadline = time.monotonic() + timeout
+
+    log.info(f'Wait for {name} TXT on {len(nameservers)} nameservers')
+    while True:
+        query_timeout = min(DEFAULT_QUERY_TIMEOUT, max(deadline - time.monotonic(), 0.1))
+        pending = pending_servers(name, values, pending, query_timeout)
+        if len(pending) == 0:
+            log.info(f'{name} TXT propagated')
+            return
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f'{name} TXT not propagated to {[n[0][0] for n in pending]} in {timeout}s')
+        log.debug(f'{name} TXT pending on {len(pending)} nameservers, retry in {interval:.1f}s')
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 1.5, max_interval)
+
+
+async def async_wait_txt_propagation(name: str, values: typing.Iterable[str], nameservers: list[Nameserver],
+                                     timeout: float, interval: float, max_interval: float) -> None:
+    """Same as wait_txt_propagation, but waits between rounds without holding a thread."""
+    import asyncio
+
+    values = list(values)
+    pending = list(nameservers)
+    deadline = time.monotonic() + timeout
+
+    log.info(f'Wait for {name} TXT on {len(nameservers)} nameservers')
+    while True:
+        query_timeout = min(DEFAULT_QUERY_TIMEOUT, max(deadline - time.monotonic(), 0.1))
+        pending = await asyncio.to_thread(pending_servers, name, values, pending, query_timeout)
+        if len(pending) == 0:
+            log.info(f'{name} TXT propagated')
+            return
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f'{name} TXT not propagated to {[n[0][0] for n in pending]} in {timeout}s')
+        log.debug(f'{name} TXT pending on {len(pending)} nameservers, retry in {interval:.1f}s')
+        await asyncio.sleep(min(interval, remaining))
+        interval = min(interval * 1.5, max_interval)
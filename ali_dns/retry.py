@@ -0,0 +1,109 @@
+import logging
+import random
+import threading
+import time
+import typing
+
+# Seconds
+DEFAULT_RETRIES = 4
+DEFAULT_BACKOFF = 0.5
+DEFAULT_MAX_BACKOFF = 10.0
+DEFAULT_CALL_TIMEOUT = 30.0
+# Consecutive failures that open the circuit, and how long it stays open, in seconds
+DEFAULT_BREAKER_THRESHOLD = 5
+DEFAULT_BREAKER_COOLDOWN = 30.0
+
+# Error codes Alidns throttles with: Throttling, Throttling.User, Throttling.Api, ...
+THROTTLING_CODE = 'Throttling'
+# Error codes of transient server side failures
+RETRYABLE_CODES = {'ServiceUnavailable', 'InternalError', 'UnknownError', 'ServiceTimeout'}
+
+log = logging.getLogger(__name__)
+
+
+class AlidnsError(Exception):
+    """An Alidns API call failed, code is the Alidns error code, or the exception class name."""
+
+    def __init__(self, action: str, code: str, message: str, retryable: bool = False):
+        super().__init__(f'{action} failed: {code} {message}')
+        self.action = action
+        self.code = code
+        self.retryable = retryable
+
+
+class CircuitOpenError(AlidnsError):
+    """The API failed too many times in a row, calls fail fast until the cooldown passes."""
+
+
+def error_code(err: Exception) -> str:
+    # The SDK exceptions carry the Alidns error code, e.g. Throttling.User.
+    return str(getattr(err, 'code', None) or type(err).__name__)
+
+
+def classify(err: Exception) -> tuple[bool, bool]:
+    """Whether the error is worth retrying, and whether it is throttling."""
+    code = getattr(err, 'code', None)
+    if code is not None and str(code).startswith(THROTTLING_CODE):
+        return True, True
+    if code in RETRYABLE_CODES:
+        return True, False
+    status = getattr(err, 'statusCode', None)
+    if isinstance(status, int):
+        return status >= 500, False
+    # No response at all: a timeout or a failed connection, the SDK wraps it with the cause.
+    if code is None and (getattr(err, 'inner_exception', None) is not None or isinstance(err, OSError)):
+        return True, False
+    return False, False
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, bounded by a deadline over all attempts of one call."""
+
+    def __init__(self, retries: int = DEFAULT_RETRIES, backoff: float = DEFAULT_BACKOFF,
+                 max_backoff: float = DEFAULT_MAX_BACKOFF, timeout: float = DEFAULT_CALL_TIMEOUT):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    Opens after threshold consecutive failures, and fails calls fast while open.
+    After cooldown calls go through again, the first result closes or reopens it.
+    A threshold of 0 disables it.
+    """
+
+    def __init__(self, threshold: int = DEFAULT_BREAKER_THRESHOLD, cooldown: float = DEFAULT_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: typing.Optional[float] = None
+        self._lock = threading.Lock()
+
+    def check(self, action: str):
+        """@raise CircuitOpenError: the circuit is open"""
+        with self._lock:
+            if self.opened_at is None or time.monotonic() - self.opened_at >= self.cooldown:
+                return
+        raise CircuitOpenError(action, 'CircuitOpen', f'Alidns failed {self.failures} times in a row,'
+                                                      f' retry after {self.cooldown:g} s')
+
+    def success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                log.info('Alidns API recovered, close circuit')
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.threshold <= 0 or self.failures < self.threshold:
+                return
+            if self.opened_at is None or time.monotonic() - self.opened_at >= self.cooldown:
+                log.error(f'Alidns API failed {self.failures} times in a row, open circuit for {self.cooldown:g} s')
+                self.opened_at = time.monotonic()
@@ -1 +1,2 @@
-from .main import main
+from .main import main, status
+from .daemon import daemon
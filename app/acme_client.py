@@ -1,41 +1,132 @@
+import email.utils
 import json
 import logging
-import os
+import threading
+import time
 import typing
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from pathlib import Path
 
-import OpenSSL
 import josepy as jose
 from acme import challenges
 from acme import client
 from acme import crypto_util
+from acme import errors
 from acme import messages
 from acme.messages import RegistrationResource
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.asymmetric import rsa
 
-from ali_dns import Client
-from .config import AppConfig
+from ali_dns import CircuitBreaker, Client, RetryPolicy, resolver
+from .config import AppConfig, CertConfig
+from .inventory import Inventory
+from .keygen import KeyPool, generate_key
+from .metrics import metrics
+from .ratelimit import ACME, ACME_NEW_ORDER, ALIDNS, RateLimiter, TokenBucket, in_flow
+from .renewal_info import RenewalInfo, parse as parse_renewal_info
+from .state_cache import StateCache
 from .consts import *
 
 log = logging.getLogger(__name__)
 
 
-def select_dns01_chl(order):
-    """Extract authorization resource from within order resource."""
+def select_dns01_chls(order):
+    """
+    Extract the authorization and its DNS-01 challenge of every authorization within order resource
+    that is not valid yet. The CA reuses recent valid authorizations, they need no challenge.
+    """
     # Authorization Resource: auth.
     # This object holds the offered challenges by the server and their status.
-    auth_list = order.authorizations
-
-    for auth in auth_list:
+    chls = list()
+    for auth in order.authorizations:
+        if auth.body.status == messages.STATUS_VALID:
+            continue
         # Choosing challenge.
         # auth.body.challenges is a set of ChallengeBody objects.
         for i in auth.body.challenges:
             # Find the supported challenge.
             if isinstance(i.chall, challenges.DNS01):
-                return i
-
-    raise Exception('DNS-01 challenge was not offered by the CA server.')
+                chls.append((auth, i))
+                break
+        else:
+            raise Exception(f'DNS-01 challenge was not offered by the CA server'
+                            f' for {auth.body.identifier.value}.')
+
+    return chls
+
+
+def retry_after(response, default: float) -> float:
+    """Seconds to wait before polling again, from the Retry-After header if the server sent one."""
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return default
+    try:
+        return max(float(int(value)), 0)
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0)
+
+
+class NewOrder(messages.NewOrder):
+    """A new order that names the certificate it replaces, by its renewal info identifier (RFC 9773)."""
+    replaces: typing.Optional[str] = jose.field('replaces', omitempty=True)
+
+
+def challenge_fqdn(zone: str, rr: str) -> str:
+    """The name a challenge record of rr in zone answers on, '@' is the zone itself."""
+    return zone if rr == '@' else f'{rr}.{zone}'
+
+
+def check_deadline(delay: float, deadline: float):
+    if time.monotonic() + delay > deadline:
+        raise errors.TimeoutError('Order deadline exceeded')
+
+
+class RateLimitedNetwork(client.ClientNetwork):
+    """
+    Every request takes a token of the ACME budget, and new orders one of the new order budget too.
+    A rate limited POST pauses the budget for its Retry-After and is retried, unless that is longer
+    than max_wait.
+    """
+
+    def __init__(self, key: jose.JWK, limiter: RateLimiter, max_wait: float, **kwargs):
+        super().__init__(key, **kwargs)
+        self.limiter = limiter
+        self.max_wait = max_wait
+        # Set once the directory is loaded
+        self.new_order_url: typing.Optional[str] = None
+
+    def _bucket(self, method: str, url: str) -> TokenBucket:
+        if method == 'POST' and url == self.new_order_url:
+            return self.limiter[ACME_NEW_ORDER]
+        return self.limiter[ACME]
+
+    def _send_request(self, method: str, url: str, *args, **kwargs):
+        if method == 'POST' and url == self.new_order_url:
+            self.limiter[ACME_NEW_ORDER].acquire()
+        self.limiter[ACME].acquire()
+        response = super()._send_request(method, url, *args, **kwargs)
+        if response.status_code in [429, 503] and 'Retry-After' in response.headers:
+            self._bucket(method, url).pause(retry_after(response, 0))
+        return response
+
+    def post(self, url: str, *args, **kwargs):
+        while True:
+            try:
+                return super().post(url, *args, **kwargs)
+            except messages.Error as err:
+                if err.code != 'rateLimited':
+                    raise
+                wait = self._bucket('POST', url).paused_for()
+                # Without Retry-After there is no telling when the limit resets.
+                if wait <= 0 or wait > self.max_wait:
+                    raise
+                log.warning(f'Rate limited, retry in {wait:.1f} s: {err.detail}')
 
 
 class ACMEClient:
@@ -48,41 +139,332 @@ class ACMEClient:
         self.acc_key: typing.Optional[jose.JWKRSA] = None
 
         self.client: typing.Optional[client.ClientV2] = None
-
-    def new_csr_comp(self, domain_name: str, pkey_pem=None):
+        # Set when the CA rejects the account, the next run loads it again.
+        self.account_stale = False
+        self.state_cache = StateCache(Path(self.config.data_dir).joinpath(ACME_STATE_FILENAME),
+                                      self.config.directory_url)
+
+        # Pre-generated keys for new certificates, set when many are due.
+        self.key_pool: typing.Optional[KeyPool] = None
+        # Records saved certificates and failures, set by the caller.
+        self.inventory: typing.Optional[Inventory] = None
+        # Network and directory for renewal info, which is asked before the account is loaded.
+        self.renewal_info_net: typing.Optional[RateLimitedNetwork] = None
+        self.renewal_info_directory: typing.Optional[messages.Directory] = None
+        # (challenge name, challenge zone) -> the name its CNAME points to, for one run
+        self.delegated = dict[tuple[str, str], str]()
+        self._delegated_lock = threading.Lock()
+
+        # Request budgets, and the Alidns client, are shared by every domain and worker.
+        self.limiter = RateLimiter({
+            ACME: (self.config.acme_rate, self.config.acme_burst),
+            ACME_NEW_ORDER: (self.config.acme_new_order_limit / self.config.acme_new_order_period
+                                       if self.config.acme_new_order_period > 0 else 0,
+                                       self.config.acme_new_order_limit),
+            ALIDNS: (self.config.dns_rate, self.config.dns_burst),
+        })
+        log.debug(f'Rate limits: {list(self.limiter.describe())}')
+        self.dns_client = Client(self.config.access_key_id, self.config.access_key_secret,
+                                 connect_timeout=self.config.dns_connect_timeout,
+                                 read_timeout=self.config.dns_read_timeout,
+                                 endpoint=self.config.dns_endpoint,
+                                 protocol=self.config.dns_protocol,
+                                 limiter=self.limiter[ALIDNS],
+                                 retry=RetryPolicy(self.config.dns_retries, self.config.dns_backoff,
+                                                   self.config.dns_max_backoff, self.config.dns_call_timeout),
+                                 breaker=CircuitBreaker(self.config.dns_breaker_threshold,
+                                                        self.config.dns_breaker_cooldown))
+
+    def new_csr_comp(self, names: list[str], pkey_pem=None):
         """Create certificate signing request."""
         if pkey_pem is None:
             # Create private key.
-            pkey = OpenSSL.crypto.PKey()
-            pkey.generate_key(OpenSSL.crypto.TYPE_RSA, self.config.cert_pkey_bits)
-            pkey_pem = OpenSSL.crypto.dump_privatekey(OpenSSL.crypto.FILETYPE_PEM,
-                                                      pkey)
-        csr_pem = crypto_util.make_csr(pkey_pem, [f'*.{domain_name}', domain_name])
+            if self.key_pool is not None:
+                pkey_pem = self.key_pool.get()
+            else:
+                pkey_pem = generate_key(self.config.cert_key_type, self.config.cert_pkey_bits)
+        csr_pem = crypto_util.make_csr(pkey_pem, names)
         return pkey_pem, csr_pem
 
-    def perform_dns01(self, domain: str, chl, order):
-        """Set up standalone webserver and perform HTTP-01 challenge."""
+    def propagation_servers(self, domain: str) -> list[resolver.Nameserver]:
+        """Nameservers to check propagation on, empty when the check is disabled."""
+        if self.config.propagation_timeout <= 0:
+            return []
+
+        if len(self.config.propagation_nameservers) != 0:
+            hosts = self.config.propagation_nameservers.split(',')
+        else:
+            hosts = self.dns_client.get_nameservers(domain)
+        servers = resolver.resolve_nameservers(hosts)
+        if len(servers) == 0:
+            log.warning(f'No nameserver to check propagation of {domain}, skip')
+        return servers
+
+    def poll_authorization(self, authz, interval: float):
+        """Poll an authorization once, return it and the seconds to wait before polling it again."""
+        authz, response = self.client.poll(authz)
+        if authz.body.status == messages.STATUS_INVALID:
+            raise errors.ValidationError([authz])
+        return authz, retry_after(response, interval)
+
+    def poll_order(self, order, interval: float):
+        """
+        Poll a finalizing order once, return it and the seconds to wait before polling it again.
+        The returned order has fullchain_pem once the certificate is issued.
+        """
+        response = self.client._post_as_get(order.uri)
+        body = messages.Order.from_json(response.json())
+        if body.status == messages.STATUS_INVALID:
+            raise errors.IssuanceError(body.error)
+        if body.status == messages.STATUS_VALID and body.certificate is not None:
+            certificate_response = self.client._post_as_get(body.certificate)
+            return order.update(body=body, fullchain_pem=certificate_response.text), 0
+        return order.update(body=body), retry_after(response, interval)
+
+    def poll_and_finalize(self, order, deadline: float):
+        """Wait for every authorization to be valid, then finalize the order and wait for the certificate."""
+        interval = self.config.poll_interval
+        authzs = list(order.authorizations)
+        with ThreadPoolExecutor(max_workers=max(len(authzs), 1)) as executor:
+            while True:
+                pending = [i for i, authz in enumerate(authzs) if authz.body.status != messages.STATUS_VALID]
+                if len(pending) == 0:
+                    break
+                results = executor.map(in_flow(lambda i: self.poll_authorization(authzs[i], interval)), pending)
+                delays = list[float]()
+                for i, (authz, delay) in zip(pending, list(results)):
+                    authzs[i] = authz
+                    if authz.body.status != messages.STATUS_VALID:
+                        delays.append(delay)
+                if len(delays) == 0:
+                    break
+                check_deadline(min(delays), deadline)
+                time.sleep(min(delays))
+                interval = min(interval * 2, self.config.poll_max_interval)
+
+        order = self.client.begin_finalization(order.update(authorizations=authzs))
+        interval = self.config.poll_interval
+        while True:
+            order, delay = self.poll_order(order, interval)
+            if order.fullchain_pem is not None:
+                return order
+            check_deadline(delay, deadline)
+            time.sleep(delay)
+            interval = min(interval * 2, self.config.poll_max_interval)
+
+    def clear_run_cache(self):
+        """Forget what is looked up once per run, a daemon keeps its client across runs."""
+        self.dns_client.clear_cache()
+        with self._delegated_lock:
+            self.delegated.clear()
+
+    def delegated_name(self, challenge_name: str, challenge_zone: str) -> str:
+        """
+        The name in challenge_zone the CNAME of challenge_name points to, looked up once per run.
+        @raise resolver.DNSError: there is no such CNAME, the CA would not see the challenge,
+                                  unless challenge_require_cname is 0, then the name it should point to
+        """
+        key = (challenge_name, challenge_zone)
+        with self._delegated_lock:
+            if key in self.delegated:
+                return self.delegated[key]
+        hosts = self.config.challenge_resolvers.split(',') if len(self.config.challenge_resolvers) != 0 \
+            else resolver.system_nameservers()
+        target = resolver.follow_cname(challenge_name, challenge_zone, resolver.resolve_servers(hosts))
+        if target is None:
+            expected = f"{challenge_name.removeprefix(f'{self.config.rr}.')}.{challenge_zone}"
+            if self.config.challenge_require_cname != 0:
+                raise resolver.DNSError(f'{challenge_name} is not a CNAME into {challenge_zone},'
+                                        f' create one to {expected}')
+            log.warning(f'{challenge_name} is not a CNAME into {challenge_zone}, expect it to be one to {expected}')
+            target = expected
+        with self._delegated_lock:
+            self.delegated[key] = target
+        return target
+
+    def challenge_name(self, cert: CertConfig, name: str) -> tuple[str, str]:
+        """The zone and rr the challenge of name is set on, in the zone it is delegated to if any."""
+        section = cert.section_of(name)
+        challenge_zone = section.challenge_zone or self.config.challenge_zone
+        if len(challenge_zone) == 0:
+            zone = section.domain
+            return zone, self.config.rr if name == zone else f'{self.config.rr}.{name[:-len(zone) - 1]}'
+
+        # One zone holds the challenges of every domain, only it needs write access, and it is listed once.
+        self.dns_client.index_whole_zone(challenge_zone)
+        target = self.delegated_name(f'{self.config.rr}.{name}', challenge_zone)
+        return challenge_zone, '@' if target == challenge_zone else target[:-len(challenge_zone) - 1]
+
+    def challenge_records(self, cert: CertConfig, authz_chls, values: list[str]) -> dict[tuple[str, str], list[str]]:
+        """Group the challenge values by the zone and rr they are set on."""
+        records = dict[tuple[str, str], list[str]]()
+        for (authz, _), value in zip(authz_chls, values):
+            zone, rr = self.challenge_name(cert, authz.body.identifier.value)
+            records.setdefault((zone, rr), list()).append(value)
+        return records
+
+    def set_challenge_records(self, records: dict[tuple[str, str], list[str]]) -> list[str]:
+        """Set all challenge names concurrently, clean the ones already set if any fails."""
+        record_ids = list[str]()
+        error = None
+        with ThreadPoolExecutor(max_workers=max(len(records), 1)) as executor:
+            set_challenge_dns = in_flow(self.dns_client.set_challenge_dns)
+            futures = [executor.submit(set_challenge_dns, zone, rr, self.config.type, values, self.config.ttl)
+                       for (zone, rr), values in records.items()]
+            for future in futures:
+                try:
+                    record_ids.extend(future.result())
+                except Exception as err:
+                    error = err
+        if error is not None:
+            self.dns_client.clean_challenge_dns(record_ids)
+            raise error
+        return record_ids
+
+    def wait_propagation(self, zone: str, rr: str, values: list[str]):
+        servers = self.propagation_servers(zone)
+        if len(servers) != 0:
+            resolver.wait_txt_propagation(challenge_fqdn(zone, rr), values, servers,
+                                          self.config.propagation_timeout,
+                                          self.config.propagation_interval,
+                                          self.config.propagation_max_interval)
+
+    def perform_dns01(self, cert: CertConfig, authz_chls, order):
+        """
+        Set up the TXT values of all challenges at once and perform DNS-01 challenges.
+        The wildcard and the apex name share one challenge name, so it holds one value per authorization.
+        """
+        deadline = time.monotonic() + self.config.order_timeout
+        if len(authz_chls) == 0:
+            log.info(f'All authorizations of {cert.name} are valid, finalize')
+            with metrics.phase(cert.name, 'poll_and_finalize'):
+                finalized_order = self.poll_and_finalize(order, deadline)
+            return bytes(finalized_order.fullchain_pem, encoding='utf-8')
+
+        key = self.client.net.key
+        chls = [chl for _, chl in authz_chls]
+        responses = [chl.response_and_validation(key) for chl in chls]
+        records = self.challenge_records(cert, authz_chls, [validation for _, validation in responses])
+
+        with metrics.phase(cert.name, 'set_challenge_dns'):
+            record_ids = self.set_challenge_records(records)
+        try:
+            with metrics.phase(cert.name, 'propagation'), \
+                    ThreadPoolExecutor(max_workers=max(len(records), 1)) as executor:
+                futures = [executor.submit(in_flow(self.wait_propagation), zone, rr, values)
+                           for (zone, rr), values in records.items()]
+                for future in futures:
+                    future.result()
+
+            # Let the CA server know that we are ready for the challenges.
+            log.info(f'Answer {len(chls)} challenges: {cert.name}')
+            with metrics.phase(cert.name, 'answer_challenge'), \
+                    ThreadPoolExecutor(max_workers=max(len(chls), 1)) as executor:
+                list(executor.map(in_flow(self.client.answer_challenge), chls,
+                                  [response for response, _ in responses]))
+
+            # Wait for challenge status and then issue a certificate.
+            log.info(f'Poll and finalize: {cert.name}')
+            with metrics.phase(cert.name, 'poll_and_finalize'):
+                finalized_order = self.poll_and_finalize(order, deadline)
+        finally:
+            with metrics.phase(cert.name, 'clean_challenge_dns'):
+                self.dns_client.clean_challenge_dns(record_ids)
+
+        return bytes(finalized_order.fullchain_pem, encoding='utf-8')
+
+    def new_network(self) -> RateLimitedNetwork:
+        return RateLimitedNetwork(self.acc_key, self.limiter, self.config.rate_limit_max_wait,
+                                  user_agent=self.config.user_agent)
 
-        response, validation = chl.response_and_validation(self.client.net.key)
+    def load_directory(self, net) -> messages.Directory:
+        document = self.state_cache.get_directory(self.config.directory_cache_ttl)
+        if document is not None:
+            log.debug('Use cached directory')
+            return messages.Directory.from_json(document)
 
-        dns_client = Client(self.config.access_key_id, self.config.access_key_secret)
-        record_id = dns_client.set_challenge_dns(domain, self.config.rr, self.config.type, validation, self.config.ttl)
+        log.debug('Get directory')
+        directory = client.ClientV2.get_directory(self.config.directory_url, net)
+        self.state_cache.set_directory(json.loads(directory.json_dumps()))
+        return directory
+
+    def get_renewal_info(self, cert_id: str) -> RenewalInfo:
+        """
+        Ask the CA when to renew a certificate. The request is not signed, so it needs no account.
+        Never raises, an answer without a window still says when to ask again.
+        """
+        now = time.time()
+        max_age = self.config.renewal_info_max_age
+        error_retry = RenewalInfo(None, None, now + min(RENEWAL_INFO_ERROR_RETRY, max_age))
+        if self.renewal_info_net is None:
+            try:
+                net = self.new_network()
+                directory = self.load_directory(net)
+            except Exception as err:
+                log.warning(f'Get directory for renewal info fail: {err!r}')
+                return error_retry
+            # Only kept once both are there, a failed load is tried again next time.
+            self.renewal_info_net, self.renewal_info_directory = net, directory
         try:
-            # Let the CA server know that we are ready for the challenge.
-            log.info('Answer challenge')
-            self.client.answer_challenge(chl, response)
+            url = self.renewal_info_directory['renewalInfo']
+        except KeyError:
+            log.debug('The CA does not offer renewal info')
+            return RenewalInfo(None, None, now + max_age)
 
-            # Wait for challenge status and then issue a certificate.
-            # It is possible to set a deadline time.
-            log.info('Poll and finalize')
-            finalized_order = self.client.poll_and_finalize(order)
-            dns_client.clean_challenge_dns(record_id)
+        try:
+            response = self.renewal_info_net.get(f"{url.rstrip('/')}/{cert_id}")
+            retry = min(max(retry_after(response, RENEWAL_INFO_DEFAULT_RETRY), RENEWAL_INFO_MIN_RETRY), max_age)
+            return parse_renewal_info(response.json(), now + retry)
         except Exception as err:
-            dns_client.clean_challenge_dns(record_id)
-            log.critical(err)
-            exit(os.EX_SOFTWARE)
+            log.warning(f'Get renewal info {cert_id} fail: {err!r}')
+            return error_retry
 
-        return bytes(finalized_order.fullchain_pem, encoding='utf-8')
+    def replaces(self, cert: CertConfig) -> typing.Optional[str]:
+        """The renewal info identifier of the saved certificate, that a new order for cert replaces."""
+        if self.config.renewal_info_max_age <= 0 or self.inventory is None:
+            return None
+        try:
+            self.client.directory['renewalInfo']
+        except KeyError:
+            return None
+        row = self.inventory.get(cert.save_dir)
+        return row['cert_id'] if row is not None else None
+
+    def new_order(self, cert: CertConfig, csr_pem: bytes) -> messages.OrderResource:
+        """ClientV2.new_order, telling the CA which certificate the order replaces, so it can renew early."""
+        replaces = self.replaces(cert)
+        if replaces is None:
+            return self.client.new_order(csr_pem)
+
+        order = NewOrder(identifiers=[messages.Identifier(typ=messages.IDENTIFIER_FQDN, value=name)
+                                      for name in cert.names], replaces=replaces)
+        try:
+            response = self.client._post(self.client.directory['newOrder'], order)
+        except messages.Error as err:
+            # Replaced by an earlier order, or unknown to the CA, e.g. it is from another CA.
+            if err.typ not in [messages.ERROR_PREFIX + 'alreadyReplaced', messages.ERROR_PREFIX + 'malformed']:
+                raise
+            log.warning(f'Order of {cert.name} can not replace {replaces}, order without it: {err.detail}')
+            return self.client.new_order(csr_pem)
+
+        body = messages.Order.from_json(response.json())
+        authorizations = [self.client._authzr_from_response(self.client._post_as_get(url), uri=url)
+                          for url in body.authorizations]
+        return messages.OrderResource(body=body, uri=response.headers.get('Location'),
+                                      authorizations=authorizations, csr_pem=csr_pem)
+
+    def handle_error(self, err: Exception):
+        """Drop cached state after errors that suggest it is stale."""
+        if isinstance(err, messages.Error) and err.typ in [messages.ERROR_PREFIX + 'badNonce',
+                                                           messages.ERROR_PREFIX + 'unauthorized',
+                                                           messages.ERROR_PREFIX + 'accountDoesNotExist']:
+            self.state_cache.invalidate()
+            if err.typ != messages.ERROR_PREFIX + 'badNonce':
+                self.account_stale = True
+
+    def account_loaded(self) -> bool:
+        """Whether load_account has built the client, and the CA has not rejected the account since."""
+        return self.client is not None and not self.account_stale
 
     def create_account(self):
         log.info(f'Create and register new account')
@@ -92,8 +474,9 @@ class ACMEClient:
                                          key_size=self.config.acc_key_bits,
                                          backend=default_backend()))
 
-        net = client.ClientNetwork(self.acc_key, user_agent=self.config.user_agent)
-        directory = client.ClientV2.get_directory(self.config.directory_url, net)
+        net = self.new_network()
+        directory = self.load_directory(net)
+        net.new_order_url = directory['newOrder']
         self.client = client.ClientV2(directory, net=net)
 
         # Terms of Service URL is in client_acme.directory.meta.terms_of_service
@@ -104,6 +487,7 @@ class ACMEClient:
         self.reg_res = self.client.new_account(
             messages.NewRegistration.from_data(
                 email=email, terms_of_service_agreed=True))
+        self.state_cache.set_registration(self.reg_res.uri)
 
     def save_account(self):
         log.info(f'Save acme account to {self.acc_file_path}')
@@ -130,18 +514,30 @@ class ACMEClient:
         return True
 
     def load_account(self):
+        # Stale until loaded, a failure half way leaves a client the next run must not use.
+        self.account_stale = True
+        reg_res = self._load_account()
+        self.account_stale = False
+        return reg_res
+
+    def _load_account(self):
         if not self.read_account_file():
             self.create_account()
             self.save_account()
+            return self.reg_res
 
-        log.info('Query registration status')
-        net = client.ClientNetwork(self.acc_key, user_agent=self.config.user_agent)
-        log.debug('Get directory')
-        directory = client.ClientV2.get_directory(self.config.directory_url, net)
+        net = self.new_network()
+        directory = self.load_directory(net)
+        net.new_order_url = directory['newOrder']
         self.client = client.ClientV2(directory, net=net)
+        self.client.net.account = self.reg_res
+
+        if self.state_cache.registration_verified(self.reg_res.uri, self.config.registration_cache_ttl):
+            log.info('Registration status verified recently, skip query')
+            return self.reg_res
 
         # Query registration status.
-        self.client.net.account = self.reg_res
+        log.info('Query registration status')
         try:
             self.client.query_registration(self.reg_res)
         except messages.Error as err:
@@ -150,46 +546,52 @@ class ACMEClient:
                 log.info('Status is deactivated')
                 self.create_account()
                 self.save_account()
-            if err.typ == messages.ERROR_PREFIX + 'accountDoesNotExist':
+            elif err.typ == messages.ERROR_PREFIX + 'accountDoesNotExist':
                 # Status is deactivated.
                 log.info('Status is not exist')
                 self.create_account()
                 self.save_account()
             else:
                 raise err
+        else:
+            self.state_cache.set_registration(self.reg_res.uri)
 
         return self.reg_res
 
-    def issue_cert(self, domain: str):
+    def issue_cert(self, cert: CertConfig):
         # Create domain private key and CSR
-        log.info(f'Generate new csr compare for {domain}')
-        pkey_pem, csr_pem = self.new_csr_comp(domain)
+        log.info(f'Generate new csr compare for {cert.name}, names: {cert.names}')
+        with metrics.phase(cert.name, 'keygen'):
+            pkey_pem, csr_pem = self.new_csr_comp(cert.names)
 
         # Issue certificate
 
         log.debug(f'Create new order')
-        order = self.client.new_order(csr_pem)
+        with metrics.phase(cert.name, 'new_order'):
+            order = self.new_order(cert, csr_pem)
 
-        # Select HTTP-01 within offered challenges by the CA server
-        chl = select_dns01_chl(order)
+        # Select DNS-01 within offered challenges by the CA server
+        authz_chls = select_dns01_chls(order)
 
         # The certificate is ready to be used in the variable "fullchain_pem".
         log.debug(f'Perform dns01')
-        fullchain_pem = self.perform_dns01(domain, chl, order)
+        fullchain_pem = self.perform_dns01(cert, authz_chls, order)
 
         return pkey_pem, fullchain_pem
 
-    def renew(self, domain: str, pkey_pem: bytes):
-        log.info(f'Renew csr compare for {domain}')
-        _, csr_pem = self.new_csr_comp(domain, pkey_pem)
+    def renew(self, cert: CertConfig, pkey_pem: bytes):
+        log.info(f'Renew csr compare for {cert.name}, names: {cert.names}')
+        with metrics.phase(cert.name, 'csr'):
+            _, csr_pem = self.new_csr_comp(cert.names, pkey_pem)
 
         log.debug(f'Create new order')
-        order = self.client.new_order(csr_pem)
+        with metrics.phase(cert.name, 'new_order'):
+            order = self.new_order(cert, csr_pem)
 
-        chl = select_dns01_chl(order)
+        authz_chls = select_dns01_chls(order)
 
         # Performing challenge
         log.debug(f'Perform dns01')
-        fullchain_pem = self.perform_dns01(domain, chl, order)
+        fullchain_pem = self.perform_dns01(cert, authz_chls, order)
 
         return pkey_pem, fullchain_pem
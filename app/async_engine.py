@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import time
+import typing
+
+from acme import messages
+
+from ali_dns import resolver
+from .acme_client import ACMEClient, challenge_fqdn, select_dns01_chls, check_deadline
+from .config import CertConfig
+from .main import record_failure, save_cert
+from .metrics import metrics
+from .ratelimit import flow
+
+log = logging.getLogger(__name__)
+
+
+class AsyncACMEEngine:
+    """
+    Run many orders on one event loop with the account of an ACMEClient.
+    Blocking ACME and Alidns requests go to the default executor, waiting for
+    propagation, authorizations and orders is done on the loop, so a domain
+    holds no thread while it waits.
+    """
+
+    def __init__(self, acme_client: ACMEClient):
+        self.acme_client = acme_client
+        self.config = acme_client.config
+
+    async def poll_and_finalize(self, order, deadline: float):
+        acme_client = self.acme_client
+        interval = self.config.poll_interval
+        authzs = list(order.authorizations)
+        while True:
+            pending = [i for i, authz in enumerate(authzs) if authz.body.status != messages.STATUS_VALID]
+            if len(pending) == 0:
+                break
+            results = await asyncio.gather(
+                *[asyncio.to_thread(acme_client.poll_authorization, authzs[i], interval) for i in pending])
+            delays = list[float]()
+            for i, (authz, delay) in zip(pending, results):
+                authzs[i] = authz
+                if authz.body.status != messages.STATUS_VALID:
+                    delays.append(delay)
+            if len(delays) == 0:
+                break
+            check_deadline(min(delays), deadline)
+            await asyncio.sleep(min(delays))
+            interval = min(interval * 2, self.config.poll_max_interval)
+
+        order = await asyncio.to_thread(acme_client.client.begin_finalization, order.update(authorizations=authzs))
+        interval = self.config.poll_interval
+        while True:
+            order, delay = await asyncio.to_thread(acme_client.poll_order, order, interval)
+            if order.fullchain_pem is not None:
+                return order
+            check_deadline(delay, deadline)
+            await asyncio.sleep(delay)
+            interval = min(interval * 2, self.config.poll_max_interval)
+
+    async def set_challenge_records(self, records: dict[tuple[str, str], list[str]]) -> list[str]:
+        dns_client = self.acme_client.dns_client
+        results = await asyncio.gather(
+            *[asyncio.to_thread(dns_client.set_challenge_dns, zone, rr, self.config.type, values, self.config.ttl)
+              for (zone, rr), values in records.items()],
+            return_exceptions=True)
+        record_ids = [record_id for result in results if not isinstance(result, BaseException) for record_id in result]
+        for result in results:
+            if isinstance(result, BaseException):
+                await asyncio.to_thread(dns_client.clean_challenge_dns, record_ids)
+                raise result
+        return record_ids
+
+    async def wait_propagation(self, zone: str, rr: str, values: list[str]):
+        servers = await asyncio.to_thread(self.acme_client.propagation_servers, zone)
+        if len(servers) != 0:
+            await resolver.async_wait_txt_propagation(challenge_fqdn(zone, rr), values, servers,
+                                                      self.config.propagation_timeout,
+                                                      self.config.propagation_interval,
+                                                      self.config.propagation_max_interval)
+
+    async def perform_dns01(self, cert: CertConfig, authz_chls, order):
+        acme_client = self.acme_client
+        deadline = time.monotonic() + self.config.order_timeout
+        if len(authz_chls) == 0:
+            log.info(f'All authorizations of {cert.name} are valid, finalize')
+            with metrics.phase(cert.name, 'poll_and_finalize'):
+                finalized_order = await self.poll_and_finalize(order, deadline)
+            return bytes(finalized_order.fullchain_pem, encoding='utf-8')
+
+        key = acme_client.client.net.key
+        chls = [chl for _, chl in authz_chls]
+        responses = [chl.response_and_validation(key) for chl in chls]
+        # Following CNAMEs blocks on DNS queries.
+        records = await asyncio.to_thread(acme_client.challenge_records, cert, authz_chls,
+                                          [validation for _, validation in responses])
+
+        with metrics.phase(cert.name, 'set_challenge_dns'):
+            record_ids = await self.set_challenge_records(records)
+        try:
+            with metrics.phase(cert.name, 'propagation'):
+                await asyncio.gather(*[self.wait_propagation(zone, rr, values)
+                                       for (zone, rr), values in records.items()])
+
+            log.info(f'Answer {len(chls)} challenges: {cert.name}')
+            with metrics.phase(cert.name, 'answer_challenge'):
+                await asyncio.gather(*[asyncio.to_thread(acme_client.client.answer_challenge, chl, response)
+                                       for chl, (response, _) in zip(chls, responses)])
+
+            log.info(f'Poll and finalize: {cert.name}')
+            with metrics.phase(cert.name, 'poll_and_finalize'):
+                finalized_order = await self.poll_and_finalize(order, deadline)
+        finally:
+            with metrics.phase(cert.name, 'clean_challenge_dns'):
+                await asyncio.to_thread(acme_client.dns_client.clean_challenge_dns, record_ids)
+
+        return bytes(finalized_order.fullchain_pem, encoding='utf-8')
+
+    async def issue_cert(self, cert: CertConfig):
+        log.info(f'Generate new csr compare for {cert.name}, names: {cert.names}')
+        with metrics.phase(cert.name, 'keygen'):
+            pkey_pem, csr_pem = await asyncio.to_thread(self.acme_client.new_csr_comp, cert.names)
+
+        log.debug(f'Create new order: {cert.name}')
+        with metrics.phase(cert.name, 'new_order'):
+            order = await asyncio.to_thread(self.acme_client.new_order, cert, csr_pem)
+        authz_chls = select_dns01_chls(order)
+
+        fullchain_pem = await self.perform_dns01(cert, authz_chls, order)
+        return pkey_pem, fullchain_pem
+
+    async def renew(self, cert: CertConfig, pkey_pem: bytes):
+        log.info(f'Renew csr compare for {cert.name}, names: {cert.names}')
+        with metrics.phase(cert.name, 'csr'):
+            _, csr_pem = self.acme_client.new_csr_comp(cert.names, pkey_pem)
+
+        log.debug(f'Create new order: {cert.name}')
+        with metrics.phase(cert.name, 'new_order'):
+            order = await asyncio.to_thread(self.acme_client.new_order, cert, csr_pem)
+        authz_chls = select_dns01_chls(order)
+
+        fullchain_pem = await self.perform_dns01(cert, authz_chls, order)
+        return pkey_pem, fullchain_pem
+
+
+async def process_cert_async(engine: AsyncACMEEngine, cert: CertConfig,
+                             pkey_pem: typing.Optional[bytes]) -> bool:
+    with metrics.phase(cert.name, 'total'), flow(cert.name):
+        if pkey_pem is None:
+            pkey_pem, fullchain_pem = await engine.issue_cert(cert)
+        else:
+            _, fullchain_pem = await engine.renew(cert, pkey_pem)
+
+        with metrics.phase(cert.name, 'save'):
+            return await asyncio.to_thread(save_cert, engine.acme_client, cert, pkey_pem, fullchain_pem)
+
+
+async def run_async(acme_client: ACMEClient, due: list[tuple[CertConfig, typing.Optional[bytes]]],
+                    max_workers: int) -> tuple[list[str], list[CertConfig]]:
+    engine = AsyncACMEEngine(acme_client)
+    semaphore = asyncio.Semaphore(max_workers)
+    failed = list[str]()
+    changed = list[CertConfig]()
+
+    async def run_one(cert: CertConfig, pkey_pem: typing.Optional[bytes]):
+        async with semaphore:
+            try:
+                if await process_cert_async(engine, cert, pkey_pem):
+                    changed.append(cert)
+                log.info(f'Done: {cert.name}')
+                metrics.record_result(cert.name, 'issued' if pkey_pem is None else 'renewed')
+            except Exception as err:
+                log.error(f'Failed: {cert.name}, {err!r}')
+                metrics.record_result(cert.name, 'failed', err)
+                acme_client.handle_error(err)
+                record_failure(acme_client, cert, err)
+                failed.append(cert.name)
+
+    await asyncio.gather(*[run_one(cert, pkey_pem) for cert, pkey_pem in due])
+    return failed, changed
+
+
+
+
+def run_async_engine(acme_client: ACMEClient, due: list[tuple[CertConfig, typing.Optional[bytes]]],
+                     max_workers: int) -> tuple[list[str], list[CertConfig]]:
+    return asyncio.run(run_async(acme_client, due, max_workers))
@@ -1,7 +1,10 @@
 import configparser
+import glob
+import hashlib
 import json
 import logging
 import os
+import typing
 from pathlib import Path
 
 from .consts import *
@@ -9,6 +12,10 @@ from .consts import *
 log = logging.getLogger(__name__)
 
 
+class ConfigError(Exception):
+    """The config files can not be loaded, the message names the file and what is wrong."""
+
+
 class JsonDeSerializable:
     def to_json(self):
         return self.__dict__
@@ -25,65 +32,255 @@ class AppConfig(JsonDeSerializable):
         self.user_agent = DEFAULT_USER_AGENT
         self.acc_key_bits = DEFAULT_ACC_KEY_BITS
         self.cert_pkey_bits = DEFAULT_CERT_PKEY_BITS
+        self.cert_key_type = DEFAULT_CERT_KEY_TYPE
+        self.key_pool_size = DEFAULT_KEY_POOL_SIZE
         self.access_key_id = DEFAULT_ACCESS_KEY_ID
         self.access_key_secret = DEFAULT_ACCESS_KEY_SECRET
         self.email = DEFAULT_EMAIL
         self.type = DEFAULT_TYPE
         self.rr = DEFAULT_CHALLENGE_RR
         self.ttl = DEFAULT_TTL
+        self.challenge_zone = DEFAULT_CHALLENGE_ZONE
+        self.challenge_resolvers = DEFAULT_CHALLENGE_RESOLVERS
+        self.challenge_require_cname = DEFAULT_CHALLENGE_REQUIRE_CNAME
+        self.dns_endpoint = DEFAULT_DNS_ENDPOINT
+        self.dns_protocol = DEFAULT_DNS_PROTOCOL
+        self.dns_connect_timeout = DEFAULT_DNS_CONNECT_TIMEOUT
+        self.dns_read_timeout = DEFAULT_DNS_READ_TIMEOUT
+        self.dns_retries = DEFAULT_DNS_RETRIES
+        self.dns_backoff = DEFAULT_DNS_BACKOFF
+        self.dns_max_backoff = DEFAULT_DNS_MAX_BACKOFF
+        self.dns_call_timeout = DEFAULT_DNS_CALL_TIMEOUT
+        self.dns_breaker_threshold = DEFAULT_DNS_BREAKER_THRESHOLD
+        self.dns_breaker_cooldown = DEFAULT_DNS_BREAKER_COOLDOWN
+        self.acme_rate = DEFAULT_ACME_RATE
+        self.acme_burst = DEFAULT_ACME_BURST
+        self.acme_new_order_limit = DEFAULT_ACME_NEW_ORDER_LIMIT
+        self.acme_new_order_period = DEFAULT_ACME_NEW_ORDER_PERIOD
+        self.dns_rate = DEFAULT_DNS_RATE
+        self.dns_burst = DEFAULT_DNS_BURST
+        self.rate_limit_max_wait = DEFAULT_RATE_LIMIT_MAX_WAIT
+        self.propagation_timeout = DEFAULT_PROPAGATION_TIMEOUT
+        self.propagation_interval = DEFAULT_PROPAGATION_INTERVAL
+        self.propagation_max_interval = DEFAULT_PROPAGATION_MAX_INTERVAL
+        self.propagation_nameservers = DEFAULT_PROPAGATION_NAMESERVERS
         self.log_level = DEFAULT_LOG_LEVEL
         self.data_dir = DEFAULT_DATA_DIR
+        self.directory_cache_ttl = DEFAULT_DIRECTORY_CACHE_TTL
+        self.registration_cache_ttl = DEFAULT_REGISTRATION_CACHE_TTL
+        self.include = DEFAULT_INCLUDE
+        self.metrics_textfile = DEFAULT_METRICS_TEXTFILE
+        self.metrics_summary = DEFAULT_METRICS_SUMMARY
+        self.renew_before_days = DEFAULT_RENEW_BEFORE_DAYS
+        self.renewal_info_max_age = DEFAULT_RENEWAL_INFO_MAX_AGE
+        self.max_workers = DEFAULT_MAX_WORKERS
+        self.deploy_hook = DEFAULT_DEPLOY_HOOK
+        self.deploy_hook_timeout = DEFAULT_DEPLOY_HOOK_TIMEOUT
+        self.deploy_hook_workers = DEFAULT_DEPLOY_HOOK_WORKERS
+        self.daemon_jitter = DEFAULT_DAEMON_JITTER
+        self.daemon_retry_interval = DEFAULT_DAEMON_RETRY_INTERVAL
+        self.retry_max_interval = DEFAULT_RETRY_MAX_INTERVAL
+        self.engine = DEFAULT_ENGINE
+        self.poll_interval = DEFAULT_POLL_INTERVAL
+        self.poll_max_interval = DEFAULT_POLL_MAX_INTERVAL
+        self.order_timeout = DEFAULT_ORDER_TIMEOUT
 
 
 class DomainConfig(JsonDeSerializable):
     def __init__(self):
         self.domain = DEFAULT_DOMAIN
         self.save_dir = ""
+        # Extra names in the zone of domain, comma separated
+        self.san = ""
+        # Sections with the same group share one certificate
+        self.group = ""
+        # Shell command run after the certificate of this section changed
+        self.deploy_hook = ""
+        # Zone the challenges of this section are delegated to, overrides challenge_zone of APP
+        self.challenge_zone = ""
 
     def from_json(self, json_obj):
         super().from_json(json_obj)
         if len(self.save_dir) == 0:
-            self.save_dir = Path(DEFAULT_KEY_COMP_DIR).joinpath(self.domain)
+            self.save_dir = str(Path(DEFAULT_KEY_COMP_DIR).joinpath(self.domain))
+        for name in self.san_names():
+            if name != self.domain and not name.endswith(f'.{self.domain}'):
+                raise ValueError(f'SAN {name} is not in zone {self.domain}')
+
+    def san_names(self) -> list[str]:
+        return [name.strip() for name in self.san.split(',') if len(name.strip()) != 0]
+
+    def names(self) -> list[str]:
+        return [f'*.{self.domain}', self.domain] + self.san_names()
+
+
+class CertConfig:
+    """One certificate, covering the names of one or more domain sections."""
+
+    def __init__(self, save_dir: str, domains: list[DomainConfig]):
+        self.save_dir = save_dir
+        self.domains = domains
+        # Used in logs.
+        self.name = domains[0].domain
+        self.names = list(dict.fromkeys(name for d in domains for name in d.names()))
+
+    def section_of(self, name: str) -> DomainConfig:
+        """The section name belongs to, the one with the longest matching domain."""
+        name = name.removeprefix('*.')
+        sections = [d for d in self.domains if name == d.domain or name.endswith(f'.{d.domain}')]
+        if len(sections) == 0:
+            raise ValueError(f'{name} is not in any zone of {self.name}')
+        return max(sections, key=lambda d: len(d.domain))
+
+
+def group_domain_config(domains: list[DomainConfig]) -> list[CertConfig]:
+    """Sections sharing a group key or a save_dir are bundled into one certificate."""
+    groups = dict[str, list[DomainConfig]]()
+    for d in domains:
+        key = f'group:{d.group}' if len(d.group) != 0 else f'dir:{os.path.normpath(d.save_dir)}'
+        groups.setdefault(key, list()).append(d)
+
+    certs = list[CertConfig]()
+    # save_dir -> the sections of the certificate saved there
+    saved_by = dict[str, list[str]]()
+    for group in groups.values():
+        save_dirs = list(dict.fromkeys(os.path.normpath(d.save_dir) for d in group))
+        if len(save_dirs) > 1:
+            raise ValueError(f'Sections of group {group[0].group} save to different dirs {save_dirs},'
+                             f' set the same save_dir for all of them')
+        cert = CertConfig(group[0].save_dir, group)
+        if save_dirs[0] in saved_by:
+            # One would overwrite the key, chain and inventory row of the other.
+            raise ValueError(f'Certificates of {saved_by[save_dirs[0]]} and {[d.domain for d in group]}'
+                             f' save to the same dir {cert.save_dir}, put them in one group or set another save_dir')
+        saved_by[save_dirs[0]] = [d.domain for d in group]
+        if len(cert.names) > MAX_SAN_NAMES:
+            raise ValueError(f'Certificate of {[d.domain for d in group]} has {len(cert.names)} names,'
+                             f' more than {MAX_SAN_NAMES}')
+        if len(group) > 1:
+            log.info(f'Bundle {[d.domain for d in group]} into one certificate saved to {cert.save_dir}')
+        certs.append(cert)
+    return certs
+
+
+class ParsedFile:
+    """The sections of one config file, kept while the file does not change."""
+
+    def __init__(self, stat_key: typing.Optional[tuple[int, int]], digest: str,
+                 app: typing.Optional[dict[str, str]], domains: dict[str, DomainConfig]):
+        # (mtime, size)
+        self.stat_key = stat_key
+        self.digest = digest
+        # The APP section as is, AppConfig is built after the files are merged
+        self.app = app
+        # Section name -> domain config
+        self.domains = domains
 
 
-app_config = AppConfig()
-domain_config = list[DomainConfig]()
+class Config:
+    """A loaded configuration, the APP settings, the domain sections and the certificates they make up."""
 
+    def __init__(self, app: typing.Optional[AppConfig] = None, domains: typing.Optional[list[DomainConfig]] = None):
+        self.app = app if app is not None else AppConfig()
+        self.domains = domains if domains is not None else list[DomainConfig]()
+        self.certs = group_domain_config(self.domains)
 
-def load_config(filename: str):
-    log.info(f'Load config file: {filename}')
-    config = configparser.ConfigParser()
 
-    try:
-        if len(config.read(filename)) == 0:
+class ConfigLoader:
+    """
+    Load a config file and the files its include patterns match, each parsed on its own.
+    A parsed file is reused while its mtime and size, or else its content hash, stay the same,
+    so a reload only parses the files that changed.
+    The cache lives in memory, so only the daemon, which keeps its loader across reloads, benefits;
+    a one-shot run parses every file. It is not persisted, data_dir is itself read from these files.
+    """
+
+    def __init__(self):
+        self._cache = dict[Path, ParsedFile]()
+
+    def parse_file(self, path: Path) -> ParsedFile:
+        stat = path.stat()
+        stat_key = (stat.st_mtime_ns, stat.st_size)
+        cached = self._cache.get(path)
+        if cached is not None and cached.stat_key == stat_key:
+            return cached
+        data = path.read_bytes()
+        digest = hashlib.sha256(data).hexdigest()
+        if cached is not None and cached.digest == digest:
+            cached.stat_key = stat_key
+            return cached
+
+        log.debug(f'Parse config file: {path}')
+        parser = configparser.ConfigParser()
+        parser.read_string(data.decode('utf-8'), source=str(path))
+        app = dict(parser['APP']) if parser.has_section('APP') else None
+        domains = dict[str, DomainConfig]()
+        for section in parser.sections():
+            if section == 'APP':
+                continue
+            d_config = DomainConfig()
+            d_config.from_json(parser[section])
+            domains[section] = d_config
+        parsed = ParsedFile(stat_key, digest, app, domains)
+        self._cache[path] = parsed
+        return parsed
+
+    def _parse(self, path: Path) -> ParsedFile:
+        try:
+            return self.parse_file(path)
+        except (OSError, UnicodeDecodeError, configparser.Error, ValueError) as err:
+            raise ConfigError(f'{path}: {err}') from err
+
+    def load(self, filename: str) -> Config:
+        """@raise ConfigError: a file can not be read or parsed, or the sections do not make valid certificates"""
+        log.info(f'Load config file: {filename}')
+        path = Path(filename).absolute()
+        if path.exists():
+            main_file = self._parse(path)
+        else:
             log.warning(f'Config file not found')
-    except configparser.Error as err:
-        log.error(err)
-        exit(os.EX_CONFIG)
-
-    if not config.has_section('APP'):
-        log.debug(f'Has not APP section, use default')
-        config.add_section('APP')
-
-    try:
-        app_config.from_json(config['APP'])
-    except ValueError as err:
-        log.error(err)
-        exit(os.EX_CONFIG)
-    config['APP'] = app_config.to_json()
-    log.info(f'Loaded APP config')
-    log.debug(f'Loaded APP config: {json.dumps(app_config.to_json(), indent=4)}')
-
-    for section in config:
-        if section in ['DEFAULT', 'APP']:
-            continue
-        d_config = DomainConfig()
+            main_file = ParsedFile(None, '', None, dict())
+
+        app_config = AppConfig()
+        if main_file.app is None:
+            log.debug(f'Has not APP section, use default')
+        try:
+            app_config.from_json(main_file.app or dict())
+        except ValueError as err:
+            raise ConfigError(f'{path}: {err}') from err
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(f'Loaded APP config: {json.dumps(app_config.to_json(), indent=4)}')
+
+        files = [(path, main_file)]
+        for pattern in [p.strip() for p in app_config.include.split(',') if len(p.strip()) != 0]:
+            # Relative to the directory of the config file, an absolute pattern is kept as is.
+            included = sorted(glob.glob(os.path.join(path.parent, pattern)))
+            if len(included) == 0:
+                log.warning(f'No config file matches include {pattern}')
+            for included_file in included:
+                included_path = Path(included_file)
+                parsed = self._parse(included_path)
+                if parsed.app is not None:
+                    log.warning(f'APP section in included {included_path} is ignored')
+                files.append((included_path, parsed))
+
+        domains = list[DomainConfig]()
+        sources = dict[str, Path]()
+        for file_path, parsed in files:
+            for section, d_config in parsed.domains.items():
+                if section in sources:
+                    raise ConfigError(f'Section {section} of {file_path} is already in {sources[section]}')
+                sources[section] = file_path
+                domains.append(d_config)
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug(f'Domain name config: {json.dumps(d_config.to_json(), indent=4)}')
+        # Forget the files that are no longer included.
+        self._cache = {file_path: self._cache[file_path] for file_path, _ in files if file_path in self._cache}
+
         try:
-            d_config.from_json(config[section])
+            config = Config(app_config, domains)
         except ValueError as err:
-            log.error(err)
-            exit(os.EX_CONFIG)
-        domain_config.append(d_config)
-        config[section] = d_config.to_json()
-        log.info(f'Loaded domain name config: {d_config.domain}')
-        log.debug(f'Domain name config: {json.dumps(d_config.to_json(), indent=4)}')
+            raise ConfigError(str(err)) from err
+        log.info(f'Loaded {len(domains)} domain name configs from {len(files)} files,'
+                 f' {len(config.certs)} certificates')
+        return config
@@ -11,9 +11,16 @@ DEFAULT_ACC_KEY_BITS = 2048
 
 # Certificate private key size
 DEFAULT_CERT_PKEY_BITS = 2048
+# Certificate private key type, one of CERT_KEY_TYPES
+DEFAULT_CERT_KEY_TYPE = 'rsa'
+CERT_KEY_TYPES = ['rsa', 'ec256', 'ec384']
+# Processes pre-generating RSA keys for new certificates, 0 to generate inline
+DEFAULT_KEY_POOL_SIZE = 2
 
 # Domain name for the certificate.
 DEFAULT_DOMAIN = 'client.example.com'
+# Let's Encrypt accepts at most 100 names per certificate
+MAX_SAN_NAMES = 100
 DEFAULT_EMAIL = 'fake@example.com'
 
 DEFAULT_ACCESS_KEY_ID = ''
@@ -21,14 +28,101 @@ DEFAULT_ACCESS_KEY_SECRET = ''
 DEFAULT_TYPE = 'TXT'
 DEFAULT_CHALLENGE_RR = '_acme-challenge'
 DEFAULT_TTL = 600
+# Zone the challenge records are written to instead of the zone of each domain, empty for the own zone.
+# _acme-challenge.<name> must be a CNAME into it, by default to <name>.<challenge_zone>
+DEFAULT_CHALLENGE_ZONE = ''
+# Recursive nameservers the CNAMEs are followed through, comma separated, empty for those of resolv.conf
+DEFAULT_CHALLENGE_RESOLVERS = ''
+# Fail a certificate whose _acme-challenge is not a CNAME into the challenge zone, before the CA is asked
+# to validate it. 0 writes <name>.<challenge_zone> anyway, for a CNAME the resolvers can not see.
+DEFAULT_CHALLENGE_REQUIRE_CNAME = 1
+# Alidns API client, timeouts in milliseconds
+DEFAULT_DNS_ENDPOINT = 'alidns.cn-beijing.aliyuncs.com'
+DEFAULT_DNS_PROTOCOL = 'https'
+DEFAULT_DNS_CONNECT_TIMEOUT = 5000
+DEFAULT_DNS_READ_TIMEOUT = 10000
+# Retries of transient Alidns failures, backoff doubles from dns_backoff up to dns_max_backoff with jitter,
+# all attempts of one call within dns_call_timeout, in seconds
+DEFAULT_DNS_RETRIES = 4
+DEFAULT_DNS_BACKOFF = 0.5
+DEFAULT_DNS_MAX_BACKOFF = 10.0
+DEFAULT_DNS_CALL_TIMEOUT = 30.0
+# Alidns calls fail fast for dns_breaker_cooldown seconds after dns_breaker_threshold failures in a row, 0 to disable
+DEFAULT_DNS_BREAKER_THRESHOLD = 5
+DEFAULT_DNS_BREAKER_COOLDOWN = 30.0
+# Request budgets shared by every domain, requests a second and burst, a rate of 0 disables the limit
+DEFAULT_ACME_RATE = 20.0
+DEFAULT_ACME_BURST = 20
+# At most acme_new_order_limit new orders every acme_new_order_period seconds, Let's Encrypt allows 300 in 3 hours
+DEFAULT_ACME_NEW_ORDER_LIMIT = 300
+DEFAULT_ACME_NEW_ORDER_PERIOD = 10800
+DEFAULT_DNS_RATE = 10.0
+DEFAULT_DNS_BURST = 10
+# The longest Retry-After of a rate limited ACME request waited for before retrying it, in seconds
+DEFAULT_RATE_LIMIT_MAX_WAIT = 300
+# Wait until the authoritative nameservers answer the challenge TXT, in seconds, 0 to disable
+DEFAULT_PROPAGATION_TIMEOUT = 300
+DEFAULT_PROPAGATION_INTERVAL = 2
+DEFAULT_PROPAGATION_MAX_INTERVAL = 30
+# Comma separated host[:port] queried instead of the authoritative nameservers
+DEFAULT_PROPAGATION_NAMESERVERS = ''
 DEFAULT_LOG_LEVEL = 'INFO'
 DEFAULT_DATA_DIR = 'run'
+# ACME engine, 'thread' runs each domain on a worker thread, 'async' runs all orders on one event loop
+DEFAULT_ENGINE = 'thread'
+# Polling of authorizations and orders, in seconds, the interval doubles up to the max
+DEFAULT_POLL_INTERVAL = 1
+DEFAULT_POLL_MAX_INTERVAL = 10
+# Deadline of one order, from answering the challenge to downloading the certificate, in seconds
+DEFAULT_ORDER_TIMEOUT = 600
+# Renew the certificate when it expires within this many days
+DEFAULT_RENEW_BEFORE_DAYS = 30
+# ACME Renewal Information (RFC 9773): renew at a random time in the window the CA suggests, instead of
+# renew_before_days before expiry. Its answer is kept for its Retry-After, at most this many seconds, 0 disables it.
+DEFAULT_RENEWAL_INFO_MAX_AGE = 86400
+# Seconds before asking again, when the CA sent no Retry-After, or did not answer
+RENEWAL_INFO_DEFAULT_RETRY = 21600
+RENEWAL_INFO_ERROR_RETRY = 3600
+RENEWAL_INFO_MIN_RETRY = 60
+# Daemon mode: random delay added to each renewal, in seconds
+DEFAULT_DAEMON_JITTER = 3600
+# Delay before retrying a failed certificate, doubling with each failure in a row up to the max, in seconds
+DEFAULT_DAEMON_RETRY_INTERVAL = 3600
+DEFAULT_RETRY_MAX_INTERVAL = 86400
+DAEMON_MAX_SLEEP = 3600
+# Shell command run once after the certificates of a run are saved, if any changed, empty to disable.
+# Domain sections have their own deploy_hook, identical commands run once.
+DEFAULT_DEPLOY_HOOK = ''
+# Seconds before a hook is killed, 0 for no limit, and hooks run concurrently
+DEFAULT_DEPLOY_HOOK_TIMEOUT = 300
+DEFAULT_DEPLOY_HOOK_WORKERS = 4
+# Number of domains processed concurrently
+DEFAULT_MAX_WORKERS = 1
 ACME_ACCOUNT_FILENAME = 'acme_account.json'
 ACME_ACCOUNT_KEY_FILENAME = 'acme_account_key.json'
+ACME_STATE_FILENAME = 'acme_state.json'
+# How long the cached ACME directory and registration status are trusted, in seconds
+DEFAULT_DIRECTORY_CACHE_TTL = 86400
+DEFAULT_REGISTRATION_CACHE_TTL = 86400
 DEFAULT_KEY_COMP_DIR = 'save/'
 PKEY_FILENAME = 'privkey.pem'
 FULLCHAIN_FILENAME = 'fullchain.pem'
+# Each save goes to a new directory under versions, live links to the current one
+# and the key and chain in save_dir link into live, so both switch over at once.
+VERSIONS_DIRNAME = 'versions'
+LIVE_LINK = 'live'
+KEY_COMP_VERSIONS_KEPT = 3
+# SQLite state of every certificate in data_dir
+INVENTORY_FILENAME = 'inventory.sqlite3'
+# status lists the certificates that failed within this many seconds
+STATUS_RECENT_FAILURES = 86400
 
 CONFIG_FILENAME = 'config.ini'
+# More config files with domain sections, comma separated glob patterns relative to the config file
+DEFAULT_INCLUDE = ''
 
 LOG_FORMAT = '%(asctime)s [%(levelname)s] %(name)s: %(message)s'
+
+# Metrics written to data_dir after each run, an empty name disables the file
+DEFAULT_METRICS_TEXTFILE = 'certbot_aliyun.prom'
+DEFAULT_METRICS_SUMMARY = ''
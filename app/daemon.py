@@ -0,0 +1,224 @@
+import heapq
+import logging
+import random
+import signal
+import threading
+import time
+import typing
+from datetime import datetime, timedelta, timezone
+
+from .config import AppConfig, CertConfig, Config, ConfigError, ConfigLoader
+from .metrics import metrics
+from .consts import *
+from .inventory import Inventory
+from .main import (init, configure, check_cert, backoff_until, open_inventory, process_due, export_metrics,
+                   record_failure)
+
+if typing.TYPE_CHECKING:
+    from .acme_client import ACMEClient
+
+log = logging.getLogger(__name__)
+
+# Settings that need a new ACMEClient when they change on reload
+CLIENT_KEYS = ['directory_url', 'user_agent', 'access_key_id', 'access_key_secret', 'email', 'data_dir',
+               'dns_endpoint', 'dns_protocol', 'dns_connect_timeout', 'dns_read_timeout', 'acme_rate',
+               'acme_burst', 'acme_new_order_limit', 'acme_new_order_period', 'dns_rate', 'dns_burst',
+               'rate_limit_max_wait', 'dns_retries', 'dns_backoff', 'dns_max_backoff', 'dns_call_timeout',
+               'dns_breaker_threshold', 'dns_breaker_cooldown']
+
+
+class Daemon:
+    """
+    Keep the ACME client, account and DNS client in one process, and wake up for each
+    certificate at its own renewal time. SIGHUP reloads the config, SIGTERM and SIGINT stop.
+    """
+
+    def __init__(self, loader: ConfigLoader, config: Config):
+        # Kept, so a reload only parses the config files that changed.
+        self.loader = loader
+        self.config = config
+        self.acme_client: typing.Optional['ACMEClient'] = None
+        self.inventory: typing.Optional[Inventory] = None
+        # (renew at, sequence, save_dir), the sequence keeps the order of equal times.
+        self.queue = list[tuple[datetime, int, str]]()
+        self.certs = dict[str, CertConfig]()
+        self.seq = 0
+        self.wakeup = threading.Event()
+        self.reload_requested = False
+        self.stop_requested = False
+
+    def on_reload(self, *_):
+        log.info('Got SIGHUP, reload config')
+        self.reload_requested = True
+        self.wakeup.set()
+
+    def on_stop(self, *_):
+        log.info('Got stop signal, exit after current work')
+        self.stop_requested = True
+        self.wakeup.set()
+
+    @staticmethod
+    def client_settings(app_config: AppConfig) -> list:
+        return [getattr(app_config, key) for key in CLIENT_KEYS]
+
+    def reload(self):
+        old_settings = self.client_settings(self.config.app)
+        try:
+            self.config = configure(self.loader)
+        except ConfigError as err:
+            log.error(f'Reload config fail, keep the running config: {err}')
+            return
+        self.setup(old_settings)
+
+    def setup(self, old_settings: typing.Optional[list] = None):
+        if self.acme_client is None or old_settings != self.client_settings(self.config.app):
+            from .acme_client import ACMEClient
+            log.info('Create ACME client')
+            self.acme_client = ACMEClient(self.config.app)
+            # data_dir is a client setting, the inventory moves with it.
+            if self.inventory is not None:
+                self.inventory.close()
+            self.inventory = open_inventory(self.config.app)
+            self.acme_client.inventory = self.inventory
+            self.load_account()
+        else:
+            # Settings the client reads on each use, like poll intervals, take effect right away.
+            self.acme_client.config = self.config.app
+
+        self.certs = {cert.save_dir: cert for cert in self.config.certs}
+        self.queue.clear()
+        for cert in self.config.certs:
+            self.schedule(cert)
+        export_metrics(self.config, self.acme_client, self.inventory)
+
+    def load_account(self):
+        """Load the account and build the ACME client once, for all batches, a failure is retried by the next batch."""
+        try:
+            self.acme_client.load_account()
+        except Exception as err:
+            log.error(f'Load ACME account fail, retry with the next batch: {err!r}')
+            self.acme_client.handle_error(err)
+
+    def check(self, cert: CertConfig) -> tuple[datetime, typing.Optional[bytes]]:
+        return check_cert(cert, self.config.app, self.inventory, self.acme_client.get_renewal_info)
+
+    def fail(self, certs: list[CertConfig], err: Exception):
+        """Count the error against every cert, so they back off instead of being retried right away."""
+        for cert in certs:
+            metrics.record_result(cert.name, 'failed', err)
+            record_failure(self.acme_client, cert, err)
+
+    def try_check(self, cert: CertConfig) -> typing.Optional[tuple[datetime, typing.Optional[bytes]]]:
+        """check, None when it fails, which counts towards the backoff of cert."""
+        try:
+            return self.check(cert)
+        except Exception as err:
+            log.error(f'Check {cert.name} fail: {err!r}')
+            self.fail([cert], err)
+            return None
+
+    def schedule(self, cert: CertConfig, failed: bool = False):
+        """Queue cert at its renewal time, failed: its check just failed, its backoff says when to try again."""
+        checked = self.try_check(cert) if not failed else None
+        # A failed check is due right away, the backoff below moves it.
+        renew_at, pkey_pem = checked if checked is not None else (datetime.now(timezone.utc), None)
+        now = datetime.now(timezone.utc)
+        if renew_at <= now and pkey_pem is None:
+            # New certificates are issued right away.
+            renew_at = now
+        else:
+            # Spread renewals, so certificates issued together are not renewed together.
+            renew_at = max(renew_at, now) + timedelta(seconds=random.uniform(0, self.config.app.daemon_jitter))
+        # Wake up to ask the CA again, it may move the window closer, e.g. after a mass revocation.
+        row = self.inventory.get(cert.save_dir)
+        if self.config.app.renewal_info_max_age > 0 and row is not None and row['ari_retry_at'] is not None:
+            ask_at = datetime.fromtimestamp(row['ari_retry_at'], timezone.utc)
+            if now < ask_at < renew_at:
+                renew_at = ask_at
+        # A certificate that keeps failing waits for its backoff, also across restarts.
+        retry_at = backoff_until(cert, self.inventory)
+        if retry_at is not None and retry_at > renew_at:
+            renew_at = retry_at
+        log.info(f'Schedule {cert.name} at {renew_at}')
+        self.seq += 1
+        heapq.heappush(self.queue, (renew_at, self.seq, cert.save_dir))
+
+    def pop_due(self) -> list[CertConfig]:
+        now = datetime.now(timezone.utc)
+        due = list[CertConfig]()
+        while len(self.queue) != 0 and self.queue[0][0] <= now:
+            _, _, save_dir = heapq.heappop(self.queue)
+            due.append(self.certs[save_dir])
+        return due
+
+    def run_once(self, certs: list[CertConfig]):
+        started, t0 = time.time(), time.perf_counter()
+        due = list[tuple[CertConfig, typing.Optional[bytes]]]()
+        for cert in certs:
+            checked = self.try_check(cert)
+            if checked is None:
+                self.schedule(cert, failed=True)
+                continue
+            renew_at, pkey_pem = checked
+            if renew_at > datetime.now(timezone.utc):
+                # Woken up to ask the CA, which suggests renewing later.
+                self.schedule(cert)
+                continue
+            due.append((cert, pkey_pem))
+        if len(due) == 0:
+            return
+
+        try:
+            failed, failed_hooks = process_due(self.acme_client, due)
+        except Exception as err:
+            # E.g. the account can not be loaded, the whole batch failed, the daemon keeps running.
+            log.error(f'Process {len(due)} certificates fail: {err!r}')
+            self.acme_client.handle_error(err)
+            self.fail([cert for cert, _ in due], err)
+            failed, failed_hooks = [cert.name for cert, _ in due], list[str]()
+        if len(failed) != 0:
+            log.error(f'{len(failed)} of {len(due)} certificates failed: {failed}')
+        if len(failed_hooks) != 0:
+            log.error(f'{len(failed_hooks)} deploy hooks failed: {failed_hooks}')
+        for cert, _ in due:
+            self.schedule(cert)
+        metrics.record_run(started, time.perf_counter() - t0)
+        export_metrics(self.config, self.acme_client, self.inventory)
+
+    def run(self):
+        signal.signal(signal.SIGHUP, self.on_reload)
+        signal.signal(signal.SIGTERM, self.on_stop)
+        signal.signal(signal.SIGINT, self.on_stop)
+
+        self.setup()
+        while not self.stop_requested:
+            if self.reload_requested:
+                self.reload_requested = False
+                self.reload()
+                continue
+
+            due = self.pop_due()
+            if len(due) != 0:
+                self.run_once(due)
+                continue
+
+            timeout = DAEMON_MAX_SLEEP
+            if len(self.queue) != 0:
+                log.info(f'Sleep until {self.queue[0][0]}')
+                timeout = min((self.queue[0][0] - datetime.now(timezone.utc)).total_seconds(), timeout)
+            # Wake up at least every DAEMON_MAX_SLEEP, in case the clock jumps.
+            self.wakeup.wait(timeout)
+            self.wakeup.clear()
+
+        log.info('Daemon exit')
+
+
+def daemon(force: bool = False):
+    """@param force: try certificates that keep failing right away, instead of after their backoff"""
+    loader = ConfigLoader()
+    config = init(loader)
+    if force:
+        inventory = open_inventory(config.app)
+        log.info(f'Reset the backoff of {inventory.reset_backoff()} failing certificates')
+        inventory.close()
+    Daemon(loader, config).run()
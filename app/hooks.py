@@ -0,0 +1,93 @@
+import logging
+import os
+import signal
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .config import AppConfig, CertConfig
+
+log = logging.getLogger(__name__)
+
+
+class DeployHook:
+    """One command, run once for all the certificates that ask for it."""
+
+    def __init__(self, command: str):
+        self.command = command
+        self.certs = list[CertConfig]()
+
+    def env(self) -> dict[str, str]:
+        # The variables certbot sets for its deploy hooks.
+        lineages = [str(Path(cert.save_dir).absolute()) for cert in self.certs]
+        env = dict(os.environ)
+        env['RENEWED_DOMAINS'] = ' '.join(name for cert in self.certs for name in cert.names)
+        env['RENEWED_LINEAGES'] = ' '.join(lineages)
+        if len(lineages) == 1:
+            env['RENEWED_LINEAGE'] = lineages[0]
+        return env
+
+
+def plan_hooks(changed: list[CertConfig], global_hook: str) -> list[list[DeployHook]]:
+    """
+    The hooks to run in two stages, the domain hooks first, then the global hook.
+    Identical commands are coalesced, a command of both stages runs once, at the end.
+    """
+    global_command = global_hook.strip()
+    domain_hooks = dict[str, DeployHook]()
+    global_hooks = dict[str, DeployHook]()
+    for cert in changed:
+        commands = dict.fromkeys(d.deploy_hook.strip() for d in cert.domains)
+        if len(global_command) != 0:
+            commands[global_command] = None
+        for command in commands:
+            if len(command) == 0:
+                continue
+            hooks = global_hooks if command == global_command else domain_hooks
+            hooks.setdefault(command, DeployHook(command)).certs.append(cert)
+    return [list(stage.values()) for stage in [domain_hooks, global_hooks] if len(stage) != 0]
+
+
+def run_hook(hook: DeployHook, timeout: float) -> bool:
+    log.info(f'Run deploy hook for {[cert.name for cert in hook.certs]}: {hook.command}')
+    try:
+        # A session of its own, so a timeout kills everything the command started.
+        proc = subprocess.Popen(hook.command, shell=True, env=hook.env(), stdin=subprocess.DEVNULL,
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                                start_new_session=True)
+    except OSError as err:
+        log.error(f'Start deploy hook fail: {hook.command}, {err}')
+        return False
+
+    with proc:
+        try:
+            output, _ = proc.communicate(timeout=timeout if timeout > 0 else None)
+        except subprocess.TimeoutExpired:
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            proc.communicate()
+            log.error(f'Deploy hook timed out after {timeout} s, killed: {hook.command}')
+            return False
+
+    if len(output.strip()) != 0:
+        log.info(f'Deploy hook output: {output.strip()}')
+    if proc.returncode != 0:
+        log.error(f'Deploy hook exit with {proc.returncode}: {hook.command}')
+        return False
+    return True
+
+
+def run_deploy_hooks(changed: list[CertConfig], config: AppConfig) -> list[str]:
+    """Run the deploy hooks of the certificates whose files changed, return the commands that failed."""
+    failed = list[str]()
+    stages = plan_hooks(changed, config.deploy_hook)
+    if len(stages) == 0:
+        return failed
+
+    with ThreadPoolExecutor(max_workers=max(config.deploy_hook_workers, 1)) as executor:
+        for stage in stages:
+            results = executor.map(lambda hook: run_hook(hook, config.deploy_hook_timeout), stage)
+            failed.extend(hook.command for hook, ok in zip(stage, results) if not ok)
+    return failed
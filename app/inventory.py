@@ -0,0 +1,227 @@
+import contextlib
+import logging
+import sqlite3
+import threading
+import time
+import typing
+from pathlib import Path
+
+from .renewal_info import RenewalInfo
+
+log = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 2
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS certificates (
+    save_dir TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    -- Sorted, comma separated
+    names TEXT NOT NULL DEFAULT '',
+    -- keygen.key_name of the private key
+    key_type TEXT,
+    serial TEXT,
+    -- Unix time
+    not_after REAL,
+    -- Identity of the saved fullchain file, the row describes it while this matches
+    file_version TEXT,
+    last_attempt REAL,
+    last_success REAL,
+    last_error TEXT,
+    failures INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    -- renewal_info.cert_id of the saved certificate, and the window the CA suggests for it
+    cert_id TEXT,
+    ari_start REAL,
+    ari_end REAL,
+    -- The time picked in the window, kept while it stays inside
+    ari_renew_at REAL,
+    -- When to ask the CA again
+    ari_retry_at REAL
+);
+CREATE INDEX IF NOT EXISTS certificates_not_after ON certificates (not_after);
+CREATE INDEX IF NOT EXISTS certificates_next_attempt ON certificates (next_attempt);
+CREATE INDEX IF NOT EXISTS certificates_last_attempt ON certificates (last_attempt);
+'''
+# Schema version -> statements that upgrade the previous version to it
+MIGRATIONS = {
+    2: ['ALTER TABLE certificates ADD COLUMN cert_id TEXT',
+        'ALTER TABLE certificates ADD COLUMN ari_start REAL',
+        'ALTER TABLE certificates ADD COLUMN ari_end REAL',
+        'ALTER TABLE certificates ADD COLUMN ari_renew_at REAL',
+        'ALTER TABLE certificates ADD COLUMN ari_retry_at REAL'],
+}
+
+
+def file_version(path: Path) -> typing.Optional[str]:
+    """Changes whenever the file is replaced or rewritten, None when it does not exist."""
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return f'{stat.st_ino}:{stat.st_mtime_ns}:{stat.st_size}'
+
+
+class CertRecord:
+    """The saved certificate as last seen, without reading it again."""
+
+    def __init__(self, names: list[str], key_type: str, serial: str, not_after: float, version: str,
+                 cert_id: typing.Optional[str] = None):
+        self.names = names
+        self.key_type = key_type
+        self.serial = serial
+        self.not_after = not_after
+        self.version = version
+        self.cert_id = cert_id
+
+
+class Inventory:
+    """
+    What is known about every certificate: the saved one, and the last attempts to issue or renew it.
+    One SQLite file in data_dir, shared by the workers of the process, each update is one transaction.
+    """
+
+    def __init__(self, filename: typing.Union[str, Path]):
+        self.filename = str(filename)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.filename, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._migrate()
+
+    def _migrate(self):
+        version = self._conn.execute('PRAGMA user_version').fetchone()[0]
+        self._conn.executescript(SCHEMA)
+        # A new file is created with the current schema, 0 is an empty file.
+        if version != 0:
+            for target in range(version + 1, SCHEMA_VERSION + 1):
+                log.info(f'Upgrade inventory {self.filename} to version {target}')
+                for statement in MIGRATIONS[target]:
+                    self._conn.execute(statement)
+        self._conn.execute(f'PRAGMA user_version={SCHEMA_VERSION}')
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @contextlib.contextmanager
+    def _transaction(self) -> typing.Iterator[sqlite3.Connection]:
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    def _query(self, sql: str, params: typing.Union[tuple, dict] = ()) -> list[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def get(self, save_dir: str) -> typing.Optional[sqlite3.Row]:
+        rows = self._query('SELECT * FROM certificates WHERE save_dir = ?', (save_dir,))
+        return rows[0] if len(rows) != 0 else None
+
+    def cert_record(self, save_dir: str, version: typing.Optional[str]) -> typing.Optional[CertRecord]:
+        """The saved certificate, if the row was written for this version of the file."""
+        row = self.get(save_dir)
+        if row is None or version is None or row['file_version'] != version or row['not_after'] is None:
+            return None
+        return CertRecord(row['names'].split(',') if len(row['names']) != 0 else [], row['key_type'],
+                          row['serial'], row['not_after'], row['file_version'], row['cert_id'])
+
+    def record_cert(self, save_dir: str, name: str, cert: CertRecord, success: bool = False):
+        """Store what the saved certificate is, and on success reset its failures."""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute('''
+                INSERT INTO certificates (save_dir, name, names, key_type, serial, not_after, file_version,
+                                          last_attempt, last_success, cert_id)
+                VALUES (:save_dir, :name, :names, :key_type, :serial, :not_after, :version, :attempt, :success,
+                        :cert_id)
+                ON CONFLICT (save_dir) DO UPDATE SET
+                    name = excluded.name, names = excluded.names, key_type = excluded.key_type,
+                    serial = excluded.serial, not_after = excluded.not_after, file_version = excluded.file_version,
+                    -- The renewal info of another certificate does not apply.
+                    ari_start = CASE WHEN cert_id IS excluded.cert_id THEN ari_start END,
+                    ari_end = CASE WHEN cert_id IS excluded.cert_id THEN ari_end END,
+                    ari_renew_at = CASE WHEN cert_id IS excluded.cert_id THEN ari_renew_at END,
+                    ari_retry_at = CASE WHEN cert_id IS excluded.cert_id THEN ari_retry_at END,
+                    cert_id = excluded.cert_id,
+                    last_attempt = COALESCE(excluded.last_attempt, last_attempt),
+                    last_success = COALESCE(excluded.last_success, last_success),
+                    last_error = CASE WHEN excluded.last_success IS NULL THEN last_error END,
+                    failures = CASE WHEN excluded.last_success IS NULL THEN failures ELSE 0 END,
+                    next_attempt = CASE WHEN excluded.last_success IS NULL THEN next_attempt ELSE 0 END
+            ''', {'save_dir': save_dir, 'name': name, 'names': ','.join(sorted(cert.names)), 'key_type': cert.key_type,
+                  'serial': cert.serial, 'not_after': cert.not_after, 'version': cert.version,
+                  'attempt': now if success else None, 'success': now if success else None,
+                  'cert_id': cert.cert_id})
+
+    def renewal_info(self, save_dir: str, cert_id: str) \
+            -> typing.Optional[tuple[typing.Optional[float], typing.Optional[float], float]]:
+        """
+        The start of the window the CA suggested and the time picked in it, None if it suggested no window,
+        and when to ask it again. None when it was not asked about this certificate yet.
+        """
+        rows = self._query('SELECT ari_start, ari_renew_at, ari_retry_at FROM certificates'
+                           ' WHERE save_dir = ? AND cert_id = ? AND ari_retry_at IS NOT NULL', (save_dir, cert_id))
+        return (rows[0]['ari_start'], rows[0]['ari_renew_at'], rows[0]['ari_retry_at']) if len(rows) != 0 else None
+
+    def record_renewal_info(self, save_dir: str, cert_id: str, info: RenewalInfo) -> typing.Optional[float]:
+        """
+        Store the answer of the CA, an answer without a window keeps the last one.
+        The time to renew at is picked again only when the window moved away from it. Return that time.
+        """
+        with self._transaction() as conn:
+            row = conn.execute('SELECT ari_renew_at FROM certificates WHERE save_dir = ? AND cert_id = ?',
+                               (save_dir, cert_id)).fetchone()
+            if row is None:
+                return None
+            renew_at = row['ari_renew_at']
+            if info.start is None:
+                conn.execute('UPDATE certificates SET ari_retry_at = ? WHERE save_dir = ?', (info.retry_at, save_dir))
+                return renew_at
+            if renew_at is None or not info.start <= renew_at <= info.end:
+                renew_at = info.pick()
+            conn.execute('UPDATE certificates SET ari_start = ?, ari_end = ?, ari_renew_at = ?, ari_retry_at = ?'
+                         ' WHERE save_dir = ?', (info.start, info.end, renew_at, info.retry_at, save_dir))
+        return renew_at
+
+    def record_failure(self, save_dir: str, name: str, error: str, backoff: float, max_backoff: float) -> float:
+        """
+        Count a failed attempt, the next one is backoff seconds later, doubling with each failure in a row
+        up to max_backoff. Return the unix time of the next attempt.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute('SELECT failures FROM certificates WHERE save_dir = ?', (save_dir,)).fetchone()
+            failures = (row['failures'] if row is not None else 0) + 1
+            next_attempt = now + min(backoff * 2 ** (failures - 1), max_backoff)
+            conn.execute('''
+                INSERT INTO certificates (save_dir, name, last_attempt, last_error, failures, next_attempt)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (save_dir) DO UPDATE SET
+                    name = excluded.name, last_attempt = excluded.last_attempt,
+                    last_error = excluded.last_error, failures = excluded.failures,
+                    next_attempt = excluded.next_attempt
+            ''', (save_dir, name, now, error, failures, next_attempt))
+        return next_attempt
+
+    def reset_backoff(self) -> int:
+        """Let every failing certificate be tried right away, return how many were backing off."""
+        with self._transaction() as conn:
+            return conn.execute('UPDATE certificates SET next_attempt = 0 WHERE next_attempt > 0').rowcount
+
+    def expiring(self, before: float) -> list[sqlite3.Row]:
+        """Certificates that expire before the unix time, soonest first."""
+        return self._query('SELECT * FROM certificates WHERE not_after < ? ORDER BY not_after', (before,))
+
+    def failed_since(self, since: float) -> list[sqlite3.Row]:
+        """Certificates whose last attempt since the unix time failed, latest first."""
+        return self._query('SELECT * FROM certificates WHERE last_attempt >= ? AND failures > 0'
+                           ' ORDER BY last_attempt DESC', (since,))
+
+    def all(self) -> list[sqlite3.Row]:
+        return self._query('SELECT * FROM certificates ORDER BY not_after IS NULL, not_after')
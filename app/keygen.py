@@ -0,0 +1,89 @@
+import collections
+import logging
+import threading
+import typing
+from concurrent.futures import ProcessPoolExecutor, Future
+
+log = logging.getLogger(__name__)
+
+# Curve class names in cryptography's ec module, cryptography is only imported when a key is generated or loaded.
+EC_CURVES = {
+    'ec256': 'SECP256R1',
+    'ec384': 'SECP384R1',
+}
+
+
+def generate_key(key_type: str, bits: int) -> bytes:
+    """Generate a certificate private key in PEM, bits is only used by RSA."""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+    if key_type == 'rsa':
+        key = rsa.generate_private_key(public_exponent=65537, key_size=bits)
+    else:
+        key = ec.generate_private_key(getattr(ec, EC_CURVES[key_type])())
+    return key.private_bytes(encoding=serialization.Encoding.PEM,
+                             format=serialization.PrivateFormat.PKCS8,
+                             encryption_algorithm=serialization.NoEncryption())
+
+
+def key_name(pkey_pem: bytes) -> typing.Optional[str]:
+    """rsa and the key size, or the EC type name, of a PEM private key, None when it is none of them."""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+    try:
+        key = serialization.load_pem_private_key(pkey_pem, password=None)
+    except (ValueError, TypeError) as err:
+        log.warning(f'Load private key fail: {err}')
+        return None
+    if isinstance(key, rsa.RSAPrivateKey):
+        return f'rsa{key.key_size}'
+    if isinstance(key, ec.EllipticCurvePrivateKey):
+        for name, curve in EC_CURVES.items():
+            if isinstance(key.curve, getattr(ec, curve)):
+                return name
+    return None
+
+
+def configured_key_name(key_type: str, bits: int) -> str:
+    """The key_name of the keys generate_key makes."""
+    return f'rsa{bits}' if key_type == 'rsa' else key_type
+
+
+class KeyPool:
+    """
+    Generate keys in worker processes ahead of use.
+    At most size keys are generated or waiting at a time, and no more than demand keys in total.
+    """
+
+    def __init__(self, key_type: str, bits: int, demand: int, size: int):
+        self.key_type = key_type
+        self.bits = bits
+        self._demand = demand
+        self._futures = collections.deque[Future]()
+        self._lock = threading.Lock()
+        self._executor = ProcessPoolExecutor(max_workers=size)
+        log.info(f'Pre-generate {demand} {key_type} keys with {size} processes')
+        with self._lock:
+            for _ in range(min(size, demand)):
+                self._submit()
+
+    def _submit(self):
+        self._futures.append(self._executor.submit(generate_key, self.key_type, self.bits))
+        self._demand -= 1
+
+    def get(self) -> bytes:
+        with self._lock:
+            if len(self._futures) == 0:
+                future = None
+            else:
+                future = self._futures.popleft()
+                if self._demand > 0:
+                    self._submit()
+        if future is None:
+            return generate_key(self.key_type, self.bits)
+        return future.result()
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
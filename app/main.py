@@ -1,19 +1,45 @@
 import logging
+import os
+import shutil
 import sys
+import time
+import typing
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
-from .acme_client import ACMEClient
-from .config import load_config, app_config, domain_config
+from .config import AppConfig, CertConfig, Config, ConfigError, ConfigLoader
+from .hooks import run_deploy_hooks
 from .consts import *
+from .inventory import CertRecord, Inventory, file_version
+from .keygen import KeyPool, configured_key_name, key_name
+from .renewal_info import RenewalInfo, cert_id
+from .metrics import metrics
+from .ratelimit import flow
+
+if typing.TYPE_CHECKING:
+    from .acme_client import ACMEClient
 
 log = logging.getLogger(__name__)
 
 
-def init():
+def init(loader: typing.Optional[ConfigLoader] = None) -> Config:
     logging.basicConfig(format=LOG_FORMAT, level=DEFAULT_LOG_LEVEL, stream=sys.stdout)
     log.info('Initializing')
+    try:
+        return configure(loader)
+    except ConfigError as err:
+        log.error(err)
+        exit(os.EX_CONFIG)
+
 
-    load_config(CONFIG_FILENAME)
+def configure(loader: typing.Optional[ConfigLoader] = None) -> Config:
+    """
+    Load the config file, a loader kept between calls only parses the files that changed.
+    @raise ConfigError: the config files are not valid
+    """
+    config = (loader if loader is not None else ConfigLoader()).load(CONFIG_FILENAME)
+    app_config = config.app
 
     log_levels = ['CRITICAL', 'FATAL', 'ERROR', 'WARN', 'WARNING', 'INFO', 'DEBUG', 'NOTSET']
     if app_config.log_level in log_levels:
@@ -21,27 +47,110 @@ def init():
         logging.basicConfig(level=app_config.log_level)
     else:
         log.warning(f'Log level can only be set to {log_levels}, use default: {DEFAULT_LOG_LEVEL}')
+
+    engines = ['thread', 'async']
+    if app_config.engine not in engines:
+        log.warning(f'Engine can only be set to {engines}, use default: {DEFAULT_ENGINE}')
+        app_config.engine = DEFAULT_ENGINE
+
+    if app_config.cert_key_type not in CERT_KEY_TYPES:
+        log.warning(f'Cert key type can only be set to {CERT_KEY_TYPES}, use default: {DEFAULT_CERT_KEY_TYPE}')
+        app_config.cert_key_type = DEFAULT_CERT_KEY_TYPE
     Path(app_config.data_dir).mkdir(parents=True, exist_ok=True)
+    return config
+
+
+def write_synced(path: Path, data: bytes, mode: int):
+    """Write a new file and flush it to disk."""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode)
+    with open(fd, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def fsync_dir(path: Path):
+    """Flush the entries of a directory, so renames in it survive a crash."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def replace_symlink(link: Path, target: str):
+    """Point link at target in one rename, readers see the old or the new target, never none."""
+    tmp_link = link.with_name(f'.{link.name}.tmp')
+    tmp_link.unlink(missing_ok=True)
+    os.symlink(target, tmp_link)
+    os.replace(tmp_link, link)
+
+
+def key_comp_dir(save_dir: str) -> Path:
+    """The directory of the live key and chain, save_dir itself when they were saved before versions."""
+    live = Path(save_dir).joinpath(LIVE_LINK)
+    return live.resolve() if live.is_symlink() else Path(save_dir)
 
 
-def save_key_comp(save_dir: str, pkey_pem: bytes, fullchain_pem: bytes):
-    Path(save_dir).mkdir(parents=True, exist_ok=True)
+def save_key_comp(save_dir: str, pkey_pem: bytes, fullchain_pem: bytes) -> bool:
+    """
+    Save the key and chain as a new version and switch live over to it.
+    Content equal to the live one is not written again, return whether anything changed.
+    """
+    save_path = Path(save_dir)
+    save_path.mkdir(parents=True, exist_ok=True)
+    files = {PKEY_FILENAME: (pkey_pem, 0o600), FULLCHAIN_FILENAME: (fullchain_pem, 0o644)}
+
+    live_dir = key_comp_dir(save_dir)
+    unchanged = list[str]()
+    for filename, (data, _) in files.items():
+        try:
+            if live_dir.joinpath(filename).read_bytes() == data:
+                unchanged.append(filename)
+        except FileNotFoundError:
+            pass
+    if len(unchanged) == len(files):
+        log.info(f'Key and fullchain in {save_dir} unchanged, skip saving')
+        return False
 
-    pkey_file = Path(save_dir).joinpath(PKEY_FILENAME)
-    fullchain_file = Path(save_dir).joinpath(FULLCHAIN_FILENAME)
+    versions_dir = save_path.joinpath(VERSIONS_DIRNAME)
+    versions_dir.mkdir(exist_ok=True)
+    version = max((int(p.name) for p in versions_dir.iterdir() if p.name.isdigit()), default=0) + 1
+    version_dir = versions_dir.joinpath(str(version))
+    version_dir.mkdir()
+    for filename, (data, mode) in files.items():
+        path = version_dir.joinpath(filename)
+        if filename in unchanged:
+            # The renewed certificate reuses the key, share the file instead of writing it again.
+            try:
+                os.link(live_dir.joinpath(filename), path)
+                continue
+            except OSError:
+                pass
+        log.info(f'Save {filename} to {path}')
+        write_synced(path, data, mode)
+    fsync_dir(version_dir)
 
-    log.info(f'Save private key to {pkey_file}')
-    with open(pkey_file, 'wb') as f:
-        f.write(pkey_pem)
+    log.info(f'Switch {save_dir} to version {version}')
+    replace_symlink(save_path.joinpath(LIVE_LINK), f'{VERSIONS_DIRNAME}/{version}')
+    for filename in files:
+        link = save_path.joinpath(filename)
+        if not link.is_symlink():
+            replace_symlink(link, f'{LIVE_LINK}/{filename}')
+    fsync_dir(save_path)
 
-    log.info(f'Save fullchain to {pkey_file}')
-    with open(fullchain_file, 'wb') as f:
-        f.write(fullchain_pem)
+    versions = sorted((p for p in versions_dir.iterdir() if p.name.isdigit()), key=lambda p: int(p.name))
+    for old in versions[:-KEY_COMP_VERSIONS_KEPT]:
+        log.debug(f'Remove old version {old}')
+        shutil.rmtree(old, ignore_errors=True)
+    return True
 
 
 def load_key_comp(save_dir: str):
-    pkey_file = Path(save_dir).joinpath(PKEY_FILENAME)
-    fullchain_file = Path(save_dir).joinpath(FULLCHAIN_FILENAME)
+    # Both files from the same version, also when live switches over meanwhile.
+    key_dir = key_comp_dir(save_dir)
+    pkey_file = key_dir.joinpath(PKEY_FILENAME)
+    fullchain_file = key_dir.joinpath(FULLCHAIN_FILENAME)
     log.info(f'Load private key from {pkey_file}')
     try:
         with open(pkey_file, 'rb') as f:
@@ -60,30 +169,361 @@ def load_key_comp(save_dir: str):
     return pkey_pem, fullchain_pem
 
 
-def main():
-    init()
+def cert_not_after(fullchain_pem: bytes) -> datetime:
+    from cryptography import x509
 
-    acme_client = ACMEClient(app_config)
-    acme_client.load_account()
+    # The leaf certificate is the first one in the chain.
+    cert = x509.load_pem_x509_certificate(fullchain_pem)
+    return cert.not_valid_after.replace(tzinfo=timezone.utc)
 
-    for i_config in domain_config:
-        is_found = False
-        pkey_pem, fullchain_pem = bytes(), bytes()
+
+def cert_names(fullchain_pem: bytes) -> set[str]:
+    from cryptography import x509
+
+    cert = x509.load_pem_x509_certificate(fullchain_pem)
+    try:
+        san = cert.extensions.get_extension_for_class(x509.SubjectAlternativeName)
+    except x509.ExtensionNotFound:
+        return set()
+    return set(san.value.get_values_for_type(x509.DNSName))
+
+
+def read_cert_record(pkey_pem: bytes, fullchain_pem: bytes, version: typing.Optional[str]) -> CertRecord:
+    """@raise ValueError: the certificate can not be parsed"""
+    from cryptography import x509
+
+    cert = x509.load_pem_x509_certificate(fullchain_pem)
+    return CertRecord(sorted(cert_names(fullchain_pem)), key_name(pkey_pem), f'{cert.serial_number:x}',
+                      cert_not_after(fullchain_pem).timestamp(), version, cert_id(cert))
+
+
+def open_inventory(app_config: AppConfig) -> Inventory:
+    return Inventory(Path(app_config.data_dir).joinpath(INVENTORY_FILENAME))
+
+
+def suggested_renewal(cert: CertConfig, record: CertRecord, app_config: AppConfig,
+                      inventory: typing.Optional[Inventory],
+                      renewal_info: typing.Optional[typing.Callable[[str], RenewalInfo]],
+                      window_start: bool = False) -> typing.Optional[datetime]:
+    """
+    When the CA suggests renewing the certificate (ARI), None when it suggests nothing.
+    Its answer is kept in the inventory, renewal_info asks it again once the answer is stale.
+    The daemon wakes up at a random time in the window, window_start renews as soon as the window starts,
+    for one-shot runs that can not wake up at that time and would find the random one between two runs.
+    """
+    if app_config.renewal_info_max_age <= 0 or inventory is None or record.cert_id is None:
+        return None
+    cached = inventory.renewal_info(cert.save_dir, record.cert_id)
+    if renewal_info is not None and (cached is None or cached[2] <= time.time()):
+        info = renewal_info(record.cert_id)
+        inventory.record_renewal_info(cert.save_dir, record.cert_id, info)
+        if info.start is not None:
+            log.info(f'CA suggests renewing {cert.name} between {datetime.fromtimestamp(info.start, timezone.utc)}'
+                     f' and {datetime.fromtimestamp(info.end, timezone.utc)}'
+                     + (f', see {info.explanation_url}' if info.explanation_url else ''))
+        cached = inventory.renewal_info(cert.save_dir, record.cert_id)
+    if cached is None:
+        return None
+    start, renew_at, _ = cached
+    if window_start:
+        renew_at = start
+    return datetime.fromtimestamp(renew_at, timezone.utc) if renew_at is not None else None
+
+
+def check_cert(cert: CertConfig, app_config: AppConfig, inventory: typing.Optional[Inventory] = None,
+               renewal_info: typing.Optional[typing.Callable[[str], RenewalInfo]] = None,
+               window_start: bool = False) -> tuple[datetime, typing.Optional[bytes]]:
+    """
+    When the certificate should be renewed, and the private key to reuse, None for a new key.
+    While the saved fullchain is the one the inventory recorded, the files are not parsed again,
+    and the private key is only read once the certificate is due.
+    The time the CA suggests wins over renew_before_days, renewal_info asks the CA for it,
+    see suggested_renewal for window_start.
+    """
+    now = datetime.now(timezone.utc)
+    version = file_version(Path(cert.save_dir).joinpath(FULLCHAIN_FILENAME))
+    record = inventory.cert_record(cert.save_dir, version) if inventory is not None else None
+    pkey_pem = None
+    if record is None:
         try:
-            pkey_pem, fullchain_pem = load_key_comp(i_config.save_dir)
-            is_found = True
+            pkey_pem, fullchain_pem = load_key_comp(cert.save_dir)
         except FileNotFoundError:
-            pass
+            return now, None
+        try:
+            record = read_cert_record(pkey_pem, fullchain_pem, version)
+        except ValueError as err:
+            log.warning(f'Parse certificate of {cert.name} fail, renew it: {err}')
+            return now, pkey_pem
+        if inventory is not None:
+            inventory.record_cert(cert.save_dir, cert.name, record)
+
+    if record.key_type != configured_key_name(app_config.cert_key_type, app_config.cert_pkey_bits):
+        log.info(f'Key type of {cert.name} changed, issue it with a new {app_config.cert_key_type} key')
+        return now, None
+
+    if set(record.names) != set(cert.names):
+        log.info(f'Names of {cert.name} changed, renew it: {sorted(record.names)} -> {sorted(cert.names)}')
+        renew_at = now
+    else:
+        renew_at = suggested_renewal(cert, record, app_config, inventory, renewal_info, window_start)
+        if renew_at is None:
+            renew_at = (datetime.fromtimestamp(record.not_after, timezone.utc)
+                        - timedelta(days=app_config.renew_before_days))
+    if renew_at <= now and pkey_pem is None:
+        try:
+            pkey_pem, _ = load_key_comp(cert.save_dir)
+        except FileNotFoundError:
+            return now, None
+    return renew_at, pkey_pem
+
+
+def backoff_until(cert: CertConfig, inventory: typing.Optional[Inventory]) -> typing.Optional[datetime]:
+    """When a certificate that failed in a row may be tried again, None if it is not backing off."""
+    row = inventory.get(cert.save_dir) if inventory is not None else None
+    if row is None or row['failures'] == 0:
+        return None
+    return datetime.fromtimestamp(row['next_attempt'], timezone.utc)
+
+
+def find_due(certs: list[CertConfig], app_config: AppConfig, inventory: typing.Optional[Inventory] = None,
+             renewal_info: typing.Optional[typing.Callable[[str], RenewalInfo]] = None) \
+        -> list[tuple[CertConfig, typing.Optional[bytes]]]:
+    # Certificate config and its private key to reuse, None for a new certificate.
+    due = list[tuple[CertConfig, typing.Optional[bytes]]]()
+    for cert in certs:
+        retry_at = backoff_until(cert, inventory)
+        if retry_at is not None and retry_at > datetime.now(timezone.utc):
+            log.info(f'Skip {cert.name}, it keeps failing, retry after {retry_at} or run with --force')
+            continue
+        # Runs from a timer renew once the CA's window starts, the next run may be after it ends.
+        renew_at, pkey_pem = check_cert(cert, app_config, inventory, renewal_info, window_start=True)
+        # After check_cert, a certificate it finds due is due right now.
+        if renew_at > datetime.now(timezone.utc):
+            log.info(f'Skip {cert.name}, renew after {renew_at}')
+            continue
+        log.info(f'Renewal due: {cert.name}')
+        due.append((cert, pkey_pem))
+    return due
+
+
+def save_cert(acme_client: 'ACMEClient', cert: CertConfig, pkey_pem: bytes, fullchain_pem: bytes) -> bool:
+    """Save the key and chain and record them in the inventory, return whether the saved files changed."""
+    changed = save_key_comp(cert.save_dir, pkey_pem, fullchain_pem)
+    if acme_client.inventory is not None:
+        version = file_version(Path(cert.save_dir).joinpath(FULLCHAIN_FILENAME))
+        acme_client.inventory.record_cert(cert.save_dir, cert.name,
+                                          read_cert_record(pkey_pem, fullchain_pem, version), success=True)
+    return changed
+
+
+def record_failure(acme_client: 'ACMEClient', cert: CertConfig, err: Exception):
+    if acme_client.inventory is None:
+        return
+    next_attempt = acme_client.inventory.record_failure(cert.save_dir, cert.name, repr(err),
+                                                        acme_client.config.daemon_retry_interval,
+                                                        acme_client.config.retry_max_interval)
+    log.info(f'Retry {cert.name} after {datetime.fromtimestamp(next_attempt, timezone.utc)}')
+
+
+def process_cert(acme_client: 'ACMEClient', cert: CertConfig, pkey_pem: typing.Optional[bytes]) -> bool:
+    """Issue or renew cert and save it, return whether the saved files changed."""
+    # Requests are queued fairly between certificates.
+    with metrics.phase(cert.name, 'total'), flow(cert.name):
+        if pkey_pem is None:
+            pkey_pem, fullchain_pem = acme_client.issue_cert(cert)
+        else:
+            _, fullchain_pem = acme_client.renew(cert, pkey_pem)
+
+        with metrics.phase(cert.name, 'save'):
+            return save_cert(acme_client, cert, pkey_pem, fullchain_pem)
+
+
+def run_thread(acme_client: 'ACMEClient', due: list[tuple[CertConfig, typing.Optional[bytes]]],
+               max_workers: int) -> tuple[list[str], list[CertConfig]]:
+    failed = list[str]()
+    changed = list[CertConfig]()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(process_cert, acme_client, cert, pkey_pem): (cert, pkey_pem)
+                   for cert, pkey_pem in due}
+        for future in as_completed(futures):
+            cert, pkey_pem = futures[future]
+            try:
+                if future.result():
+                    changed.append(cert)
+                log.info(f'Done: {cert.name}')
+                metrics.record_result(cert.name, 'issued' if pkey_pem is None else 'renewed')
+            except Exception as err:
+                log.error(f'Failed: {cert.name}, {err!r}')
+                metrics.record_result(cert.name, 'failed', err)
+                acme_client.handle_error(err)
+                record_failure(acme_client, cert, err)
+                failed.append(cert.name)
+    return failed, changed
+
+
+def process_due(acme_client: 'ACMEClient', due: list[tuple[CertConfig, typing.Optional[bytes]]]) \
+        -> tuple[list[str], list[str]]:
+    """
+    Issue or renew the due certificates, then run the deploy hooks of the changed ones.
+    Return the names of the failed certificates and the failed hook commands.
+    """
+    app_config = acme_client.config
+    # Records, nameservers and CNAMEs are cached for one run, a daemon keeps its client across runs.
+    acme_client.clear_run_cache()
+    new_keys = len([pkey_pem for _, pkey_pem in due if pkey_pem is None])
+    if app_config.cert_key_type == 'rsa' and app_config.key_pool_size > 0 and new_keys > 1:
+        # Start generating before the account is loaded, keys are ready when orders need them.
+        acme_client.key_pool = KeyPool(app_config.cert_key_type, app_config.cert_pkey_bits,
+                                       new_keys, app_config.key_pool_size)
+    try:
+        # A daemon loads the account once, and again only after the CA rejects it.
+        if not acme_client.account_loaded():
+            acme_client.load_account()
 
-        if not is_found:
-            pkey_pem, fullchain_pem = acme_client.issue_cert(i_config.domain)
+        max_workers = max(app_config.max_workers, 1)
+        log.info(f'Process {len(due)} certificates with {app_config.engine} engine, {max_workers} workers')
+        if app_config.engine == 'async':
+            # asyncio is only imported when the async engine runs.
+            from .async_engine import run_async_engine
+            failed, changed = run_async_engine(acme_client, due, max_workers)
         else:
-            _, fullchain_pem = acme_client.renew(i_config.domain, pkey_pem)
+            failed, changed = run_thread(acme_client, due, max_workers)
+    finally:
+        if acme_client.key_pool is not None:
+            acme_client.key_pool.close()
+            acme_client.key_pool = None
 
-        save_key_comp(i_config.save_dir, pkey_pem, fullchain_pem)
+    # Once for the whole run, a reload of a shared server covers all of its certificates.
+    return failed, run_deploy_hooks(changed, app_config)
+
+
+def export_metrics(config: Config, acme_client: typing.Optional['ACMEClient'] = None,
+                   inventory: typing.Optional[Inventory] = None):
+    """
+    Write the metrics and days to expiry of every configured certificate to data_dir.
+    The expiry is read from the inventory when given, else from the saved certificates.
+    """
+    app_config = config.app
+    textfile = None
+    if len(app_config.metrics_textfile) != 0:
+        textfile = Path(app_config.data_dir).joinpath(app_config.metrics_textfile)
+    summary_file = None
+    if len(app_config.metrics_summary) != 0:
+        summary_file = Path(app_config.data_dir).joinpath(app_config.metrics_summary)
+    if textfile is None and summary_file is None:
+        return
+
+    now = datetime.now(timezone.utc)
+    expiry_days = dict[str, float]()
+    # save_dir -> unix time, one query instead of parsing every certificate
+    not_after = None
+    if inventory is not None:
+        not_after = {row['save_dir']: row['not_after'] for row in inventory.all()}
+    for cert in config.certs:
+        if not_after is not None:
+            if not_after.get(cert.save_dir) is not None:
+                expiry_days[cert.name] = (not_after[cert.save_dir] - now.timestamp()) / 86400
+            continue
+        try:
+            fullchain_pem = Path(cert.save_dir).joinpath(FULLCHAIN_FILENAME).read_bytes()
+            expiry_days[cert.name] = (cert_not_after(fullchain_pem) - now).total_seconds() / 86400
+        except (OSError, ValueError):
+            continue
+
+    dns_calls, dns_errors = None, None
+    if acme_client is not None:
+        dns_calls, dns_errors = dict(acme_client.dns_client.calls), dict(acme_client.dns_client.errors)
+    metrics.export(textfile, summary_file, expiry_days, dns_calls, dns_errors)
+
+
+def main(force: bool = False):
+    """@param force: try certificates that keep failing right away, instead of after their backoff"""
+    started, t0 = time.time(), time.perf_counter()
+    config = init()
+    inventory = open_inventory(config.app)
+    if force:
+        log.info(f'Reset the backoff of {inventory.reset_backoff()} failing certificates')
+    acme_client: typing.Optional['ACMEClient'] = None
+
+    def new_acme_client() -> 'ACMEClient':
+        # The ACME and Alidns SDKs are only imported when there is work to do, asking the CA for renewal info is.
+        from .acme_client import ACMEClient
+        client = ACMEClient(config.app)
+        client.inventory = inventory
+        return client
+
+    def renewal_info(cert_id: str) -> RenewalInfo:
+        nonlocal acme_client
+        if acme_client is None:
+            acme_client = new_acme_client()
+        return acme_client.get_renewal_info(cert_id)
+
+    due = find_due(config.certs, config.app, inventory, renewal_info)
+    if len(due) == 0:
+        log.info('No certificate is due for renewal, exit')
+        metrics.record_run(started, time.perf_counter() - t0)
+        export_metrics(config, acme_client, inventory)
+        return
+
+    if acme_client is None:
+        acme_client = new_acme_client()
+    failed, failed_hooks = process_due(acme_client, due)
+    metrics.record_run(started, time.perf_counter() - t0)
+    export_metrics(config, acme_client, inventory)
+
+    if len(failed) != 0:
+        log.error(f'{len(failed)} of {len(due)} certificates failed: {failed}')
+    if len(failed_hooks) != 0:
+        log.error(f'{len(failed_hooks)} deploy hooks failed: {failed_hooks}')
+    if len(failed) != 0 or len(failed_hooks) != 0:
+        exit(os.EX_SOFTWARE)
 
     log.info('Done and exit')
 
 
+def status():
+    """Print what the inventory knows about every configured certificate, soonest to expire first."""
+    config = init()
+    inventory = open_inventory(config.app)
+    for cert in config.certs:
+        # Brings the rows of certificates changed on disk up to date.
+        check_cert(cert, config.app, inventory)
+    rows = {row['save_dir']: row for row in inventory.all()}
+
+    def fmt(timestamp: typing.Optional[float]) -> str:
+        if not timestamp:
+            return '-'
+        return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%d %H:%M')
+
+    def expires(cert: CertConfig) -> float:
+        row = rows.get(cert.save_dir)
+        return row['not_after'] if row is not None and row['not_after'] is not None else float('inf')
+
+    certs = sorted(config.certs, key=expires)
+    print(f"{'证书':32s} {'过期时间':16s} {'建议续签':16s} {'上次成功':16s} {'连续失败':>8s} {'下次重试':16s}"
+          f" 错误")
+    for cert in certs:
+        row = rows.get(cert.save_dir)
+        if row is None:
+            print(f'{cert.name:32s} 未签发')
+            continue
+        print(f"{cert.name:32s} {fmt(row['not_after']):16s} {fmt(row['ari_renew_at']):16s}"
+              f" {fmt(row['last_success']):16s} {row['failures']:8d}"
+              f" {fmt(row['next_attempt']) if row['failures'] != 0 else '-':16s} {row['last_error'] or ''}")
+
+    configured = {cert.save_dir for cert in config.certs}
+    now = time.time()
+    expiring = [row['name'] for row in inventory.expiring(now + config.app.renew_before_days * 86400)
+                if row['save_dir'] in configured]
+    if len(expiring) != 0:
+        print(f'\n{config.app.renew_before_days} 天内过期: {", ".join(expiring)}')
+    failed = [row['name'] for row in inventory.failed_since(now - STATUS_RECENT_FAILURES)
+              if row['save_dir'] in configured]
+    if len(failed) != 0:
+        print(f'\n最近 {STATUS_RECENT_FAILURES // 3600} 小时内失败: {", ".join(failed)}')
+        print('修复后可使用 --force 立即重试')
+    inventory.close()
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,170 @@
+import collections
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+import typing
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+PREFIX = 'certbot_aliyun'
+
+
+def error_class(err: BaseException) -> str:
+    """The ACME problem type of an ACME error, e.g. rateLimited, the exception class name otherwise."""
+    typ = getattr(err, 'typ', None)
+    if isinstance(typ, str) and len(typ) != 0:
+        return typ.rsplit(':', 1)[-1]
+    return type(err).__name__
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels) -> str:
+    if len(labels) == 0:
+        return ''
+    text = ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+    return f'{{{text}}}'
+
+
+def write_atomic(path: typing.Union[str, Path], text: str):
+    """Write to a temporary file in the same directory and rename it, readers never see a partial file."""
+    path = Path(path)
+    tmp_path = path.with_name(f'.{path.name}.tmp')
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+class Metrics:
+    """
+    Timings and counters of certificate runs, kept for the life of the process,
+    so the daemon accumulates counters over its runs.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (certificate, phase) -> seconds, the last time the phase ran
+        self.phase_last = dict[tuple[str, str], float]()
+        self.phase_sum = collections.Counter[str]()
+        self.phase_count = collections.Counter[str]()
+        # issued / renewed / failed
+        self.results = collections.Counter[str]()
+        # Failures by error class
+        self.failures = collections.Counter[str]()
+        # Certificate -> 1 when its last run succeeded, 0 when it failed
+        self.last_success = dict[str, int]()
+        self.last_run_time = 0.0
+        self.last_run_seconds = 0.0
+
+    def observe(self, cert: str, phase: str, seconds: float):
+        with self._lock:
+            self.phase_last[(cert, phase)] = seconds
+            self.phase_sum[phase] += seconds
+            self.phase_count[phase] += 1
+
+    @contextlib.contextmanager
+    def phase(self, cert: str, phase: str):
+        """Time the block as one phase of cert, also when it raises."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(cert, phase, time.perf_counter() - t0)
+
+    def record_result(self, cert: str, result: str, err: typing.Optional[BaseException] = None):
+        with self._lock:
+            self.results[result] += 1
+            self.last_success[cert] = 0 if err is not None else 1
+            if err is not None:
+                self.failures[error_class(err)] += 1
+
+    def record_run(self, started: float, seconds: float):
+        with self._lock:
+            self.last_run_time = started
+            self.last_run_seconds = seconds
+
+    def render(self, expiry_days: dict[str, float], dns_calls: typing.Optional[dict[str, int]] = None,
+               dns_errors: typing.Optional[dict[tuple[str, str], int]] = None) -> str:
+        """The Prometheus text exposition format, for the node-exporter textfile collector."""
+        lines = list[str]()
+
+        def metric(name: str, typ: str, doc: str, samples: typing.Iterable[tuple[dict, float]]):
+            lines.append(f'# HELP {PREFIX}_{name} {doc}')
+            lines.append(f'# TYPE {PREFIX}_{name} {typ}')
+            for labels, value in samples:
+                lines.append(f'{PREFIX}_{name}{_labels(**labels)} {value}')
+
+        with self._lock:
+            metric('last_run_timestamp_seconds', 'gauge', 'Unix time the last run started.',
+                   [({}, self.last_run_time)])
+            metric('last_run_duration_seconds', 'gauge', 'Wall time of the last run.',
+                   [({}, self.last_run_seconds)])
+            metric('cert_expiry_days', 'gauge', 'Days until the saved certificate expires.',
+                   [({'cert': cert}, days) for cert, days in sorted(expiry_days.items())])
+            metric('cert_last_success', 'gauge', '1 when the last issue or renewal succeeded, 0 when it failed.',
+                   [({'cert': cert}, value) for cert, value in sorted(self.last_success.items())])
+            metric('phase_seconds', 'gauge', 'Time of each phase the last time a certificate went through it.',
+                   [({'cert': cert, 'phase': phase}, seconds)
+                    for (cert, phase), seconds in sorted(self.phase_last.items())])
+
+            lines.append(f'# HELP {PREFIX}_phase_duration_seconds Time of each phase over all certificates.')
+            lines.append(f'# TYPE {PREFIX}_phase_duration_seconds summary')
+            for phase in sorted(self.phase_count):
+                lines.append(f'{PREFIX}_phase_duration_seconds_sum{_labels(phase=phase)} {self.phase_sum[phase]}')
+                lines.append(f'{PREFIX}_phase_duration_seconds_count{_labels(phase=phase)} {self.phase_count[phase]}')
+
+            metric('certificates_total', 'counter', 'Certificates processed, by result.',
+                   [({'result': result}, count) for result, count in sorted(self.results.items())])
+            metric('failures_total', 'counter', 'Failed certificates, by error class.',
+                   [({'error': error}, count) for error, count in sorted(self.failures.items())])
+
+        metric('alidns_calls_total', 'counter', 'Alidns API calls, by action.',
+               [({'action': action}, count) for action, count in sorted((dns_calls or {}).items())])
+        metric('alidns_errors_total', 'counter', 'Alidns API errors, by action and error code.',
+               [({'action': action, 'code': code}, count)
+                for (action, code), count in sorted((dns_errors or {}).items())])
+        return '\n'.join(lines) + '\n'
+
+    def summary(self, expiry_days: dict[str, float], dns_calls: typing.Optional[dict[str, int]] = None,
+                dns_errors: typing.Optional[dict[tuple[str, str], int]] = None) -> dict:
+        """The same data as render, as a JSON object."""
+        with self._lock:
+            certs = {cert: {'expiry_days': expiry_days.get(cert), 'last_success': self.last_success.get(cert),
+                            'phases': dict()}
+                     for cert in sorted(set(expiry_days) | set(self.last_success))}
+            for (cert, phase), seconds in self.phase_last.items():
+                if cert in certs:
+                    certs[cert]['phases'][phase] = seconds
+            return {'last_run_time': self.last_run_time,
+                    'last_run_seconds': self.last_run_seconds,
+                    'certificates': certs,
+                    'phases': {phase: {'count': self.phase_count[phase], 'sum': self.phase_sum[phase]}
+                               for phase in sorted(self.phase_count)},
+                    'results': dict(self.results),
+                    'failures': dict(self.failures),
+                    'alidns_calls': dict(dns_calls or {}),
+                    'alidns_errors': [{'action': action, 'code': code, 'count': count}
+                                      for (action, code), count in sorted((dns_errors or {}).items())]}
+
+    def export(self, textfile: typing.Optional[Path], summary_file: typing.Optional[Path],
+               expiry_days: dict[str, float], dns_calls: typing.Optional[dict[str, int]] = None,
+               dns_errors: typing.Optional[dict[tuple[str, str], int]] = None):
+        """Write the textfile and the JSON summary, each only when its path is given."""
+        try:
+            if textfile is not None:
+                log.debug(f'Write metrics to {textfile}')
+                write_atomic(textfile, self.render(expiry_days, dns_calls, dns_errors))
+            if summary_file is not None:
+                log.debug(f'Write run summary to {summary_file}')
+                write_atomic(summary_file, json.dumps(self.summary(expiry_days, dns_calls, dns_errors), indent=4))
+        except OSError as err:
+            log.warning(f'Write metrics fail: {err}')
+
+
+metrics = Metrics()
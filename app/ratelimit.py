@@ -0,0 +1,132 @@
+import collections
+import contextlib
+import contextvars
+import functools
+import logging
+import threading
+import time
+import typing
+
+log = logging.getLogger(__name__)
+
+# Budget names
+ACME = 'acme'
+ACME_NEW_ORDER = 'acme_new_order'
+ALIDNS = 'alidns'
+# Waits longer than this are logged at INFO, in seconds
+LOG_WAIT = 1.0
+
+# The certificate the current call is made for, requests are queued fairly between certificates.
+current_flow = contextvars.ContextVar('rate_limit_flow', default='')
+
+
+@contextlib.contextmanager
+def flow(name: str):
+    """Calls made in the block, also by asyncio.to_thread, are queued as those of name."""
+    token = current_flow.set(name)
+    try:
+        yield
+    finally:
+        current_flow.reset(token)
+
+
+def in_flow(func):
+    """Bind func to the current flow, for work handed to a thread pool, which does not copy the context."""
+    name = current_flow.get()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with flow(name):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+class TokenBucket:
+    """
+    At most rate requests a second on average, and burst at once. A rate of 0 means no limit,
+    but a pause asked by the server is still honoured.
+    Callers waiting for a token are served one flow at a time in turn, so a certificate with many names
+    does not starve the others.
+    """
+
+    def __init__(self, name: str, rate: float, burst: float):
+        self.name = name
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._cond = threading.Condition()
+        # Flow -> its waiting tickets, the first flow is the next to be served
+        self._queues = collections.OrderedDict[str, collections.deque]()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _delay(self, now: float) -> float:
+        """Seconds before the next token can be taken."""
+        delay = self.paused_until - now
+        if self.rate > 0 and self.tokens < 1:
+            delay = max(delay, (1 - self.tokens) / self.rate)
+        return delay
+
+    def acquire(self):
+        """Block until it is the turn of the current flow and a token is available, then take it."""
+        name = current_flow.get()
+        ticket = object()
+        t0 = time.monotonic()
+        with self._cond:
+            self._queues.setdefault(name, collections.deque()).append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self._queues[next(iter(self._queues))][0] is ticket:
+                        delay = self._delay(now)
+                        if delay <= 0:
+                            break
+                        self._cond.wait(delay)
+                    else:
+                        self._cond.wait()
+            finally:
+                queue = self._queues.pop(name)
+                queue.remove(ticket)
+                if len(queue) != 0:
+                    # To the back of the turn order.
+                    self._queues[name] = queue
+                self._cond.notify_all()
+            if self.rate > 0:
+                self.tokens -= 1
+
+        waited = time.monotonic() - t0
+        if waited >= LOG_WAIT:
+            log.info(f'Wait {waited:.1f} s for the {self.name} rate limit: {name}')
+
+    def pause(self, seconds: float):
+        """Hold every caller for seconds, when the server says it is overloaded or throttling us."""
+        with self._cond:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self._cond.notify_all()
+        log.info(f'Pause {self.name} requests for {seconds:.1f} s')
+
+    def paused_for(self) -> float:
+        """Seconds left of the current pause."""
+        with self._cond:
+            return max(self.paused_until - time.monotonic(), 0)
+
+
+class RateLimiter:
+    """The request budget of every endpoint, shared by all certificates and workers of the process."""
+
+    def __init__(self, budgets: dict[str, tuple[float, float]]):
+        """budgets: name -> (requests a second, burst)"""
+        self.buckets = {name: TokenBucket(name, rate, burst) for name, (rate, burst) in budgets.items()}
+
+    def __getitem__(self, name: str) -> TokenBucket:
+        return self.buckets[name]
+
+    def describe(self) -> typing.Iterator[str]:
+        for bucket in self.buckets.values():
+            limit = f'{bucket.rate:g}/s, burst {bucket.burst:g}' if bucket.rate > 0 else 'no limit'
+            yield f'{bucket.name}: {limit}'
@@ -0,0 +1,72 @@
+import base64
+import random
+import re
+import typing
+from datetime import datetime
+
+if typing.TYPE_CHECKING:
+    from cryptography import x509
+
+
+class RenewalInfo:
+    """
+    The window a CA suggests renewing a certificate in (ACME Renewal Information, RFC 9773), and when to ask
+    again. Unix times, start and end are None when the CA suggests no window.
+    """
+
+    def __init__(self, start: typing.Optional[float], end: typing.Optional[float], retry_at: float,
+                 explanation_url: typing.Optional[str] = None):
+        self.start = start
+        self.end = end
+        self.retry_at = retry_at
+        self.explanation_url = explanation_url
+
+    def pick(self) -> float:
+        """A uniformly random time in the window, so renewals spread the way the CA wants them to."""
+        return random.uniform(self.start, self.end)
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def cert_id(cert: 'x509.Certificate') -> typing.Optional[str]:
+    """The ARI identifier of a certificate, None when it has no authority key identifier."""
+    from cryptography import x509
+
+    try:
+        aki = cert.extensions.get_extension_for_class(x509.AuthorityKeyIdentifier).value.key_identifier
+    except x509.ExtensionNotFound:
+        return None
+    if aki is None:
+        return None
+    # The bytes of the DER encoded serial, with a leading zero when the high bit is set.
+    serial = cert.serial_number
+    return f"{_b64encode(aki)}.{_b64encode(serial.to_bytes(serial.bit_length() // 8 + 1, 'big'))}"
+
+
+def parse_time(text: str) -> float:
+    """
+    An RFC 3339 time as unix time. Before Python 3.11 fromisoformat reads neither the Z suffix
+    nor other than 3 or 6 fractional digits, so they are rewritten first.
+    @raise ValueError: text is not an RFC 3339 time
+    """
+    match = re.fullmatch(r'(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.(\d+))?(Z|[+-]\d\d:\d\d)', text.strip().upper())
+    if match is None:
+        raise ValueError(f'Bad time {text}')
+    seconds, fraction, offset = match.groups()
+    fraction = f'.{(fraction + "000000")[:6]}' if fraction else ''
+    return datetime.fromisoformat(seconds + fraction + ('+00:00' if offset == 'Z' else offset)).timestamp()
+
+
+def parse(document: dict, retry_at: float) -> RenewalInfo:
+    """@raise ValueError: the document is not a renewal info"""
+    try:
+        window = document['suggestedWindow']
+        start = parse_time(window['start'])
+        end = parse_time(window['end'])
+    except (KeyError, TypeError, AttributeError) as err:
+        raise ValueError(f'Bad renewal info {document}: {err!r}') from err
+    if end < start:
+        raise ValueError(f'Renewal window ends before it starts: {window}')
+    return RenewalInfo(start, end, retry_at, document.get('explanationURL'))
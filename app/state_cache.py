@@ -0,0 +1,73 @@
+import json
+import logging
+import os
+import threading
+import time
+import typing
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+
+class StateCache:
+    """
+    ACME state kept in data_dir between runs: the directory document and the
+    account URI whose registration was last verified, each with the time it was stored.
+    """
+
+    def __init__(self, path: typing.Union[str, Path], directory_url: str):
+        self.path = Path(path)
+        self.directory_url = directory_url
+        self._lock = threading.Lock()
+        self._state = dict()
+        try:
+            with open(self.path) as f:
+                self._state = json.load(f)
+        except FileNotFoundError:
+            pass
+        except ValueError as err:
+            log.warning(f'Ignore broken state cache {self.path}: {err}')
+        if self._state.get('directory_url') != directory_url:
+            self._state = {'directory_url': directory_url}
+
+    def _fresh(self, key: str, ttl: float) -> typing.Optional[dict]:
+        entry = self._state.get(key)
+        if entry is None or time.time() - entry.get('time', 0) > ttl:
+            return None
+        return entry
+
+    def get_directory(self, ttl: float) -> typing.Optional[dict]:
+        with self._lock:
+            entry = self._fresh('directory', ttl)
+        return None if entry is None else entry['document']
+
+    def set_directory(self, document: dict):
+        with self._lock:
+            self._state['directory'] = {'time': time.time(), 'document': document}
+            self._save()
+
+    def registration_verified(self, uri: str, ttl: float) -> bool:
+        with self._lock:
+            entry = self._fresh('registration', ttl)
+        return entry is not None and entry['uri'] == uri
+
+    def set_registration(self, uri: str):
+        with self._lock:
+            self._state['registration'] = {'time': time.time(), 'uri': uri}
+            self._save()
+
+    def invalidate(self):
+        with self._lock:
+            if len(self._state) > 1:
+                log.info('Invalidate ACME state cache')
+                self._state = {'directory_url': self.directory_url}
+                self._save()
+
+    def _save(self):
+        tmp_path = self.path.with_name(f'{self.path.name}.tmp')
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self._state, f, indent=4)
+            os.replace(tmp_path, self.path)
+        except OSError as err:
+            log.warning(f'Save state cache {self.path} fail: {err}')
@@ -0,0 +1,181 @@
+import collections
+import contextlib
+import functools
+import inspect
+import logging
+import math
+import sys
+import threading
+import time
+import typing
+from urllib.parse import urlsplit
+
+log = logging.getLogger(__name__)
+
+# Upper bounds of the latency histogram buckets, seconds
+BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+# ali_dns.Client methods that are timed
+ALIDNS_METHODS = ['find_records_by_type', 'get_nameservers', 'add_record', 'update_record', 'delete_record',
+                  'set_challenge_dns', 'clean_challenge_dns']
+TRACEMALLOC_FRAMES = 10
+TRACEMALLOC_TOP = 30
+
+
+def _percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[max(math.ceil(p / 100 * len(values)) - 1, 0)]
+
+
+def _bucket_label(bound: float) -> str:
+    return f'<={bound * 1000:g}ms' if bound < 1 else f'<={bound:g}s'
+
+
+class Tracer:
+    """Durations of every traced call, by call name."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.spans = collections.defaultdict[str, list[float]](list)
+
+    def record(self, name: str, seconds: float):
+        with self._lock:
+            self.spans[name].append(seconds)
+        log.debug(f'Span {name}: {seconds * 1000:.1f} ms')
+
+    def report(self) -> str:
+        with self._lock:
+            spans = {name: list(values) for name, values in self.spans.items()}
+        lines = [f"{'call':44s} {'count':>6s} {'total s':>9s} {'mean ms':>9s} {'p50 ms':>9s} {'p90 ms':>9s}"
+                 f" {'p99 ms':>9s} {'max ms':>9s}"]
+        # The calls that took the most time in total first.
+        for name, values in sorted(spans.items(), key=lambda item: -sum(item[1])):
+            total = sum(values)
+            lines.append(f'{name:44s} {len(values):6d} {total:9.3f} {total / len(values) * 1000:9.1f}'
+                         f' {_percentile(values, 50) * 1000:9.1f} {_percentile(values, 90) * 1000:9.1f}'
+                         f' {_percentile(values, 99) * 1000:9.1f} {max(values) * 1000:9.1f}')
+            counts = [0] * (len(BUCKETS) + 1)
+            for value in values:
+                counts[next((i for i, bound in enumerate(BUCKETS) if value <= bound), len(BUCKETS))] += 1
+            labels = [_bucket_label(bound) for bound in BUCKETS] + [f'>{BUCKETS[-1]:g}s']
+            lines.append('    ' + ' '.join(f'{label}:{count}' for label, count in zip(labels, counts) if count != 0))
+        return '\n'.join(lines)
+
+
+def _traced(tracer: Tracer, name: typing.Union[str, typing.Callable[..., str]], func):
+    """Wrap func to record a span, name may be computed from the call arguments."""
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def gen_wrapper(*args, **kwargs):
+            # A generator does its work while it is consumed.
+            t0 = time.perf_counter()
+            try:
+                yield from func(*args, **kwargs)
+            finally:
+                tracer.record(name if isinstance(name, str) else name(*args, **kwargs), time.perf_counter() - t0)
+        return gen_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            tracer.record(name if isinstance(name, str) else name(*args, **kwargs), time.perf_counter() - t0)
+    return wrapper
+
+
+def url_pattern(url: str) -> str:
+    """The path of url with ids and tokens replaced by *, so calls to the same resource type group together."""
+    segments = urlsplit(url).path.split('/')
+    return '/'.join('*' if segment.isdigit() or len(segment) >= 16 else segment for segment in segments)
+
+
+def instrument(tracer: Tracer):
+    """Wrap the Alidns, ACME and DNS calls with spans. Only called when tracing, so it costs nothing otherwise."""
+    from ali_dns import resolver
+    from ali_dns.main import Client
+    from acme import client as acme_client
+
+    for method in ALIDNS_METHODS:
+        setattr(Client, method, _traced(tracer, f'alidns {method}', getattr(Client, method)))
+    # Each API request on its own, the methods above may make several.
+    Client._call = _traced(tracer, lambda _, action, *args: f'alidns api {action}', Client._call)
+    # Every ACME request, GET, HEAD and POST, goes through _send_request.
+    acme_client.ClientNetwork._send_request = _traced(
+        tracer, lambda _, method, url, *args, **kwargs: f'acme {method} {url_pattern(url)}',
+        acme_client.ClientNetwork._send_request)
+    resolver.query_txt = _traced(tracer, 'dns query_txt', resolver.query_txt)
+
+
+class Profiler:
+    """cProfile over the main and every new thread, with tracemalloc."""
+
+    def __init__(self, filename: str):
+        import cProfile
+        import tracemalloc
+
+        self.filename = filename
+        self._profiles = list['cProfile.Profile']()
+        self._lock = threading.Lock()
+
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        # cProfile only sees the thread it is enabled in, workers get their own.
+        threading.setprofile(self._start_thread)
+        self._main = cProfile.Profile()
+        self._main.enable()
+
+    def _start_thread(self, *_):
+        import cProfile
+
+        profile = cProfile.Profile()
+        with self._lock:
+            self._profiles.append(profile)
+        try:
+            # Replaces this hook for the rest of the thread.
+            profile.enable()
+        except ValueError:
+            sys.setprofile(None)
+
+    def dump(self):
+        import pstats
+        import tracemalloc
+
+        self._main.disable()
+        threading.setprofile(None)
+        stats = pstats.Stats(self._main)
+        with self._lock:
+            for profile in self._profiles:
+                stats.add(profile)
+        stats.dump_stats(self.filename)
+        log.info(f'Write cProfile stats to {self.filename}, read them with python -m pstats {self.filename}')
+
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        mem_filename = f'{self.filename}.mem'
+        with open(mem_filename, 'w') as f:
+            f.write(f'current {current / 1024:.1f} KiB, peak {peak / 1024:.1f} KiB\n')
+            for stat in snapshot.statistics('lineno')[:TRACEMALLOC_TOP]:
+                f.write(f'{stat}\n')
+        log.info(f'Write tracemalloc top allocations to {mem_filename}')
+
+
+@contextlib.contextmanager
+def session(trace: bool = False, profile: typing.Optional[str] = None):
+    """
+    Trace the calls made in the block, and profile it when a profile file name is given.
+    The latency report is printed to stderr when the block exits, also by exit().
+    """
+    if not trace and profile is None:
+        yield
+        return
+
+    tracer = Tracer()
+    instrument(tracer)
+    profiler = Profiler(profile) if profile is not None else None
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.dump()
+        print(tracer.report(), file=sys.stderr)
@@ -0,0 +1,6 @@
+"""
+End-to-end benchmarks against in-process stand-ins for the ACME server, the Alidns API and
+the authoritative nameservers, no request leaves the machine.
+
+    python -m bench.e2e
+"""
@@ -0,0 +1,187 @@
+"""
+End-to-end benchmark of app.main against local stand-ins for the ACME server, the Alidns API and
+the nameservers. Each domain count runs in a fresh interpreter, so peak RSS is per run.
+
+    python -m bench.e2e
+    python -m bench.e2e --domains 100 --engine async --workers 32 --acme-latency 0.05 --dns-error-rate 0.01
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from .fake import Faults, CallStats
+from .fake_acme import FakeACME
+from .fake_alidns import FakeAlidns
+from .fake_zone import FakeZone, FakeNameserver
+
+PROJ_DIR = Path(__file__).absolute().parent.parent
+BENCH_ZONE = 'bench.test'
+
+# Options passed on to the run of each domain count
+FORWARD_OPTIONS = ['engine', 'workers', 'key_type', 'acme_latency', 'dns_latency', 'jitter',
+                   'acme_error_rate', 'dns_error_rate', 'dns_error_code', 'validation_delay', 'challenge_zone', 'seed',
+                   'log_level']
+
+
+def write_config(path: Path, domains: int, acme: FakeACME, alidns: FakeAlidns, nameserver: FakeNameserver,
+                 args: argparse.Namespace):
+    lines = ['[APP]',
+             f'directory_url = {acme.directory_url}',
+             'access_key_id = bench',
+             'access_key_secret = bench',
+             'email = bench@example.com',
+             f'dns_endpoint = {alidns.endpoint}',
+             'dns_protocol = http',
+             f'cert_key_type = {args.key_type}',
+             f'engine = {args.engine}',
+             f'max_workers = {args.workers}',
+             f'log_level = {args.log_level}',
+             f"data_dir = {path.joinpath('run')}",
+             'propagation_interval = 1',
+             'poll_interval = 1',
+             '']
+    if args.challenge_zone is not None:
+        lines[-1:] = [f'challenge_zone = {args.challenge_zone}',
+                      f'challenge_resolvers = 127.0.0.1:{nameserver.port}',
+                      '']
+    for i in range(domains):
+        domain = f'd{i}.{BENCH_ZONE}'
+        lines += [f'[{domain}]', f'domain = {domain}', f"save_dir = {path.joinpath('save', domain)}", '']
+        if args.challenge_zone is not None:
+            # Delegated the way the docs ask, every challenge lands in the one challenge zone.
+            nameserver.zone.add(domain, '_acme-challenge', 'CNAME', f'{domain}.{args.challenge_zone}', 600)
+    path.joinpath('config.ini').write_text('\n'.join(lines))
+
+
+def run_once(args: argparse.Namespace, domains: int) -> dict:
+    import app
+    from app.consts import FULLCHAIN_FILENAME
+    from app.metrics import metrics
+
+    zone = FakeZone()
+    nameserver = FakeNameserver(zone).start()
+    alidns = FakeAlidns(zone, [f'127.0.0.1:{nameserver.port}'],
+                        Faults(args.dns_latency, args.jitter, args.dns_error_rate, args.seed),
+                        args.dns_error_code).start()
+    acme = FakeACME(zone, Faults(args.acme_latency, args.jitter, args.acme_error_rate, args.seed),
+                    args.validation_delay).start()
+    work = Path(tempfile.mkdtemp(prefix='certbot-bench-'))
+    try:
+        write_config(work, domains, acme, alidns, nameserver, args)
+        os.chdir(work)
+        t0 = time.perf_counter()
+        exit_code = 0
+        try:
+            app.main()
+        except SystemExit as err:
+            exit_code = err.code
+        wall = time.perf_counter() - t0
+        issued = len(list(work.joinpath('save').glob(f'*/{FULLCHAIN_FILENAME}')))
+    finally:
+        os.chdir(PROJ_DIR)
+        shutil.rmtree(work, ignore_errors=True)
+        acme.stop()
+        alidns.stop()
+        nameserver.stop()
+
+    # Phases as the app times them, one sample per certificate.
+    app_phases = CallStats()
+    for (_, phase), seconds in metrics.phase_last.items():
+        app_phases.record(phase, seconds)
+
+    return {'domains': domains,
+            'exit_code': exit_code,
+            'issued': issued,
+            'wall': wall,
+            # KiB on Linux, the fake servers live in the same process.
+            'peak_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'peak_rss_children_kib': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+            'app_phases': app_phases.summary(),
+            'phases': acme.phases.summary(),
+            'acme_calls': acme.stats.summary(),
+            'alidns_calls': alidns.stats.summary(),
+            'dns_queries': nameserver.queries}
+
+
+def print_table(title: str, stats: dict[str, dict]):
+    print(f"  {title:20s} {'calls':>7s} {'errors':>7s} {'p50 ms':>9s} {'p90 ms':>9s} {'p99 ms':>9s} {'max ms':>9s}")
+    for name, s in stats.items():
+        print(f"  {name:20s} {s['calls']:7d} {s['errors']:7d} {s['p50'] * 1000:9.1f} {s['p90'] * 1000:9.1f}"
+              f" {s['p99'] * 1000:9.1f} {s['max'] * 1000:9.1f}")
+
+
+def print_report(result: dict):
+    print(f"== {result['domains']} domains: exit {result['exit_code']}, {result['issued']} issued,"
+          f" wall {result['wall']:.2f} s, peak RSS {result['peak_rss_kib'] / 1024:.1f} MiB"
+          f" (key workers {result['peak_rss_children_kib'] / 1024:.1f} MiB)")
+    print_table('app phase', result['app_phases'])
+    print_table('ACME server phase', result['phases'])
+    print_table('ACME request', result['acme_calls'])
+    print_table('Alidns action', result['alidns_calls'])
+    print(f"  nameserver queries {result['dns_queries']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='端到端基准测试，使用本地模拟的 ACME 服务器和阿里云 DNS')
+    parser.add_argument('--domains', default='10,100,1000', help='逗号分隔的域名数量，每个数量单独运行一次')
+    parser.add_argument('--engine', default='thread', choices=['thread', 'async'])
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--key-type', dest='key_type', default='rsa', choices=['rsa', 'ec256', 'ec384'])
+    parser.add_argument('--acme-latency', dest='acme_latency', type=float, default=0.0, help='每个请求的延迟，秒')
+    parser.add_argument('--dns-latency', dest='dns_latency', type=float, default=0.0, help='每个请求的延迟，秒')
+    parser.add_argument('--jitter', type=float, default=0.0, help='在延迟上随机增加 0 到 jitter 秒')
+    parser.add_argument('--acme-error-rate', dest='acme_error_rate', type=float, default=0.0)
+    parser.add_argument('--dns-error-rate', dest='dns_error_rate', type=float, default=0.0)
+    parser.add_argument('--dns-error-code', dest='dns_error_code', default='ServiceUnavailable',
+                        help='注入错误的错误码，如 Throttling.User')
+    parser.add_argument('--validation-delay', dest='validation_delay', type=float, default=0.0,
+                        help='应答挑战后多少秒完成验证')
+    parser.add_argument('--challenge-zone', dest='challenge_zone', default=None,
+                        help='将挑战记录写入这个区域，各域名的 _acme-challenge 通过 CNAME 委派到这里')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--log-level', dest='log_level', default='WARNING')
+    parser.add_argument('--json', dest='json_file', default=None, help='将结果写入 JSON 文件')
+    parser.add_argument('--single', type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--output', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        # Configure logging before app.main does, so it stays at the chosen level.
+        logging.basicConfig(level=args.log_level, stream=sys.stderr)
+        # The stand-ins are on 127.0.0.1, never go through a proxy.
+        os.environ['NO_PROXY'] = '127.0.0.1'
+        with open(args.output, 'w') as f:
+            json.dump(run_once(args, args.single), f)
+        return
+
+    forward = list[str]()
+    for key in FORWARD_OPTIONS:
+        value = getattr(args, key)
+        if value is not None:
+            forward += [f"--{key.replace('_', '-')}", str(value)]
+
+    results = list[dict]()
+    for domains in [int(n) for n in args.domains.split(',')]:
+        with tempfile.TemporaryDirectory() as tmp:
+            output = Path(tmp).joinpath('result.json')
+            subprocess.run([sys.executable, '-m', 'bench.e2e', '--single', str(domains), '--output', str(output)]
+                           + forward, cwd=PROJ_DIR, check=True)
+            result = json.loads(output.read_text())
+        print_report(result)
+        results.append(result)
+
+    if args.json_file is not None:
+        with open(args.json_file, 'w') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+import collections
+import json
+import logging
+import math
+import random
+import threading
+import time
+import typing
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+log = logging.getLogger(__name__)
+
+
+class Faults:
+    """Latency and errors injected into every request of a fake server."""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 seed: typing.Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self):
+        with self._lock:
+            seconds = self.latency + self._random.uniform(0, self.jitter)
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def fail(self) -> bool:
+        if self.error_rate <= 0:
+            return False
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+
+def percentile(values: list[float], p: float) -> float:
+    """Nearest-rank percentile of values, 0 when empty."""
+    if len(values) == 0:
+        return 0.0
+    values = sorted(values)
+    return values[max(math.ceil(p / 100 * len(values)) - 1, 0)]
+
+
+class CallStats:
+    """Call counts, error counts and latencies by name."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = collections.Counter[str]()
+        self.errors = collections.Counter[str]()
+        self.latencies = collections.defaultdict[str, list[float]](list)
+
+    def record(self, name: str, seconds: float, error: bool = False):
+        with self._lock:
+            self.calls[name] += 1
+            if error:
+                self.errors[name] += 1
+            self.latencies[name].append(seconds)
+
+    def summary(self) -> dict[str, dict]:
+        with self._lock:
+            return {name: {'calls': self.calls[name],
+                           'errors': self.errors[name],
+                           'p50': percentile(self.latencies[name], 50),
+                           'p90': percentile(self.latencies[name], 90),
+                           'p99': percentile(self.latencies[name], 99),
+                           'max': max(self.latencies[name], default=0.0)}
+                    for name in sorted(self.calls)}
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Many workers connect at once on big runs.
+    request_queue_size = 256
+
+
+class Response(typing.NamedTuple):
+    status: int
+    headers: dict[str, str]
+    body: bytes
+
+
+def json_response(status: int, obj, headers: typing.Optional[dict[str, str]] = None,
+                  content_type: str = 'application/json') -> Response:
+    headers = dict(headers or {})
+    headers['Content-Type'] = content_type
+    return Response(status, headers, json.dumps(obj).encode('utf-8'))
+
+
+class HTTPFake:
+    """
+    An HTTP server on 127.0.0.1 with a random port, served from a background thread.
+    Subclasses implement handle, which gets lower-cased header names,
+    every request is counted in stats under the name handle returns.
+    """
+
+    def __init__(self, faults: typing.Optional[Faults] = None):
+        self.faults = faults or Faults()
+        self.stats = CallStats()
+        self._server: typing.Optional[_Server] = None
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.port}'
+
+    def handle(self, method: str, path: str, headers: dict[str, str], body: bytes) -> tuple[str, Response]:
+        raise NotImplementedError
+
+    def _serve(self, request: BaseHTTPRequestHandler, method: str):
+        t0 = time.perf_counter()
+        length = int(request.headers.get('Content-Length') or 0)
+        body = request.rfile.read(length) if length > 0 else b''
+        self.faults.delay()
+        headers = {key.lower(): value for key, value in request.headers.items()}
+        try:
+            name, response = self.handle(method, request.path, headers, body)
+        except Exception as err:
+            log.exception(f'{type(self).__name__} {method} {request.path} fail')
+            name, response = 'unhandled', Response(500, {}, repr(err).encode('utf-8'))
+
+        request.send_response(response.status)
+        for key, value in response.headers.items():
+            request.send_header(key, value)
+        request.send_header('Content-Length', str(len(response.body)))
+        request.end_headers()
+        if method != 'HEAD':
+            request.wfile.write(response.body)
+        self.stats.record(name, time.perf_counter() - t0, response.status >= 400)
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, as the SDK clients reuse connections.
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                fake._serve(self, 'GET')
+
+            def do_HEAD(self):
+                fake._serve(self, 'HEAD')
+
+            def do_POST(self):
+                fake._serve(self, 'POST')
+
+            def log_message(self, *_):
+                pass
+
+        self._server = _Server(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
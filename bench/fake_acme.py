@@ -0,0 +1,350 @@
+import base64
+import hashlib
+import itertools
+import json
+import logging
+import secrets
+import threading
+import time
+import typing
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+from .fake import HTTPFake, Faults, CallStats, Response, json_response
+from .fake_zone import FakeZone
+
+log = logging.getLogger(__name__)
+
+ACME_ERROR = 'urn:ietf:params:acme:error:'
+CHALLENGE_RR = '_acme-challenge'
+AUTHZ_LIFETIME = timedelta(days=7)
+CERT_LIFETIME = timedelta(days=90)
+# Renewal info: the window starts this far into the lifetime, lasts this long, and is asked again after
+RENEWAL_WINDOW_START = 2 / 3
+RENEWAL_WINDOW_LENGTH = timedelta(days=2)
+RENEWAL_INFO_RETRY_AFTER = 21600
+
+# Phases of an order as the server sees them: (name, from, to)
+PHASES = [('challenge', 'created', 'answered'),
+          ('validation', 'answered', 'ready'),
+          ('finalize', 'ready', 'finalized'),
+          ('download', 'finalized', 'downloaded'),
+          ('total', 'created', 'downloaded')]
+
+
+def b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def jwk_thumbprint(jwk: dict) -> str:
+    """RFC 7638 thumbprint, the account part of a key authorization."""
+    members = {'RSA': ['e', 'kty', 'n'], 'EC': ['crv', 'kty', 'x', 'y']}[jwk['kty']]
+    data = json.dumps({key: jwk[key] for key in members}, sort_keys=True, separators=(',', ':'))
+    return b64encode(hashlib.sha256(data.encode('utf-8')).digest())
+
+
+def rfc3339(dt: datetime) -> str:
+    return dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def public(obj: dict) -> dict:
+    """Drop the bookkeeping keys, those starting with an underscore."""
+    return {key: value for key, value in obj.items() if not key.startswith('_')}
+
+
+def problem(status: int, typ: str, detail: str) -> Response:
+    return json_response(status, {'type': ACME_ERROR + typ, 'detail': detail},
+                         content_type='application/problem+json')
+
+
+class FakeACME(HTTPFake):
+    """
+    An RFC 8555 server with only the DNS-01 challenge, enough for python-acme to issue certificates.
+    JWS signatures are not checked, challenges are validated against the TXT records of a FakeZone
+    validation_delay seconds after they are answered, and certificates are signed by a throwaway CA.
+    """
+
+    def __init__(self, zone: FakeZone, faults: typing.Optional[Faults] = None, validation_delay: float = 0.0):
+        super().__init__(faults)
+        self.zone = zone
+        self.validation_delay = validation_delay
+        # Time spent in each phase of an order, recorded when its certificate is downloaded.
+        self.phases = CallStats()
+
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.accounts = dict[str, dict]()
+        self._account_ids = dict[str, str]()
+        self.orders = dict[str, dict]()
+        self.authzs = dict[str, dict]()
+        self.challenges = dict[str, dict]()
+        # (account id, name, wildcard) -> id of its valid authorization, reused by new orders
+        self.valid_authzs = dict[tuple[str, str, bool], str]()
+        self.certificates = dict[str, tuple[str, bytes]]()
+        # Renewal info identifier -> {'not_before', 'not_after', 'replaced'}
+        self.issued = dict[str, dict]()
+        # Suggested for every certificate when set, as after a mass revocation
+        self.renewal_window: typing.Optional[tuple[datetime, datetime]] = None
+
+        self.ca_key = ec.generate_private_key(ec.SECP256R1())
+        name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'Fake ACME CA')])
+        now = datetime.now(timezone.utc)
+        self.ca_cert = (x509.CertificateBuilder()
+                        .subject_name(name).issuer_name(name)
+                        .public_key(self.ca_key.public_key())
+                        .serial_number(x509.random_serial_number())
+                        .not_valid_before(now - timedelta(days=1))
+                        .not_valid_after(now + timedelta(days=3650))
+                        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+                        .sign(self.ca_key, hashes.SHA256()))
+
+    @property
+    def directory_url(self) -> str:
+        return f'{self.url}/directory'
+
+    def directory(self) -> dict:
+        return {'newNonce': f'{self.url}/new-nonce',
+                'newAccount': f'{self.url}/new-account',
+                'newOrder': f'{self.url}/new-order',
+                'revokeCert': f'{self.url}/revoke-cert',
+                'keyChange': f'{self.url}/key-change',
+                'renewalInfo': f'{self.url}/renewal-info',
+                'meta': {'termsOfService': f'{self.url}/terms'}}
+
+    def handle(self, method: str, path: str, _: dict[str, str], body: bytes) -> tuple[str, Response]:
+        parts = urlsplit(path).path.strip('/').split('/')
+        name = parts[0]
+        if method != 'POST':
+            if name == 'directory':
+                return name, json_response(200, self.directory())
+            if name == 'renewal-info':
+                return name, self._renewal_info(parts[1] if len(parts) > 1 else '')
+            if name == 'new-nonce':
+                return name, Response(200 if method == 'HEAD' else 204, {'Replay-Nonce': self._nonce(),
+                                                                        'Cache-Control': 'no-store'}, b'')
+            return name, problem(405, 'malformed', f'{method} is not allowed')
+
+        response = self._post(name, parts[1:], body)
+        # Every POST response carries a fresh nonce, python-acme needs it for the next request.
+        response.headers['Replay-Nonce'] = self._nonce()
+        return name, response
+
+    def _renewal_info(self, cert_id: str) -> Response:
+        if self.faults.fail():
+            return problem(500, 'serverInternal', 'Injected error')
+        with self._lock:
+            issued = self.issued.get(cert_id)
+            if issued is None:
+                return problem(404, 'malformed', f'Unknown certificate {cert_id}')
+            if self.renewal_window is not None:
+                start, end = self.renewal_window
+            else:
+                start = issued['not_before'] + (issued['not_after'] - issued['not_before']) * RENEWAL_WINDOW_START
+                end = start + RENEWAL_WINDOW_LENGTH
+        return json_response(200, {'suggestedWindow': {'start': rfc3339(start), 'end': rfc3339(end)}},
+                             {'Retry-After': str(RENEWAL_INFO_RETRY_AFTER)})
+
+    @staticmethod
+    def _nonce() -> str:
+        return b64encode(secrets.token_bytes(16))
+
+    def _post(self, name: str, args: list[str], body: bytes) -> Response:
+        if self.faults.fail():
+            return problem(500, 'serverInternal', 'Injected error')
+        try:
+            jws = json.loads(body)
+            protected = json.loads(b64decode(jws['protected']))
+            payload = b64decode(jws['payload'])
+            # An empty payload is a POST-as-GET.
+            payload = json.loads(payload) if len(payload) != 0 else None
+        except (ValueError, KeyError, TypeError) as err:
+            return problem(400, 'malformed', f'Bad JWS: {err!r}')
+
+        route = getattr(self, f"post_{name.replace('-', '_')}", None)
+        if route is None:
+            return problem(404, 'malformed', f'Unknown resource {name}')
+        try:
+            with self._lock:
+                return route(protected, payload, args)
+        except (KeyError, IndexError) as err:
+            return problem(404, 'malformed', f'Not found: {err}')
+
+    def _account_of(self, protected: dict) -> typing.Optional[str]:
+        account_id = protected.get('kid', '').rsplit('/', 1)[-1]
+        return account_id if account_id in self.accounts else None
+
+    def _account_json(self, account_id: str) -> Response:
+        return json_response(200, public(self.accounts[account_id]),
+                             {'Location': f'{self.url}/acct/{account_id}'})
+
+    def post_new_account(self, protected: dict, payload: dict, _) -> Response:
+        thumbprint = jwk_thumbprint(protected['jwk'])
+        account_id = self._account_ids.get(thumbprint)
+        if account_id is not None:
+            return self._account_json(account_id)
+        if payload.get('onlyReturnExisting'):
+            return problem(400, 'accountDoesNotExist', 'No account for this key')
+
+        account_id = str(next(self._ids))
+        self.accounts[account_id] = {'status': 'valid', 'contact': payload.get('contact', []),
+                                     'orders': f'{self.url}/orders/{account_id}', '_thumbprint': thumbprint}
+        self._account_ids[thumbprint] = account_id
+        response = self._account_json(account_id)
+        return response._replace(status=201)
+
+    def post_acct(self, protected: dict, payload: typing.Optional[dict], args: list[str]) -> Response:
+        account_id = args[0]
+        if self._account_of(protected) != account_id:
+            return problem(403, 'unauthorized', 'Not your account')
+        if payload is not None and 'contact' in payload:
+            self.accounts[account_id]['contact'] = payload['contact']
+        return self._account_json(account_id)
+
+    def post_new_order(self, protected: dict, payload: dict, _) -> Response:
+        account_id = self._account_of(protected)
+        if account_id is None:
+            return problem(400, 'accountDoesNotExist', 'Unknown account')
+        replaces = payload.get('replaces')
+        if replaces is not None:
+            if replaces not in self.issued:
+                return problem(400, 'malformed', f'Unknown certificate {replaces}')
+            if self.issued[replaces]['replaced']:
+                return problem(409, 'alreadyReplaced', f'Certificate {replaces} is already replaced')
+            self.issued[replaces]['replaced'] = True
+
+        order_id = str(next(self._ids))
+        expires = rfc3339(datetime.now(timezone.utc) + AUTHZ_LIFETIME)
+        authz_urls = list[str]()
+        for identifier in payload['identifiers']:
+            reused = self.valid_authzs.get((account_id, identifier['value'].removeprefix('*.'),
+                                            identifier['value'].startswith('*.')))
+            if reused is not None:
+                authz_urls.append(f'{self.url}/authz/{reused}')
+                continue
+            authz_id, chall_id = str(next(self._ids)), str(next(self._ids))
+            self.challenges[chall_id] = {'type': 'dns-01', 'url': f'{self.url}/chall/{chall_id}',
+                                         'status': 'pending', 'token': b64encode(secrets.token_bytes(32)),
+                                         '_authz': authz_id}
+            self.authzs[authz_id] = {'identifier': {'type': 'dns', 'value': identifier['value'].removeprefix('*.')},
+                                     'status': 'pending', 'expires': expires,
+                                     'wildcard': identifier['value'].startswith('*.'),
+                                     '_challenges': [chall_id], '_order': order_id, '_account': account_id}
+            authz_urls.append(f'{self.url}/authz/{authz_id}')
+
+        self.orders[order_id] = {'status': 'pending', 'expires': expires, 'identifiers': payload['identifiers'],
+                                 'authorizations': authz_urls, 'finalize': f'{self.url}/finalize/{order_id}',
+                                 '_times': {'created': time.perf_counter()}}
+        # Ready right away when every authorization is reused.
+        self._update_order(order_id)
+        return json_response(201, public(self.orders[order_id]), {'Location': f'{self.url}/order/{order_id}'})
+
+    def _authz_json(self, authz_id: str) -> dict:
+        authz = self.authzs[authz_id]
+        return dict(public(authz), challenges=[public(self.challenges[i]) for i in authz['_challenges']])
+
+    def post_authz(self, _, __, args: list[str]) -> Response:
+        return json_response(200, self._authz_json(args[0]))
+
+    def post_chall(self, _, __, args: list[str]) -> Response:
+        chall_id = args[0]
+        chall = self.challenges[chall_id]
+        authz_id = chall['_authz']
+        if chall['status'] == 'pending':
+            chall['status'] = 'processing'
+            self.orders[self.authzs[authz_id]['_order']]['_times'].setdefault('answered', time.perf_counter())
+            threading.Timer(self.validation_delay, self._validate, (chall_id,)).start()
+        return json_response(200, public(chall), {'Link': f'<{self.url}/authz/{authz_id}>;rel="up"'})
+
+    def _validate(self, chall_id: str):
+        with self._lock:
+            chall = self.challenges[chall_id]
+            authz = self.authzs[chall['_authz']]
+            key_authorization = f"{chall['token']}.{self.accounts[authz['_account']]['_thumbprint']}"
+            expected = b64encode(hashlib.sha256(key_authorization.encode('utf-8')).digest())
+            name = f"{CHALLENGE_RR}.{authz['identifier']['value']}"
+
+            if expected in self.zone.resolve(name, 'TXT'):
+                chall['status'] = authz['status'] = 'valid'
+                chall['validated'] = rfc3339(datetime.now(timezone.utc))
+                self.valid_authzs[(authz['_account'], authz['identifier']['value'], authz['wildcard'])] = \
+                    chall['_authz']
+            else:
+                chall['status'] = authz['status'] = 'invalid'
+                chall['error'] = {'type': ACME_ERROR + 'unauthorized', 'detail': f'No TXT record {expected} at {name}'}
+            self._update_order(authz['_order'])
+
+    def _update_order(self, order_id: str):
+        order = self.orders[order_id]
+        statuses = [self.authzs[url.rsplit('/', 1)[-1]]['status'] for url in order['authorizations']]
+        if 'invalid' in statuses:
+            order['status'] = 'invalid'
+            order['error'] = {'type': ACME_ERROR + 'unauthorized', 'detail': 'An authorization is invalid'}
+        elif all(status == 'valid' for status in statuses):
+            order['status'] = 'ready'
+            order['_times']['ready'] = time.perf_counter()
+
+    def post_finalize(self, _, payload: dict, args: list[str]) -> Response:
+        order_id = args[0]
+        order = self.orders[order_id]
+        if order['status'] != 'ready':
+            return problem(403, 'orderNotReady', f"Order is {order['status']}")
+
+        csr = x509.load_der_x509_csr(b64decode(payload['csr']))
+        names = [identifier['value'] for identifier in order['identifiers']]
+        try:
+            csr_names = csr.extensions.get_extension_for_class(x509.SubjectAlternativeName).value \
+                .get_values_for_type(x509.DNSName)
+        except x509.ExtensionNotFound:
+            csr_names = []
+        if set(csr_names) != set(names):
+            return problem(400, 'badCSR', f'CSR names {sorted(csr_names)} do not match order {sorted(names)}')
+
+        cert_id = str(next(self._ids))
+        self.certificates[cert_id] = (order_id, self._issue(csr, names))
+        order['status'] = 'valid'
+        order['certificate'] = f'{self.url}/cert/{cert_id}'
+        order['_times']['finalized'] = time.perf_counter()
+        return json_response(200, public(order), {'Location': f'{self.url}/order/{order_id}'})
+
+    def _issue(self, csr: x509.CertificateSigningRequest, names: list[str]) -> bytes:
+        now = datetime.now(timezone.utc)
+        serial = x509.random_serial_number()
+        cert = (x509.CertificateBuilder()
+                .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, names[0])]))
+                .issuer_name(self.ca_cert.subject)
+                .public_key(csr.public_key())
+                .serial_number(serial)
+                .not_valid_before(now - timedelta(hours=1))
+                .not_valid_after(now + CERT_LIFETIME)
+                .add_extension(x509.SubjectAlternativeName([x509.DNSName(name) for name in names]), critical=False)
+                .add_extension(x509.AuthorityKeyIdentifier.from_issuer_public_key(self.ca_key.public_key()),
+                               critical=False)
+                .sign(self.ca_key, hashes.SHA256()))
+        aki = cert.extensions.get_extension_for_class(x509.AuthorityKeyIdentifier).value.key_identifier
+        cert_id = f"{b64encode(aki)}.{b64encode(serial.to_bytes(serial.bit_length() // 8 + 1, 'big'))}"
+        self.issued[cert_id] = {'not_before': now - timedelta(hours=1), 'not_after': now + CERT_LIFETIME,
+                                'replaced': False}
+        return (cert.public_bytes(serialization.Encoding.PEM)
+                + self.ca_cert.public_bytes(serialization.Encoding.PEM))
+
+    def post_order(self, _, __, args: list[str]) -> Response:
+        return json_response(200, public(self.orders[args[0]]), {'Location': f'{self.url}/order/{args[0]}'})
+
+    def post_cert(self, _, __, args: list[str]) -> Response:
+        order_id, chain = self.certificates[args[0]]
+        times = self.orders[order_id]['_times']
+        if 'downloaded' not in times:
+            times['downloaded'] = time.perf_counter()
+            for name, start, end in PHASES:
+                if start in times and end in times:
+                    self.phases.record(name, times[end] - times[start])
+        return Response(200, {'Content-Type': 'application/pem-certificate-chain'}, chain)
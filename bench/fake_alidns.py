@@ -0,0 +1,85 @@
+import logging
+import typing
+import uuid
+from urllib.parse import parse_qsl, urlsplit
+
+from .fake import HTTPFake, Faults, Response, json_response
+from .fake_zone import FakeZone
+
+log = logging.getLogger(__name__)
+
+MAX_PAGE_SIZE = 500
+
+
+class FakeAlidns(HTTPFake):
+    """
+    The RPC actions of the Alidns API that ali_dns.Client calls, on a FakeZone.
+    Signatures are not checked, point the client at url with the http protocol.
+    """
+
+    def __init__(self, zone: FakeZone, nameservers: list[str], faults: typing.Optional[Faults] = None,
+                 error_code: str = 'ServiceUnavailable'):
+        super().__init__(faults)
+        self.zone = zone
+        self.nameservers = nameservers
+        self.error_code = error_code
+
+    @property
+    def endpoint(self) -> str:
+        return f'127.0.0.1:{self.port}'
+
+    def handle(self, method: str, path: str, headers: dict[str, str], body: bytes) -> tuple[str, Response]:
+        # RPC parameters come in the query string, or in a form body.
+        params = dict(parse_qsl(urlsplit(path).query))
+        params.update(parse_qsl(body.decode('utf-8')))
+        # The action is a parameter with V2 signatures, and a header with V3 ones.
+        action = params.get('Action') or headers.get('x-acs-action', '')
+        request_id = str(uuid.uuid4())
+
+        if self.faults.fail():
+            return action, json_response(503, {'RequestId': request_id, 'Code': self.error_code,
+                                               'Message': 'Injected error'})
+
+        handler = getattr(self, f'action_{action}', None)
+        if handler is None:
+            return action, json_response(404, {'RequestId': request_id, 'Code': 'InvalidAction.NotFound',
+                                               'Message': f'Unknown action {action}'})
+        status, result = handler(params)
+        result['RequestId'] = request_id
+        return action, json_response(status, result)
+
+    @staticmethod
+    def _not_found(record_id: str) -> tuple[int, dict]:
+        return 400, {'Code': 'DomainRecordNotBelong', 'Message': f'Record {record_id} not found'}
+
+    def action_DescribeDomainRecords(self, params: dict) -> tuple[int, dict]:
+        page_number = int(params.get('PageNumber', 1))
+        page_size = min(int(params.get('PageSize', 20)), MAX_PAGE_SIZE)
+        records = self.zone.find(params['DomainName'], params.get('Type'), params.get('RRKeyWord'))
+        page = records[(page_number - 1) * page_size:page_number * page_size]
+        return 200, {'TotalCount': len(records), 'PageNumber': page_number, 'PageSize': page_size,
+                     'DomainRecords': {'Record': page}}
+
+    def action_DescribeDomainInfo(self, params: dict) -> tuple[int, dict]:
+        return 200, {'DomainName': params['DomainName'], 'DnsServers': {'DnsServer': self.nameservers}}
+
+    def action_AddDomainRecord(self, params: dict) -> tuple[int, dict]:
+        if any(r['RR'] == params['RR'] and r['Value'] == params['Value']
+               for r in self.zone.find(params['DomainName'], params['Type'], params['RR'])):
+            return 400, {'Code': 'DomainRecordDuplicate', 'Message': 'The DNS record already exists.'}
+        record_id = self.zone.add(params['DomainName'], params['RR'], params['Type'], params['Value'],
+                                  int(params.get('TTL', 600)))
+        return 200, {'RecordId': record_id}
+
+    def action_UpdateDomainRecord(self, params: dict) -> tuple[int, dict]:
+        record_id = params['RecordId']
+        if not self.zone.update(record_id, params['RR'], params['Type'], params['Value'],
+                                int(params.get('TTL', 600))):
+            return self._not_found(record_id)
+        return 200, {'RecordId': record_id}
+
+    def action_DeleteDomainRecord(self, params: dict) -> tuple[int, dict]:
+        record_id = params['RecordId']
+        if not self.zone.delete(record_id):
+            return self._not_found(record_id)
+        return 200, {'RecordId': record_id}
@@ -0,0 +1,144 @@
+import itertools
+import logging
+import socket
+import struct
+import threading
+import typing
+
+from ali_dns.resolver import TYPE_CNAME, TYPE_TXT, CLASS_IN, RCODE_NXDOMAIN, MAX_CNAME_CHAIN
+
+log = logging.getLogger(__name__)
+
+# Answer, authoritative
+FLAGS_AA = 0x8400
+
+
+class FakeZone:
+    """The records of every fake Alidns domain, shared by the Alidns API, the nameserver and the ACME server."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.records = dict[str, dict]()
+
+    def add(self, domain: str, rr: str, type_name: str, value: str, ttl: int) -> str:
+        with self._lock:
+            record_id = str(next(self._ids))
+            self.records[record_id] = {'RecordId': record_id, 'DomainName': domain, 'RR': rr, 'Type': type_name,
+                                       'Value': value, 'TTL': ttl, 'Line': 'default', 'Status': 'ENABLE'}
+            return record_id
+
+    def update(self, record_id: str, rr: str, type_name: str, value: str, ttl: int) -> bool:
+        with self._lock:
+            record = self.records.get(record_id)
+            if record is None:
+                return False
+            record.update({'RR': rr, 'Type': type_name, 'Value': value, 'TTL': ttl})
+            return True
+
+    def delete(self, record_id: str) -> bool:
+        with self._lock:
+            return self.records.pop(record_id, None) is not None
+
+    def find(self, domain: str, type_name: typing.Optional[str] = None,
+             rr_keyword: typing.Optional[str] = None) -> list[dict]:
+        """Records of domain, rr_keyword matches part of RR like the Alidns API does."""
+        with self._lock:
+            return [dict(r) for r in self.records.values()
+                    if r['DomainName'] == domain
+                    and (type_name is None or r['Type'] == type_name)
+                    and (rr_keyword is None or rr_keyword in r['RR'])]
+
+    def lookup(self, name: str, type_name: str) -> list[str]:
+        name = name.rstrip('.').lower()
+        with self._lock:
+            return [r['Value'] for r in self.records.values()
+                    if r['Type'] == type_name
+                    and (r['DomainName'] if r['RR'] == '@' else f"{r['RR']}.{r['DomainName']}") == name]
+
+    def resolve(self, name: str, type_name: str) -> list[str]:
+        """Values of name, following CNAMEs."""
+        for _ in range(MAX_CNAME_CHAIN):
+            cnames = self.lookup(name, 'CNAME')
+            if len(cnames) == 0:
+                break
+            name = cnames[0]
+        return self.lookup(name, type_name)
+
+
+def _read_name(data: bytes, offset: int) -> tuple[str, int]:
+    labels = list[str]()
+    while True:
+        length = data[offset]
+        offset += 1
+        if length == 0:
+            return '.'.join(labels), offset
+        labels.append(data[offset:offset + length].decode('ascii'))
+        offset += length
+
+
+def _name_rdata(name: str) -> bytes:
+    labels = [label.encode('ascii') for label in name.rstrip('.').split('.')]
+    return b''.join(struct.pack('!B', len(label)) + label for label in labels) + b'\x00'
+
+
+def _txt_rdata(value: str) -> bytes:
+    raw = value.encode('utf-8')
+    chunks = [raw[i:i + 255] for i in range(0, len(raw), 255)] or [b'']
+    return b''.join(struct.pack('!B', len(chunk)) + chunk for chunk in chunks)
+
+
+class FakeNameserver:
+    """An authoritative UDP nameserver answering TXT and CNAME queries from a FakeZone."""
+
+    def __init__(self, zone: FakeZone):
+        self.zone = zone
+        self.queries = 0
+        self._sock: typing.Optional[socket.socket] = None
+
+    @property
+    def port(self) -> int:
+        return self._sock.getsockname()[1]
+
+    def answer(self, query: bytes) -> bytes:
+        qid, _, _, _, _, _ = struct.unpack('!HHHHHH', query[:12])
+        name, offset = _read_name(query, 12)
+        qtype, _ = struct.unpack('!HH', query[offset:offset + 4])
+        question = query[12:offset + 4]
+
+        if qtype == TYPE_TXT:
+            rdatas = [_txt_rdata(value) for value in self.zone.resolve(name, 'TXT')]
+        elif qtype == TYPE_CNAME:
+            rdatas = [_name_rdata(target) for target in self.zone.lookup(name, 'CNAME')]
+        else:
+            rdatas = []
+        rcode = RCODE_NXDOMAIN if len(rdatas) == 0 else 0
+        header = struct.pack('!HHHHHH', qid, FLAGS_AA | rcode, 1, len(rdatas), 0, 0)
+        answers = bytes()
+        for rdata in rdatas:
+            # 0xC00C points at the name in the question.
+            answers += struct.pack('!HHHIH', 0xC00C, qtype, CLASS_IN, 60, len(rdata)) + rdata
+        return header + question + answers
+
+    def _serve(self):
+        while True:
+            try:
+                query, addr = self._sock.recvfrom(65535)
+            except OSError:
+                return
+            self.queries += 1
+            try:
+                self._sock.sendto(self.answer(query), addr)
+            except (OSError, struct.error, IndexError, UnicodeDecodeError) as err:
+                log.warning(f'Answer query from {addr} fail: {err!r}')
+
+    def start(self):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind(('127.0.0.1', 0))
+        threading.Thread(target=self._serve, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
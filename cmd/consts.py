@@ -5,18 +5,89 @@ directory_url = https://acme-staging-v02.api.letsencrypt.org/directory
 user_agent = python-acme
 acc_key_bits = 2048
 cert_pkey_bits = 2048
+# rsa / ec256 / ec384
+cert_key_type = rsa
+key_pool_size = 2
 access_key_id = xxxxxxxx
 access_key_secret = xxxxxxx
 type = TXT
 challenge_rr = _acme-challenge
 ttl = 600
+# Write the challenge records to this zone instead of the zone of each domain, empty for the own zone.
+# _acme-challenge.<name> must be a CNAME into it, by default to <name>.<challenge_zone>
+# challenge_zone = acme-validation.example.net
+# Recursive nameservers the CNAMEs are followed through, comma separated, empty for those of /etc/resolv.conf
+challenge_resolvers =
+# A certificate whose CNAME is not found fails before its challenges are answered,
+# 0 writes <name>.<challenge_zone> anyway, for a CNAME the resolvers can not see
+challenge_require_cname = 1
+dns_endpoint = alidns.cn-beijing.aliyuncs.com
+dns_protocol = https
+dns_connect_timeout = 5000
+dns_read_timeout = 10000
+# Retries of transient Alidns failures with backoff, all attempts of one call within dns_call_timeout seconds
+dns_retries = 4
+dns_backoff = 0.5
+dns_max_backoff = 10.0
+dns_call_timeout = 30.0
+# Fail fast for dns_breaker_cooldown seconds after dns_breaker_threshold failures in a row, 0 to disable
+dns_breaker_threshold = 5
+dns_breaker_cooldown = 30.0
+# Request budgets shared by every domain, requests a second and burst, a rate of 0 disables the limit
+acme_rate = 20.0
+acme_burst = 20
+# At most acme_new_order_limit new orders every acme_new_order_period seconds
+acme_new_order_limit = 300
+acme_new_order_period = 10800
+dns_rate = 10.0
+dns_burst = 10
+# The longest Retry-After waited for before retrying a rate limited ACME request, in seconds
+rate_limit_max_wait = 300
+propagation_timeout = 300
+propagation_interval = 2
+propagation_max_interval = 30
 log_level = INFO
 data_dir = run
+directory_cache_ttl = 86400
+registration_cache_ttl = 86400
+# More config files with domain sections, comma separated glob patterns relative to this file
+# include = conf.d/*.ini
+# Prometheus node-exporter textfile and JSON run summary in data_dir, empty to disable
+metrics_textfile = certbot_aliyun.prom
+metrics_summary =
+renew_before_days = 30
+# Renew when the CA suggests (ARI), asking it again at most this often in seconds, 0 to disable
+# A one-shot run renews at its first run in the suggested window, the daemon at a random time in it.
+# The window is a few days wide, hours after a revocation, so run the timer at least daily.
+renewal_info_max_age = 86400
+max_workers = 1
+# Run once after a run saved changed certificates, with RENEWED_DOMAINS and RENEWED_LINEAGES set
+# deploy_hook = systemctl reload nginx
+deploy_hook_timeout = 300
+deploy_hook_workers = 4
+daemon_jitter = 3600
+# A certificate that keeps failing is retried after daemon_retry_interval, doubling up to retry_max_interval
+# --force retries it right away, e.g. after fixing the AccessKey
+daemon_retry_interval = 3600
+retry_max_interval = 86400
+# thread / async
+engine = thread
+poll_interval = 1
+poll_max_interval = 10
+order_timeout = 600
 
 [client.example.com]
 domain = client.example.com
 email = fake@example.com
 save_dir = save/client.example.com
+# Extra names in the zone of domain, comma separated
+# san = www.api.client.example.com
+# Sections with the same group or save_dir share one certificate, sections of a group need the same save_dir
+# group = client
+# Run after this certificate changed, identical commands run once per run
+# deploy_hook = cp -L save/client.example.com/*.pem /etc/nginx/certs/
+# Delegate the challenges of this section to another zone, overrides challenge_zone of APP
+# challenge_zone = acme-validation.example.net
 '''
 
 PRODUCTION_URL = 'https://acme-v02.api.letsencrypt.org/directory'
@@ -28,13 +99,71 @@ directory_url = {directory}
 user_agent = python-acme
 acc_key_bits = 2048
 cert_pkey_bits = 2048
+# rsa / ec256 / ec384
+cert_key_type = rsa
+key_pool_size = 2
 access_key_id = {access_key_id}
 access_key_secret = {access_key_secret}
 type = TXT
 challenge_rr = _acme-challenge
 ttl = 600
+# Write the challenge records to this zone instead of the zone of each domain, empty for the own zone.
+# _acme-challenge.<name> must be a CNAME into it, by default to <name>.<challenge_zone>
+# challenge_zone = acme-validation.example.net
+# Recursive nameservers the CNAMEs are followed through, comma separated, empty for those of /etc/resolv.conf
+challenge_resolvers =
+# A certificate whose CNAME is not found fails before its challenges are answered,
+# 0 writes <name>.<challenge_zone> anyway, for a CNAME the resolvers can not see
+challenge_require_cname = 1
+dns_endpoint = alidns.cn-beijing.aliyuncs.com
+dns_protocol = https
+dns_connect_timeout = 5000
+dns_read_timeout = 10000
+# Retries of transient Alidns failures with backoff, all attempts of one call within dns_call_timeout seconds
+dns_retries = 4
+dns_backoff = 0.5
+dns_max_backoff = 10.0
+dns_call_timeout = 30.0
+# Fail fast for dns_breaker_cooldown seconds after dns_breaker_threshold failures in a row, 0 to disable
+dns_breaker_threshold = 5
+dns_breaker_cooldown = 30.0
+# Request budgets shared by every domain, requests a second and burst, a rate of 0 disables the limit
+acme_rate = 20.0
+acme_burst = 20
+# At most acme_new_order_limit new orders every acme_new_order_period seconds
+acme_new_order_limit = 300
+acme_new_order_period = 10800
+dns_rate = 10.0
+dns_burst = 10
+# The longest Retry-After waited for before retrying a rate limited ACME request, in seconds
+rate_limit_max_wait = 300
+propagation_timeout = 300
+propagation_interval = 2
+propagation_max_interval = 30
 log_level = INFO
 data_dir = run
+directory_cache_ttl = 86400
+registration_cache_ttl = 86400
+# More config files with domain sections, comma separated glob patterns relative to this file
+# include = conf.d/*.ini
+# Prometheus node-exporter textfile and JSON run summary in data_dir, empty to disable
+metrics_textfile = certbot_aliyun.prom
+metrics_summary =
+renew_before_days = 30
+renewal_info_max_age = 86400
+max_workers = 1
+# Run once after a run saved changed certificates, with RENEWED_DOMAINS and RENEWED_LINEAGES set
+# deploy_hook = systemctl reload nginx
+deploy_hook_timeout = 300
+deploy_hook_workers = 4
+daemon_jitter = 3600
+daemon_retry_interval = 3600
+retry_max_interval = 86400
+# thread / async
+engine = thread
+poll_interval = 1
+poll_max_interval = 10
+order_timeout = 600
 email = {email}
 
 '''
@@ -56,12 +185,30 @@ WorkingDirectory={wd}
 ExecStart={exec}
 '''
 
+EXAMPLE_DAEMON_SERVICE_FILE = '''[Unit]
+Description=Certbot--SSL certificate daemon
+Wants=network.target network-online.target
+After=network.target network-online.target
+
+[Service]
+Type=simple
+WorkingDirectory={wd}
+ExecStart={exec}
+ExecReload=/bin/kill -HUP $MAINPID
+Restart=on-failure
+RestartSec=60
+
+[Install]
+WantedBy=multi-user.target
+'''
+
 EXAMPLE_TIMER_FILE = '''[Unit]
 Description=Certbot--SSL certificate
 
 [Timer]
-OnCalendar=*-1,3,5,7,9,11-01 02:00:00
-
+OnCalendar=daily
+RandomizedDelaySec=1h
+Persistent=true
 
 [Install]
 WantedBy=timers.target
@@ -56,27 +56,40 @@ def gen_config_interactive(filename: typing.Union[str, Path]):
     write_file(filename, write_str)
 
 
-def gen_service(config_path: str, save_dir: str = '.'):
+def gen_service(config_path: str, save_dir: str = '.', replace: bool = False):
     filename = Path(save_dir).joinpath(service_filename)
+    if replace and filename.exists():
+        remove(filename)
     data = EXAMPLE_SERVICE_FILE.format(wd=f'{run_maim_file.parent.absolute()}',
                                        exec=f'{run_maim_file.absolute()} -c {Path(config_path).absolute()}')
     write_file(filename, data, re_name=False)
 
 
-def gen_timer(save_dir: str = '.'):
+def gen_daemon_service(config_path: str, save_dir: str = '.'):
+    filename = Path(save_dir).joinpath(service_filename)
+    data = EXAMPLE_DAEMON_SERVICE_FILE.format(
+        wd=f'{run_maim_file.parent.absolute()}',
+        exec=f'{run_maim_file.absolute()} daemon -c {Path(config_path).absolute()}')
+    write_file(filename, data, re_name=False)
+
+
+def gen_timer(save_dir: str = '.', replace: bool = False):
     filename = Path(save_dir).joinpath(timer_filename)
+    if replace and filename.exists():
+        # Installed units are replaced, so reinstalling picks up a changed schedule.
+        remove(filename)
     write_file(filename, EXAMPLE_TIMER_FILE, re_name=False)
 
 
 def gen_systemd(config_path: str, is_install: bool = False, user: bool = False):
     if is_install:
         if user:
-            gen_service(config_path, SYSTEMD_DIR_USER)
-            gen_timer(SYSTEMD_DIR_USER)
+            gen_service(config_path, SYSTEMD_DIR_USER, replace=True)
+            gen_timer(SYSTEMD_DIR_USER, replace=True)
         else:
             check_root()
-            gen_service(config_path, SYSTEMD_DIR)
-            gen_timer(SYSTEMD_DIR)
+            gen_service(config_path, SYSTEMD_DIR, replace=True)
+            gen_timer(SYSTEMD_DIR, replace=True)
     else:
         gen_service(config_path)
         gen_timer()
@@ -138,14 +151,17 @@ def install_venv(install_dir: Path = run_maim_file.parent):
         f' install -r {install_dir.joinpath(REQUIREMENTS_NAME)}')
 
 
-def run():
+def run(entry: str = 'main', trace: bool = False, profile: typing.Optional[str] = None, **kwargs):
     if venv_python.absolute() != Path(sys.executable):
         if not venv_dir.exists():
             install_venv()
-        ret = subprocess.run([str(venv_python.absolute())] + sys.argv)
-        exit(ret.returncode)
+        # Replace this process, so only one interpreter stays alive.
+        os.execv(venv_python.absolute(), [str(venv_python.absolute())] + sys.argv)
     import app
-    app.main()
+    from app import tracing
+    with tracing.session(trace, profile):
+        # main, daemon or status
+        getattr(app, entry)(**kwargs)
 
 
 def main():
@@ -153,14 +169,22 @@ def main():
         prog=f'python {run_maim_file.name}',
         description='自动申请 SSL 证书和续签，使用阿里云 DNS 验证。')
 
-    sel = ['gen-systemd', 'gen-systemd-i', 'gen-systemd-i-u', 'gen-config', 'gen-config-i', 'install', 'install-i',
-           'uninstall']
+    sel = ['gen-systemd', 'gen-systemd-i', 'gen-systemd-i-u', 'gen-systemd-daemon', 'gen-config', 'gen-config-i',
+           'install', 'install-i', 'uninstall', 'daemon', 'status']
     parser.add_argument('option', nargs='?', choices=sel)
     parser.add_argument('-c', dest='config', default=f'./{CONFIG_FILENAME}')
+    parser.add_argument('--trace', action='store_true', help='记录每次阿里云 DNS 和 ACME 调用的耗时，退出时输出统计')
+    parser.add_argument('--profile', metavar='FILE', default=None,
+                        help='使用 cProfile 和 tracemalloc 分析运行，结果写入 FILE 和 FILE.mem，同时开启 --trace')
+    parser.add_argument('--force', action='store_true', help='立即重试连续失败的证书，不等待退避时间结束')
     args = parser.parse_args()
 
     if args.option is None:
-        run()
+        run(trace=args.trace, profile=args.profile, force=args.force)
+    elif args.option == 'daemon':
+        run('daemon', trace=args.trace, profile=args.profile, force=args.force)
+    elif args.option == 'status':
+        run('status')
     elif args.option == 'gen-config':
         gen_config(args.config)
     elif args.option == 'gen-config-i':
@@ -171,6 +195,8 @@ def main():
         gen_systemd(args.config, is_install=True)
     elif args.option == 'gen-systemd-i-u':
         gen_systemd(args.config, is_install=True, user=True)
+    elif args.option == 'gen-systemd-daemon':
+        gen_daemon_service(args.config)
     elif args.option == 'install':
         install()
     elif args.option == 'install-i':
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Startup time benchmark, guards against slow imports creeping back into the start path.
+
+Runs each case in a fresh interpreter several times, prints the median wall time,
+and exits with 1 when a heavy SDK is imported too early or a median exceeds --max-ms.
+
+    python script/bench_startup.py
+    python script/bench_startup.py --max-ms 300
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+PROJ_DIR = Path(__file__).absolute().parent.parent
+
+# Modules that must not be loaded before there is ACME or DNS work to do
+HEAVY_MODULES = ['acme', 'josepy', 'OpenSSL', 'requests', 'alibabacloud_alidns20150109', 'alibabacloud_tea_openapi',
+                 'app.acme_client', 'app.async_engine', 'cryptography', 'asyncio']
+
+CHECK_IMPORTS = f'''
+import sys
+import app
+import ali_dns.resolver
+loaded = [m for m in {HEAVY_MODULES!r} if m in sys.modules]
+if loaded:
+    print('eagerly imported: ' + ', '.join(loaded))
+    sys.exit(1)
+'''
+
+CASES = {
+    'python': [sys.executable, '-c', 'pass'],
+    'cli --help': [sys.executable, 'main.py', '--help'],
+    'import app': [sys.executable, '-c', 'import app'],
+}
+
+
+def measure(args: list[str], runs: int) -> float:
+    times = list[float]()
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        subprocess.run(args, cwd=PROJ_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='启动时间基准测试')
+    parser.add_argument('-n', dest='runs', type=int, default=10)
+    parser.add_argument('--max-ms', dest='max_ms', type=float, default=None)
+    args = parser.parse_args()
+
+    ok = True
+    ret = subprocess.run([sys.executable, '-c', CHECK_IMPORTS], cwd=PROJ_DIR, env=os.environ.copy())
+    if ret.returncode != 0:
+        ok = False
+
+    for name, case in CASES.items():
+        median = measure(case, args.runs)
+        print(f'{name:12s} {median:8.1f} ms')
+        if args.max_ms is not None and name != 'python' and median > args.max_ms:
+            print(f'{name} is slower than {args.max_ms} ms')
+            ok = False
+
+    exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
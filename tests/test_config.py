@@ -0,0 +1,81 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from app.config import ConfigError, ConfigLoader, DomainConfig, group_domain_config
+
+
+def section(domain: str, save_dir: str = '', group: str = '', san: str = '') -> DomainConfig:
+    d_config = DomainConfig()
+    d_config.from_json({'domain': domain, 'save_dir': save_dir, 'group': group, 'san': san})
+    return d_config
+
+
+class GroupDomainConfigTest(unittest.TestCase):
+    def test_one_certificate_per_section(self):
+        certs = group_domain_config([section('a.com'), section('b.com')])
+        self.assertEqual([cert.names for cert in certs], [['*.a.com', 'a.com'], ['*.b.com', 'b.com']])
+
+    def test_bundle_by_group_and_save_dir(self):
+        certs = group_domain_config([section('a.com', 'save/ab', 'g'), section('b.com', 'save/ab', 'g'),
+                                     section('c.com', 'save/cd'), section('d.com', './save/cd', san='www.d.com')])
+        self.assertEqual([cert.save_dir for cert in certs], ['save/ab', 'save/cd'])
+        self.assertEqual(certs[1].names, ['*.c.com', 'c.com', '*.d.com', 'd.com', 'www.d.com'])
+        self.assertEqual(certs[1].section_of('www.d.com').domain, 'd.com')
+
+    def test_group_with_different_save_dirs(self):
+        with self.assertRaises(ValueError):
+            group_domain_config([section('a.com', 'save/a', 'g'), section('b.com', 'save/b', 'g')])
+
+    def test_duplicate_save_dir(self):
+        # Different groups, or a grouped and an ungrouped section, in one dir
+        with self.assertRaises(ValueError):
+            group_domain_config([section('a.com', 'save/shared', 'g1'), section('b.com', 'save/shared', 'g2')])
+        with self.assertRaises(ValueError):
+            group_domain_config([section('a.com', 'save/shared', 'g1'), section('b.com', 'save/shared/')])
+
+    def test_san_outside_zone(self):
+        with self.assertRaises(ValueError):
+            section('a.com', san='b.com')
+
+
+class ConfigLoaderTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.dir.name)
+        self.path.joinpath('conf.d').mkdir()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write(self, name: str, text: str) -> str:
+        file = self.path.joinpath(name)
+        file.write_text(text)
+        return str(file)
+
+    def test_include(self):
+        config_file = self.write('config.ini', '[APP]\ninclude = conf.d/*.ini\n\n[a]\ndomain = a.com\n')
+        self.write('conf.d/b.ini', '[b]\ndomain = b.com\n')
+        config = ConfigLoader().load(config_file)
+        self.assertEqual([cert.name for cert in config.certs], ['a.com', 'b.com'])
+
+    def test_reload_reuses_unchanged_files(self):
+        config_file = self.write('config.ini', '[APP]\ninclude = conf.d/*.ini\n')
+        self.write('conf.d/b.ini', '[b]\ndomain = b.com\n')
+        loader = ConfigLoader()
+        first = loader.load(config_file)
+        second = loader.load(config_file)
+        self.assertIs(first.domains[0], second.domains[0])
+
+    def test_errors(self):
+        config_file = self.write('config.ini', '[APP]\ninclude = conf.d/*.ini\n\n[b]\ndomain = b.com\n')
+        self.write('conf.d/b.ini', '[b]\ndomain = b.com\n')
+        with self.assertRaises(ConfigError):
+            ConfigLoader().load(config_file)
+        self.write('conf.d/b.ini', '[broken\n')
+        with self.assertRaises(ConfigError):
+            ConfigLoader().load(config_file)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+from datetime import datetime, timezone
+
+from app import renewal_info
+
+
+class ParseTest(unittest.TestCase):
+    def test_z_suffix(self):
+        # As Let's Encrypt sends it
+        info = renewal_info.parse({'suggestedWindow': {'start': '2025-01-02T04:00:00Z',
+                                                       'end': '2025-01-03T04:00:00Z'}}, 0)
+        self.assertEqual(info.start, datetime(2025, 1, 2, 4, tzinfo=timezone.utc).timestamp())
+        self.assertEqual(info.end, datetime(2025, 1, 3, 4, tzinfo=timezone.utc).timestamp())
+        self.assertTrue(info.start <= info.pick() <= info.end)
+
+    def test_fraction_and_offset(self):
+        self.assertEqual(renewal_info.parse_time('2025-01-02T04:00:00.5Z'),
+                         datetime(2025, 1, 2, 4, 0, 0, 500000, tzinfo=timezone.utc).timestamp())
+        self.assertEqual(renewal_info.parse_time('2025-01-02T12:00:00.123456789+08:00'),
+                         datetime(2025, 1, 2, 4, 0, 0, 123456, tzinfo=timezone.utc).timestamp())
+        self.assertEqual(renewal_info.parse_time('2025-01-02t04:00:00z'),
+                         datetime(2025, 1, 2, 4, tzinfo=timezone.utc).timestamp())
+
+    def test_explanation_url(self):
+        info = renewal_info.parse({'suggestedWindow': {'start': '2025-01-02T04:00:00Z', 'end': '2025-01-02T05:00:00Z'},
+                                   'explanationURL': 'https://example.com/why'}, 0)
+        self.assertEqual(info.explanation_url, 'https://example.com/why')
+
+    def test_bad_document(self):
+        for document in [{}, {'suggestedWindow': {'start': '2025-01-02'}},
+                         {'suggestedWindow': {'start': '2025-01-02T04:00:00', 'end': '2025-01-02T05:00:00'}},
+                         {'suggestedWindow': {'start': '2025-01-03T04:00:00Z', 'end': '2025-01-02T04:00:00Z'}}]:
+            with self.assertRaises(ValueError):
+                renewal_info.parse(document, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
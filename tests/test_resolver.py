@@ -0,0 +1,57 @@
+import unittest
+
+from ali_dns import resolver
+from bench.fake_zone import FakeNameserver, FakeZone
+
+# Documentation prefix, nothing answers there
+UNREACHABLE = ('2001:db8::53', 53)
+
+
+class ResolverTest(unittest.TestCase):
+    def setUp(self):
+        self.zone = FakeZone()
+        self.nameserver = FakeNameserver(self.zone).start()
+        self.server = ('127.0.0.1', self.nameserver.port)
+
+    def tearDown(self):
+        self.nameserver.stop()
+
+    def test_parse_server(self):
+        self.assertEqual(resolver.parse_server('127.0.0.1'), ('127.0.0.1', 53))
+        self.assertEqual(resolver.parse_server(' 127.0.0.1:5353 '), ('127.0.0.1', 5353))
+        self.assertEqual(resolver.parse_server('[::1]:5353'), ('::1', 5353))
+        self.assertEqual(resolver.parse_server('::1'), ('::1', 53))
+
+    def test_resolve_nameservers(self):
+        self.assertEqual(resolver.resolve_nameservers(['127.0.0.1:5353', 'does-not-exist.invalid']),
+                         [[('127.0.0.1', 5353)]])
+
+    def test_query_txt(self):
+        self.zone.add('example.com', '_acme-challenge', 'TXT', 'value', 600)
+        self.assertEqual(resolver.query_txt('_acme-challenge.example.com', self.server), ['value'])
+
+    def test_pending_until_answered(self):
+        self.assertEqual(resolver.pending_servers('_acme-challenge.example.com', ['value'], [[self.server]], 0.5),
+                         [[self.server]])
+        self.zone.add('example.com', '_acme-challenge', 'TXT', 'value', 600)
+        self.assertEqual(resolver.pending_servers('_acme-challenge.example.com', ['value'], [[self.server]], 0.5), [])
+
+    def test_unreachable_address(self):
+        self.zone.add('example.com', '_acme-challenge', 'TXT', 'value', 600)
+        # One reachable address of a nameserver is enough.
+        self.assertEqual(resolver.pending_servers('_acme-challenge.example.com', ['value'],
+                                                  [[self.server, UNREACHABLE]], 0.3), [])
+        # A nameserver none of whose addresses answer stays pending.
+        self.assertEqual(resolver.pending_servers('_acme-challenge.example.com', ['value'],
+                                                  [[self.server], [UNREACHABLE]], 0.3), [[UNREACHABLE]])
+
+    def test_wait_txt_propagation(self):
+        self.zone.add('example.com', '_acme-challenge', 'TXT', 'value', 600)
+        resolver.wait_txt_propagation('_acme-challenge.example.com', ['value'], [[self.server, UNREACHABLE]],
+                                      2, 0.1, 0.1)
+        with self.assertRaises(TimeoutError):
+            resolver.wait_txt_propagation('_acme-challenge.example.com', ['other'], [[self.server]], 0.3, 0.1, 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()